@@ -0,0 +1,58 @@
+'''
+RTEMConfig serialization cost, in microseconds per configuration.
+
+    python -m benchmarks.config_speed [--configs 2000]
+
+`encode` packs fresh configurations, `cached` encodes them again, `decode` parses their bytestream
+and `data file` writes the annotated data file.
+'''
+import argparse
+import io
+import random
+from time import perf_counter
+from typing import Callable
+
+from src.config import RTEMConfig
+
+
+def random_config(rng: random.Random) -> RTEMConfig:
+    return RTEMConfig(
+        state_offset=rng.getrandbits(8),
+        trans_offset=rng.getrandbits(8),
+        program_length_sub1=rng.getrandbits(8),
+        tick_length_sub1=rng.getrandbits(32),
+        clock_flags=rng.getrandbits(32),
+        clock_joins=rng.getrandbits(8),
+        clock_divider_immediate_values=tuple(rng.getrandbits(10) for _ in range(4)),
+        main_memory=bytearray(rng.randbytes(256)))
+
+
+def per_config(fn: Callable[[RTEMConfig], object], configs: list[RTEMConfig]) -> float:
+    start = perf_counter()
+    for config in configs:
+        fn(config)
+    return (perf_counter() - start) / len(configs) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--configs', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    configs = [random_config(rng) for _ in range(args.configs)]
+    streams = [config.to_bytestream() for config in configs]
+    for config in configs:
+        config.main_memory[0] ^= 1  # Invalidates the cached stream
+
+    print(f'{"encode":>10} {per_config(RTEMConfig.to_bytestream, configs):8.1f}us')
+    print(f'{"cached":>10} {per_config(RTEMConfig.to_bytestream, configs):8.1f}us')
+    start = perf_counter()
+    for stream in streams:
+        RTEMConfig.from_bytestream(stream)
+    print(f'{"decode":>10} {(perf_counter() - start) / len(streams) * 1e6:8.1f}us')
+    print(f'{"data file":>10} {per_config(lambda config: config.to_data_file(io.StringIO()), configs):8.1f}us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+'''
+Disassembly cost of complete images, in microseconds per image.
+
+    python -m benchmarks.disasm_speed [--images 200] [--repeat 5]
+
+The images are synthetic policies of 2 to 5 states, assembled with and without DO compression.
+Those that do not assemble (e.g. too many clock constraints) are skipped.
+'''
+import argparse
+from time import perf_counter
+
+from src.disassemble import SymbolNames, disassemble
+from src.main import RTEMAssembler
+from src.result import AssemblerResult
+
+from .synthetic import synthetic_source
+
+
+def synthetic_images(count: int) -> list[AssemblerResult]:
+    images = []
+    seed = 0
+    while len(images) < count:
+        nstates = 2 + seed % 4
+        try:
+            ass = RTEMAssembler('state_0', clocks=dict(vevent=0, v=5), compress=bool(seed % 2),
+                                inputs=dict(AS=28, VS=29, AP=30, VP=31))
+            ass.parse_source(synthetic_source(nstates, seed))
+            images.append(ass.resolve())
+        except (ValueError, AssertionError):
+            pass
+        seed += 1
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    images = synthetic_images(args.images)
+    size = sum(len(image.main_memory) for image in images) / len(images)
+    for label, names in (('named', None), ('anonymous', SymbolNames())):
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = perf_counter()
+            for image in images:
+                disassemble(image, names)
+            best = min(best, (perf_counter() - start) / len(images))
+        print(f'{label:>10} {best * 1e6:8.1f}us per image of {size:.0f} bytes')
+
+
+if __name__ == '__main__':
+    main()
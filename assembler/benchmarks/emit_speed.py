@@ -0,0 +1,83 @@
+'''
+Code emission cost on large synthetic sources: resolving the parsed code and packing it into bytes.
+
+    python -m benchmarks.emit_speed [--states 200 800] [--repeat 5]
+
+`bits` is the pipeline of the assembler, (value, width) integers packed into a bytearray.
+`strings` is the previous representation for comparison: every resolved line is formatted as a
+string of 1s and 0s, and the strings are concatenated into bytes and parsed with int(..., 2).
+Synthetic policies do not fit the hardware, so the symbols are numbered modulo 16 to keep every
+field in range.
+'''
+import argparse
+from time import perf_counter
+import tracemalloc
+from typing import Any, Callable
+
+from src.main import RTEMAssembler
+from src.tokens import R, UnresolvedCode, pack_code
+
+from .synthetic import CLOCKS, synthetic_source
+
+
+def bits_pipeline(lines: UnresolvedCode, symbols: dict[Any, int]) -> bytes:
+    return bytes(pack_code(line.resolve(symbols) if isinstance(line, R) else line for line in lines))
+
+
+def strings_pipeline(lines: UnresolvedCode, symbols: dict[Any, int]) -> bytes:
+    code = [str(line.resolve(symbols) if isinstance(line, R) else line) for line in lines]
+    out: list[int] = []
+    current_byte = ''
+    for line in code:
+        if len(line) + len(current_byte) > 8:
+            out.append(int(current_byte, 2))
+            current_byte = line
+        else:
+            current_byte = line + current_byte
+    out.append(int(current_byte, 2))
+    return bytes(out)
+
+
+def measure(fn: Callable[[UnresolvedCode, dict[Any, int]], bytes], lines: UnresolvedCode,
+            symbols: dict[Any, int], repeat: int) -> tuple[float, int, bytes]:
+    '''
+    Returns (best time, peak bytes allocated, output)
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        out = fn(lines, symbols)
+        best = min(best, perf_counter() - start)
+    tracemalloc.start()
+    fn(lines, symbols)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, nargs='+', default=[200, 800])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"states":>8} {"lines":>8} {"pipeline":>8} {"ms":>8} {"peak KiB":>9}')
+    for nstates in args.states:
+        ass = RTEMAssembler('state_0', clocks={clock: i for i, clock in enumerate(CLOCKS)})
+        ass.parse_source(synthetic_source(nstates))
+        lines = ass.data.lines_unresolved
+        symbols: dict[Any, int] = {}
+        for line in lines:
+            if isinstance(line, R):
+                for r in line.requests:
+                    symbols.setdefault(r, len(symbols) % 16)
+        outputs = []
+        for name, fn in (('strings', strings_pipeline), ('bits', bits_pipeline)):
+            seconds, peak, out = measure(fn, lines, symbols, args.repeat)
+            outputs.append(out)
+            print(f'{nstates:8} {len(lines):8} {name:>8} {seconds * 1000:8.2f} {peak / 1024:9.1f}')
+        assert outputs[0] == outputs[1]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''
+Parser throughput on large synthetic sources, in lines per second.
+
+    python -m benchmarks.parse_speed [--states 200 400 800] [--repeat 5] [--parser regex whole-file per-line]
+                                     [--ref 8c291d8]
+
+`regex` is the parser before the lexer, for comparison: the sections and parse states of the git
+ref `--ref` (the last commit with regular_tokenizer and getattr(Commands, ...) dispatch) are
+extracted from the repository and fed line by line, as its RTEMAssembler.parse_line did.
+`whole-file` lexes the source once (RTEMAssembler.parse_source), `per-line` lexes each line
+separately (RTEMAssembler.parse_line), both with the lexer of src/lexer.py.
+'''
+import argparse
+import importlib
+import io
+from pathlib import Path
+import subprocess
+import sys
+import tarfile
+import tempfile
+from time import perf_counter
+from types import ModuleType
+
+from src.main import RTEMAssembler
+
+from .synthetic import CLOCKS, synthetic_source
+
+BASELINE_REF = '8c291d8'
+'''Last commit parsing with regular expressions'''
+
+PARSERS = ('regex', 'whole-file', 'per-line')
+
+
+def load_baseline(ref: str, root: Path) -> ModuleType:
+    '''
+    Extracts src/ of `ref` into `root` as the package rtem_baseline, and returns its sections module.
+    The main module of the ref is left out, it assembles the pacemaker when imported.
+    '''
+    here = Path(__file__).resolve().parent.parent
+    archive = subprocess.run(['git', 'archive', '--format=tar', ref, 'src'],
+                             cwd=here, check=True, capture_output=True).stdout
+    package = root / 'rtem_baseline'
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        for member in tar.getmembers():
+            if member.isfile() and member.name.endswith('.py'):
+                path = package / Path(member.name).name
+                path.parent.mkdir(exist_ok=True)
+                path.write_bytes(tar.extractfile(member).read())  # type: ignore
+    sys.path.insert(0, str(root))
+    return importlib.import_module('rtem_baseline.sections')
+
+
+def parse_baseline(sections: ModuleType, source: str) -> float:
+    trace = importlib.import_module('rtem_baseline.trace')
+    tokens = importlib.import_module('rtem_baseline.tokens')
+    tracer = trace.Tracer()
+    data = sections.AssemblerState(
+        clock_map={tokens.RTEMClock(clock): i for i, clock in enumerate(CLOCKS)},
+        state_map={tokens.RTEMState('state_0'): 0},
+        tracer=tracer)
+    section = sections.EditSection(data)
+    start = perf_counter()
+    # The body of RTEMAssembler.parse_line at the ref
+    for line in source.split('\n'):
+        line_start = perf_counter()
+        data.current_line += 1
+        data.code.append(line)
+        tracer('parse', trace.Level.DEBUG, '%s', line)
+        parsed = section
+        section.parse_line(line)
+        if line.startswith('.'):
+            section = sections.Section.class_map[line.split()[0].removeprefix('.')](data)
+        elapsed = perf_counter() - line_start
+        tracer.add_time('parse', elapsed)
+        tracer.add_time(parsed.timing_key, elapsed)
+    return perf_counter() - start
+
+
+def parse(source: str, parser: str) -> float:
+    ass = RTEMAssembler('state_0', clocks={clock: i for i, clock in enumerate(CLOCKS)})
+    start = perf_counter()
+    if parser == 'whole-file':
+        ass.parse_source(source)
+    else:
+        for line in source.split('\n'):
+            ass.parse_line(line)
+    return perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, nargs='+', default=[200, 400, 800])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--parser', nargs='+', choices=PARSERS, default=list(PARSERS))
+    parser.add_argument('--ref', default=BASELINE_REF, help='git ref of the regex parser')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        sections = load_baseline(args.ref, Path(root)) if 'regex' in args.parser else None
+        print(f'{"states":>8} {"lines":>8} {"parser":>10} {"lines/s":>10}')
+        for nstates in args.states:
+            source = synthetic_source(nstates)
+            nlines = source.count('\n') + 1
+            # The parsers take turns, so that a slower stretch of the machine weighs on all of them
+            best = dict.fromkeys(args.parser, float('inf'))
+            for _ in range(args.repeat):
+                for name in args.parser:
+                    seconds = parse_baseline(sections, source) if name == 'regex' else parse(source, name)
+                    best[name] = min(best[name], seconds)
+            for name, seconds in best.items():
+                print(f'{nstates:8} {nlines:8} {name:>10} {nlines / seconds:10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''
+Startup cost of the assembler, in milliseconds of wall time for a fresh interpreter.
+
+    python -m benchmarks.startup [--repeat 10] [--importtime]
+
+Each case runs in its own process, the best of `repeat` runs is reported next to the cost of an
+interpreter that imports nothing. --importtime also prints the slowest modules of each case, from
+python -X importtime.
+'''
+import argparse
+import subprocess
+import sys
+from time import perf_counter
+
+CASES = {
+    'python': 'pass',
+    'import src': 'import src',
+    'import src.main': 'import src.main',
+    'RTEMAssembler': 'from src import RTEMAssembler',
+    'rtem-asm --help': 'import sys; sys.argv = ["rtem-asm", "--help"]; from src.cli import main; main()',
+}
+
+
+def run(code: str) -> float:
+    start = perf_counter()
+    subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.DEVNULL)
+    return perf_counter() - start
+
+
+def slowest_imports(code: str, n: int = 5) -> list[tuple[int, str]]:
+    '''
+    The `n` modules with the largest cumulative import time, in microseconds.
+    '''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], check=True,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    times = []
+    for line in proc.stderr.splitlines()[1:]:
+        _, _, cumulative, name = (part.strip() for part in line.replace(':', '|').split('|'))
+        times.append((int(cumulative), name))
+    return sorted(times, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--importtime', action='store_true')
+    args = parser.parse_args()
+
+    base = min(run(CASES['python']) for _ in range(args.repeat))
+    print(f'{"case":>16} {"ms":>8} {"+ms":>8}')
+    for name, code in CASES.items():
+        best = min(run(code) for _ in range(args.repeat))
+        print(f'{name:>16} {best * 1000:8.1f} {(best - base) * 1000:8.1f}')
+        if args.importtime and name != 'python':
+            for us, module in slowest_imports(code):
+                print(f'{"":>16} {us / 1000:8.1f} {module}')
+
+
+if __name__ == '__main__':
+    main()
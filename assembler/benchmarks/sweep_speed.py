@@ -0,0 +1,64 @@
+'''
+Parameter sweep throughput on the pacemaker example, in points per second.
+
+    python -m benchmarks.sweep_speed [--points 1000] [--jobs 1]
+
+`reparse` assembles the whole source for every point, `sweep` resolves the parsed policy again for
+every assignment of the constants (src.sweep).
+'''
+import argparse
+import itertools
+import re
+from time import perf_counter
+
+from src.main import RTEMAssembler
+from src.sweep import sweep
+
+SOURCE = 'examples/rtem/pacemaker.rtem'
+SETTINGS = dict(inputs=dict(AS=28, VS=29, AP=30, VP=31), clocks=dict(vevent=0, v=5))
+
+
+def grid(points: int) -> dict[str, list[int]]:
+    '''
+    Sweep of the four timing constants, with about `points` points that all differ in constants.
+    '''
+    side = max(1, round(points ** 0.25))
+    return {name: list(range(1, side + 1)) for name in ('aviTicks', 'aeiTicks', 'uriTicks', 'lriTicks')}
+
+
+def reparse(source: str, points: list[dict[str, int]]):
+    for point in points:
+        text = source
+        for name, value in point.items():
+            text = re.sub(rf'^{name}=\w+', f'{name}={value}', text, flags=re.M)
+        ass = RTEMAssembler('pre_ASAP', **SETTINGS)
+        ass.parse_source(text)
+        ass.resolve()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=1000)
+    parser.add_argument('--jobs', type=int, default=1)
+    args = parser.parse_args()
+
+    with open(SOURCE) as f:
+        source = f.read()
+    g = grid(args.points)
+    names = list(g)
+    points = [dict(zip(names, values)) for values in itertools.product(*g.values())]
+
+    start = perf_counter()
+    reparse(source, points)
+    reparse_time = perf_counter() - start
+    start = perf_counter()
+    rows = sweep(source, 'pre_ASAP', g, jobs=args.jobs, **SETTINGS)
+    sweep_time = perf_counter() - start
+
+    print(f'{len(points)} points, {sum(row.fits for row in rows)} fit')
+    print(f'{"reparse":>8} {len(points) / reparse_time:10.0f} points/s')
+    print(f'{"sweep":>8} {len(points) / sweep_time:10.0f} points/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+Synthetic RTEM sources for the benchmarks.
+
+The generated policies use every construct of the language (constants, clock constraints with
+extensions, NXT tables with resets, EDI/EDIT chains), but are not meant to fit the hardware: they
+may have any number of states, so only the parser can be benchmarked on them.
+'''
+import random
+
+CLOCKS = ('v', 'vevent')
+CONSTANTS = ('aviTicks', 'aeiTicks', 'uriTicks', 'lriTicks')
+INPUTS = ('AS', 'VS', 'AP', 'VP')
+EXTENSION_OPS = ('|', '!|', '|!', '!|!')
+
+
+def _operand(rng: random.Random) -> str:
+    if rng.random() < 0.4:
+        return f'{rng.choice(CLOCKS)}<{rng.choice(CONSTANTS)}'
+    return rng.choice(INPUTS)
+
+
+def _push(rng: random.Random) -> str:
+    ops = [_operand(rng)]
+    for _ in range(rng.randrange(4)):
+        ops += [rng.choice(EXTENSION_OPS), _operand(rng)]
+    return 'PSH ' + ' '.join(ops)
+
+
+def _transition(rng: random.Random, states: list[str]) -> str:
+    resets = rng.sample(CLOCKS, rng.randrange(len(CLOCKS) + 1))
+    return ' '.join([rng.choice(states)] + [f'{c}=0,' for c in resets]).rstrip(',')
+
+
+def synthetic_source(nstates: int, seed: int = 0) -> str:
+    '''
+    A policy with `nstates` states, of roughly 20 lines per state.
+    '''
+    rng = random.Random(seed)
+    states = [f'state_{i}' for i in range(nstates)]
+    lines = ['.Constants']
+    lines += [f'{name}={rng.randrange(1, 16)}' for name in CONSTANTS]
+
+    lines.append('.NextTrans')
+    for state in states:
+        n = rng.randrange(1, 4)
+        lines.append(f'{state}: # trans')
+        lines += [f'    {_push(rng)}' for _ in range(n)]
+        lines.append(f'    NXT 0 {n}  # table of {2**n} entries')
+        lines += [f'        {_transition(rng, states)}' for _ in range(2**n)]
+
+    lines.append('')
+    lines.append('.NextEdits')
+    for state in states:
+        lines.append(f'{state}: # edit')
+        for _ in range(rng.randrange(1, 3)):
+            lines.append(f'    {_push(rng)}')
+            lines.append(f'    EDI {rng.choice(("$0", "~$0", "True"))}')
+            outputs = rng.sample(INPUTS[2:], rng.randrange(1, 3))
+            for i, out in enumerate(outputs):
+                last = i == len(outputs) - 1
+                lines.append(f'        {out} = {rng.randrange(2)}{"" if last else ","}')
+        lines.append('    EDI True')
+        lines.append(f'        {rng.choice(INPUTS[2:])}=0 END')
+    return '\n'.join(lines)
@@ -0,0 +1,44 @@
+'''
+Assembler for the RTEM runtime enforcement processor.
+
+Importing the package does no I/O and loads no submodule: the names below are imported from their
+submodule on first use.
+'''
+import importlib
+
+_EXPORTS = {
+    'RTEMAssembler': 'main',
+    'AssemblerResult': 'result',
+    'RTEMConfig': 'config',
+    'Tracer': 'trace',
+    'Level': 'trace',
+    'BlockCache': 'incremental',
+    'BuildCache': 'build_cache',
+    'emit_artifacts': 'emit',
+    'make_config': 'emit',
+    'analyze': 'analysis',
+    'PolicySpec': 'manifest',
+    'load_manifest': 'manifest',
+    'assemble_batch': 'manifest',
+    'PolicySweep': 'sweep',
+    'sweep': 'sweep',
+    'RTEMObject': 'link',
+    'RTEMLinker': 'link',
+    'RTEMSimulator': 'simulator',
+    'BatchEvaluator': 'batch',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str) -> object:
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,120 @@
+'''
+Allocation of the 32 IN slots between inputs and clock constraints.
+
+A clock constraint in slot x is evaluated from MEM[x] (and MEM[x+1] for the high byte of a 12 bit
+constraint), so the constraints also define the clock constraint region at the start of memory.
+The high byte of a 12 bit constraint does not use IN[x+1], which may still hold an input.
+
+The constraints are placed to minimize the length of that region, avoiding slots fixed by the user.
+The remaining inputs then take the lowest free slots.
+'''
+from dataclasses import dataclass
+from functools import cache, lru_cache
+from typing import Mapping, Sequence
+
+from .tokens import Bits, Code, RTEMClockConstraint, RTEMInput, RTEMVar
+
+IN_SLOTS = 32
+
+
+@dataclass
+class SlotAllocation:
+    input_map: dict[RTEMInput, int]
+    clock_constraints: Code
+    '''Contents of the clock constraint region, MEM[0:len(clock_constraints)]'''
+
+
+def place_clock_constraints(sizes: Sequence[int], reserved: set[int]) -> tuple[list[int], int]:
+    '''
+    Chooses the slot of each constraint, given its size in bytes, such that no slot is reserved and
+    the region holding them is as short as possible. Among optimal placements, constraints are kept
+    in their original order where possible.
+
+    Returns the slot of each constraint and the length of the region.
+    '''
+    slots, length = _placement(tuple(sizes), frozenset(reserved))
+    return list(slots), length
+
+
+@lru_cache(maxsize=64)
+def _placement(sizes: tuple[int, ...], reserved: frozenset[int]) -> tuple[tuple[int, ...], int]:
+    '''
+    Memoized, as the placement only depends on the constraint sizes and not on their values: a
+    parameter sweep resolves the same policy many times.
+    '''
+    by_size = {size: [i for i, s in enumerate(sizes) if s == size] for size in (1, 2)}
+
+    @cache
+    def best(addr: int, i1: int, i2: int) -> tuple[int, tuple[int, ...]] | None:
+        '''(region length, choices) placing the remaining constraints from `addr`'''
+        if i1 == len(by_size[1]) and i2 == len(by_size[2]):
+            return addr, ()
+        if addr >= IN_SLOTS:
+            return None
+        candidates = []
+        if i1 < len(by_size[1]):
+            candidates.append((by_size[1][i1], 1))
+        if i2 < len(by_size[2]):
+            candidates.append((by_size[2][i2], 2))
+        options = []
+        if addr not in reserved:
+            for _, size in sorted(candidates):
+                options.append((size, best(addr + size, i1 + (size == 1), i2 + (size == 2))))
+        options.append((0, best(addr + 1, i1, i2)))
+        found = None
+        for size, res in options:
+            if res is not None and (found is None or res[0] < found[0]):
+                found = res[0], (size,) + res[1]
+        return found
+
+    res = best(0, 0, 0)
+    if res is None:
+        raise ValueError(
+            f'Cannot place {len(sizes)} clock constraints ({len(by_size[2])} of them 12 bit) in the '
+            f'{IN_SLOTS} IN slots, around the fixed inputs {sorted(reserved)}')
+
+    length, choices = res
+    slots = [0] * len(sizes)
+    remaining = {size: iter(ids) for size, ids in by_size.items()}
+    addr = 0
+    for size in choices:
+        if size:
+            slots[next(remaining[size])] = addr
+            addr += size
+        else:
+            addr += 1
+    return tuple(slots), length
+
+
+def allocate_slots(fixed: Mapping[RTEMInput, int],
+                   constraints: Mapping[RTEMClockConstraint, Code],
+                   unbound: Sequence[RTEMVar]) -> SlotAllocation:
+    '''
+    fixed: inputs with a slot chosen by the user
+    constraints: the encoding of each clock constraint, in order of first use
+    unbound: inputs to be given any free slot
+    '''
+    reserved = set(fixed.values())
+    if len(reserved) < len(fixed) or any(not 0 <= v < IN_SLOTS for v in reserved):
+        raise ValueError(f'Fixed inputs must use distinct slots in [0, {IN_SLOTS}): {dict(fixed)}')
+
+    slots, length = place_clock_constraints([len(code) for code in constraints.values()], reserved)
+    input_map: dict[RTEMInput, int] = dict(fixed)
+    region = [Bits(0, 8)] * length
+    for (constraint, code), slot in zip(constraints.items(), slots):
+        input_map[constraint] = slot
+        region[slot:slot + len(code)] = code
+
+    used = set(input_map.values())
+    free = (i for i in range(IN_SLOTS) if i not in used)
+    for var in unbound:
+        if var in input_map:
+            continue
+        slot = next(free, None)
+        if slot is None:
+            n = len(set(unbound) - set(fixed))
+            raise ValueError(
+                f'{n} unbound inputs do not fit in the {IN_SLOTS - len(used)} IN slots left by '
+                f'{len(fixed)} fixed inputs and {len(constraints)} clock constraints')
+        input_map[var] = slot
+    return SlotAllocation(input_map, region)
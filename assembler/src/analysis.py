@@ -0,0 +1,150 @@
+'''
+Static worst-case timing and stack depth analysis of an assembled image.
+
+Control flow within a state does not depend on the input values, so a single functional run of
+each machine per state (`isa.execute`) gives its exact number of steps, including DO replays. Each
+clock constraint read costs one extra step the first time it is read in a tick; the bound assumes
+the other machine never evaluated it first.
+
+Timing, relative to the start of the tick (see controller.v):
+- Both machines leave FINISH while do_setup is asserted (global clock 0 and 1). The edit machine
+  performs its B cycles on even clock cycles, the transition machine on odd clock cycles, so the
+  SETUP B cycle happens at clock 2 (edit) or 3 (transition), followed by INIT and one B cycle per
+  step.
+- The flush event at clock 2*program_length_sub1 + 1 latches the outputs and applies the clock
+  resets, so the edit machine must finish in an earlier cycle. The transition machine may execute
+  RST in the flush cycle itself, whose reset the clocks apply along with the latched ones
+  (reset_sync_combined in clocks_module.v). The final TRA only needs to complete before the next
+  tick's setup.
+- The flush must happen within the tick: tick_length_sub1 >= program_length_sub1.
+'''
+from dataclasses import dataclass
+
+from .config import RTEMConfig
+from .isa import MACHINES, STACK_LEN, Machine, execute, table_states
+from .result import AssemblerResult
+
+_FIRST_B_CYCLE: dict[Machine, int] = {'trans': 3, 'edit': 2}
+'''Clock cycle of the SETUP B cycle of each machine'''
+
+MAX_PROGRAM_LENGTH_SUB1 = 0xff
+'''cfg_prog_len is PROG_BITS (8) wide'''
+
+
+@dataclass
+class MachineTiming:
+    steps: int
+    '''A/B cycle pairs from INIT to the finishing instruction, including clock evaluation'''
+    last_cycle: int
+    '''Clock cycle of the final B cycle'''
+    earliest_flush: int
+    '''Earliest clock cycle of the flush: after the final edit B cycle, or at the RST B cycle'''
+    max_stack: int
+
+
+@dataclass
+class StateTiming:
+    state: int
+    trans: MachineTiming
+    edit: MachineTiming
+
+
+@dataclass
+class TimingAnalysis:
+    states: list[StateTiming]
+
+    @property
+    def last_cycle(self) -> int:
+        return max((max(s.trans.last_cycle, s.edit.last_cycle) for s in self.states), default=0)
+
+    @property
+    def earliest_flush(self) -> int:
+        return max((max(s.trans.earliest_flush, s.edit.earliest_flush) for s in self.states), default=0)
+
+    @property
+    def max_stack(self) -> int:
+        return max((max(s.trans.max_stack, s.edit.max_stack) for s in self.states), default=0)
+
+    @property
+    def program_length_sub1(self) -> int:
+        '''Minimal program length such that the flush happens no earlier than every machine allows'''
+        return self.earliest_flush // 2
+
+    @property
+    def tick_length_sub1(self) -> int:
+        '''Minimal tick length for the proposed program length'''
+        return max(self.program_length_sub1, self.last_cycle // 2)
+
+    def check(self, config: RTEMConfig) -> list[str]:
+        '''
+        Returns a description of every way in which `config` violates the analysed bounds.
+        '''
+        problems: list[str] = []
+        flush = 2 * config.program_length_sub1 + 1
+        period = 2 * (config.tick_length_sub1 + 1)
+        for s in self.states:
+            for machine in MACHINES:
+                timing: MachineTiming = getattr(s, machine)
+                if timing.earliest_flush > flush:
+                    problems.append(
+                        f'State {s.state}: {machine} machine needs the flush at cycle '
+                        f'{timing.earliest_flush} or later, not at cycle {flush}')
+                if timing.last_cycle >= period:
+                    problems.append(
+                        f'State {s.state}: {machine} machine finishes at cycle {timing.last_cycle}, '
+                        f'after the end of the {period} cycle tick')
+                if timing.max_stack > STACK_LEN:
+                    problems.append(
+                        f'State {s.state}: {machine} machine uses {timing.max_stack} stack entries, '
+                        f'only {STACK_LEN} are available')
+        if self.program_length_sub1 > MAX_PROGRAM_LENGTH_SUB1:
+            problems.append(f'No program length fits the earliest flush at cycle {self.earliest_flush}')
+        if config.tick_length_sub1 < config.program_length_sub1:
+            problems.append(
+                f'tick_length_sub1={config.tick_length_sub1} is shorter than '
+                f'program_length_sub1={config.program_length_sub1}')
+        return problems
+
+    def __str__(self) -> str:
+        lines = ['state | trans steps cycle stack | edit steps cycle stack']
+        for s in self.states:
+            lines.append(
+                f'{s.state:5} | {s.trans.steps:11} {s.trans.last_cycle:5} {s.trans.max_stack:5} '
+                f'| {s.edit.steps:10} {s.edit.last_cycle:5} {s.edit.max_stack:5}')
+        lines.append(f'program_length_sub1 >= {self.program_length_sub1}, '
+                     f'tick_length_sub1 >= {self.tick_length_sub1}, max stack {self.max_stack}/{STACK_LEN}')
+        return '\n'.join(lines)
+
+
+def analyze(config: RTEMConfig, states: list[int] | None = None) -> TimingAnalysis:
+    '''
+    Analyse every state of the image held by `config`. `states` lists the valid state ids, and
+    defaults to every state with a non-empty entry in the state address table.
+    '''
+    memory = list(config.main_memory) + [0] * (256 - len(config.main_memory))
+    if states is None:
+        states = table_states(memory, config.state_offset, config.trans_offset)
+
+    def timing(machine: Machine, state: int) -> MachineTiming:
+        run = execute(memory, machine, state, config.state_offset, config.trans_offset,
+                      clock_flags=config.clock_flags)
+        steps = run.steps + run.clock_steps
+        last_cycle = _FIRST_B_CYCLE[machine] + 2 * steps
+        # The transition machine always ends with TRA, one step after RST
+        earliest_flush = last_cycle - 2 if machine == 'trans' else last_cycle + 1
+        return MachineTiming(steps, last_cycle, earliest_flush, run.max_stack)
+
+    return TimingAnalysis([StateTiming(s, timing('trans', s), timing('edit', s)) for s in states])
+
+
+def analyze_result(result: AssemblerResult) -> TimingAnalysis:
+    config = RTEMConfig(
+        state_offset=result.state_offset,
+        trans_offset=result.trans_offset,
+        clock_flags=result.clock_flags,
+        clock_divider_immediate_values=(0, 0, 0, 0),
+        clock_joins=0,
+        program_length_sub1=0,
+        tick_length_sub1=0,
+        main_memory=result.main_memory)
+    return analyze(config, sorted(result.assembler_state.state_map.values()))
@@ -0,0 +1,246 @@
+'''
+Vectorised evaluation of a policy over many independent input traces.
+
+Each policy state is compiled into dense lookup tables, indexed by the state and by the packed
+values of the inputs (pins and clock constraints) the state actually reads. A batch of traces is
+then stepped with NumPy gathers, one tick at a time, with the clocks also kept per trace.
+
+The compiled tables describe one tick functionally: the machines are assumed to finish within
+the program length. Use `simulator.RTEMSimulator` where timing matters.
+'''
+from dataclasses import dataclass
+
+import numpy as np
+
+from .config import RTEMConfig
+from .isa import CLK_DECODE, Op, execute, table_states
+from .result import AssemblerResult
+
+MAX_STATE_INPUTS = 16
+'''Maximum number of distinct inputs a single state may read before its table gets too large'''
+
+_ZERO_COLUMN = 32
+'''Column of the IN matrix that is always 0, used to pad the per state read positions'''
+
+
+@dataclass
+class BatchResult:
+    states: np.ndarray
+    '''[batch, time] next state after each tick'''
+    outputs: np.ndarray
+    '''[batch, time] packed 32 bit outputs latched at each tick'''
+    violations: np.ndarray
+    '''[batch, time] whether the outputs differ from the (non clock) inputs'''
+    clocks: np.ndarray
+    '''[batch, 8] clock counters at the end of the run'''
+
+
+@dataclass
+class CompiledPolicy:
+    read_pos: np.ndarray
+    '''[state, K] IN address providing bit k of the table index of each state'''
+    next_state: np.ndarray
+    '''[state, 2**K]'''
+    resets: np.ndarray
+    '''[state, 2**K] clock reset masks'''
+    edit_mask: np.ndarray
+    '''[state, 2**K] outputs overridden by the edit machine'''
+    edit_values: np.ndarray
+    '''[state, 2**K]'''
+
+    clock_slots: np.ndarray
+    '''IN addresses holding clock constraints'''
+    clock_ops: np.ndarray
+    '''1 for equality, 0 for less than'''
+    clock_ids: np.ndarray
+    clock_imms: np.ndarray
+
+    clock_flags: int
+    clock_joins: int
+    divider_max: np.ndarray
+    initial_state: int = 0
+
+    @classmethod
+    def from_config(cls, config: RTEMConfig, states: list[int] | None = None) -> 'CompiledPolicy':
+        '''
+        Compile the policy held in the main memory of `config`. `states` lists the valid state ids,
+        and defaults to every state with a non-empty entry in the state address table.
+        '''
+        memory = list(config.main_memory) + [0] * (256 - len(config.main_memory))
+        if states is None:
+            states = table_states(memory, config.state_offset, config.trans_offset)
+
+        def run(machine, state, in_data):
+            return execute(memory, machine, state, config.state_offset, config.trans_offset, in_data)
+
+        # Find the inputs read by every state. Control flow within a state does not depend on
+        # the inputs, so a single run per machine is enough.
+        reads: dict[int, list[int]] = {}
+        for state in states:
+            mask = run('trans', state, 0).reads | run('edit', state, 0).reads
+            reads[state] = [i for i in range(32) if (mask >> i) & 1]
+            if len(reads[state]) > MAX_STATE_INPUTS:
+                raise ValueError(
+                    f'State {state} reads {len(reads[state])} inputs, at most {MAX_STATE_INPUTS} are supported')
+
+        k = max((len(r) for r in reads.values()), default=0)
+        read_pos = np.full((16, k), _ZERO_COLUMN, dtype=np.int64)
+        next_state = np.tile(np.arange(16, dtype=np.uint8)[:, None], (1, 2**k))
+        resets = np.zeros((16, 2**k), dtype=np.uint8)
+        edit_mask = np.zeros((16, 2**k), dtype=np.uint32)
+        edit_values = np.zeros((16, 2**k), dtype=np.uint32)
+
+        for state, positions in reads.items():
+            read_pos[state, :len(positions)] = positions
+            for idx in range(2**len(positions)):
+                in_data = 0
+                for bit, pos in enumerate(positions):
+                    in_data |= ((idx >> bit) & 1) << pos
+                tran = run('trans', state, in_data)
+                edit = run('edit', state, in_data)
+                # Unused high index bits always read the zero column, so only the low rows are hit.
+                next_state[state, idx] = tran.next_state
+                resets[state, idx] = tran.resets
+                edit_mask[state, idx] = edit.edit_mask
+                edit_values[state, idx] = edit.edit_values
+
+        slots = [i for i in range(32) if (config.clock_flags >> i) & 1]
+        ops, ids, imms = [], [], []
+        for slot in slots:
+            insn = CLK_DECODE[memory[slot]]
+            imm = insn.c
+            if insn.op == Op.CLK1:
+                imm |= memory[slot + 1] << 4
+            ops.append(insn.a)
+            ids.append(insn.b)
+            imms.append(imm)
+
+        return cls(
+            read_pos=read_pos,
+            next_state=next_state,
+            resets=resets,
+            edit_mask=edit_mask,
+            edit_values=edit_values,
+            clock_slots=np.array(slots, dtype=np.int64),
+            clock_ops=np.array(ops, dtype=bool),
+            clock_ids=np.array(ids, dtype=np.int64),
+            clock_imms=np.array(imms, dtype=np.int64),
+            clock_flags=config.clock_flags,
+            clock_joins=config.clock_joins,
+            divider_max=np.array(config.clock_divider_immediate_values, dtype=np.int64))
+
+    @classmethod
+    def from_result(cls, result: AssemblerResult,
+                    clock_divider_immediate_values: tuple[int, int, int, int] | None = None,
+                    clock_joins: int | None = None) -> 'CompiledPolicy':
+        # The clocks of the image by default, those of an assignment or 0
+        data = result.assembler_state
+        config = RTEMConfig(
+            state_offset=result.state_offset,
+            trans_offset=result.trans_offset,
+            clock_flags=result.clock_flags,
+            clock_divider_immediate_values=data.clock_divider_immediate_values
+            if clock_divider_immediate_values is None else clock_divider_immediate_values,
+            clock_joins=data.clock_joins if clock_joins is None else clock_joins,
+            program_length_sub1=0,
+            tick_length_sub1=0,
+            main_memory=result.main_memory)
+        return cls.from_config(config, sorted(result.assembler_state.state_map.values()))
+
+
+class BatchEvaluator:
+    '''
+    Steps a batch of independent traces through a compiled policy.
+    '''
+
+    def __init__(self, policy: CompiledPolicy, batch: int):
+        self.policy = policy
+        self.batch = batch
+        self.reset()
+
+    def reset(self):
+        self.state = np.full(self.batch, self.policy.initial_state, dtype=np.int64)
+        # Stored clock major, so that each clock is a contiguous vector
+        self.counters = np.zeros((8, self.batch), dtype=np.int64)
+        self.dividers = np.zeros((4, self.batch), dtype=np.int64)
+
+    def advance_clocks(self, resets: np.ndarray):
+        '''
+        Vectorised equivalent of `RTEMSimulator.advance_clocks`
+        '''
+        policy = self.policy
+        counters = self.counters
+        dividers = self.dividers
+        carry = np.zeros(self.batch, dtype=bool)
+        for j in range(8):
+            width_mask = 0xfff if j % 2 else 0xf
+            keep = 1 - ((resets >> j) & 1)
+            joined = (policy.clock_joins >> j) & 1
+            if j in (0, 1, 4, 5):
+                d = j if j < 4 else j - 2
+                divider = dividers[d]
+                divider_max = int(policy.divider_max[d])
+                divider_zero = divider == 0
+                inc = carry if joined else divider_zero
+                dividers[d] = np.where(
+                    divider_zero, divider_max,
+                    (divider * keep + divider_max * (1 - keep) - 1) & 0x3ff)
+            elif joined:
+                inc = carry
+            else:
+                inc = True
+            carry = (counters[j] == width_mask) & inc
+            counters[j] = (counters[j] * keep + inc) & width_mask
+
+    def run(self, inputs: np.ndarray) -> BatchResult:
+        '''
+        `inputs` is either a [batch, time, 32] array of input bits, or a [batch, time] array of
+        packed input words.
+        '''
+        policy = self.policy
+        if inputs.ndim == 3:
+            words = (inputs.astype(np.int64) << np.arange(32, dtype=np.int64)).sum(axis=-1)
+        else:
+            words = inputs.astype(np.int64) & 0xffffffff
+        batch, time = words.shape
+        assert batch == self.batch
+
+        k = policy.read_pos.shape[1]
+        read_pos = policy.read_pos.ravel()
+        next_state_table = policy.next_state.ravel().astype(np.int64)
+        resets_table = policy.resets.ravel().astype(np.int64)
+        edit_mask_table = policy.edit_mask.ravel().astype(np.int64)
+        edit_values_table = policy.edit_values.ravel().astype(np.int64)
+        non_clock = ~policy.clock_flags & 0xffffffff
+        clock_constraints = list(zip(
+            policy.clock_slots.tolist(), policy.clock_ops.tolist(),
+            policy.clock_ids.tolist(), policy.clock_imms.tolist()))
+
+        states = np.empty((batch, time), dtype=np.uint8)
+        outputs = np.empty((batch, time), dtype=np.uint32)
+        violations = np.empty((batch, time), dtype=bool)
+
+        for t in range(time):
+            word = words[:, t]
+            in_data = word & non_clock
+            for slot, op, clk, imm in clock_constraints:
+                clock = self.counters[clk]
+                in_data |= ((clock == imm) if op else (clock < imm)).astype(np.int64) << slot
+
+            state = self.state
+            row = state << k
+            idx = row.copy()
+            for bit in range(k):
+                idx |= ((in_data >> read_pos.take(state * k + bit)) & 1) << bit
+
+            edit_mask = edit_mask_table.take(idx)
+            out = (word & ~edit_mask) | (edit_values_table.take(idx) & edit_mask)
+
+            next_state = next_state_table.take(idx)
+            states[:, t] = next_state
+            outputs[:, t] = out
+            violations[:, t] = ((out ^ word) & non_clock) != 0
+            self.advance_clocks(resets_table.take(idx))
+            self.state = next_state
+
+        return BatchResult(states=states, outputs=outputs, violations=violations, clocks=self.counters.T.copy())
@@ -0,0 +1,156 @@
+'''
+Persistent, content addressed cache of assembled images and the artifacts emitted from them.
+
+An entry is keyed on everything the build depends on: the source text, the clocks/constants/inputs
+maps, the RTEMConfig parameters, the output paths, and the assembler itself (a hash of its sources).
+Outputs are only written when their bytes differ from the file on disk, so that an unchanged build
+does not touch files watched by downstream tools.
+
+Entries are evicted least recently used first (by modification time, refreshed on every hit) once
+the cache exceeds its size bound.
+'''
+from dataclasses import dataclass
+import dataclasses
+from functools import cache
+import copy
+import hashlib
+import json
+import os
+from pathlib import Path
+import pickle
+import tempfile
+from typing import Any
+
+from .result import AssemblerResult
+from .trace import Tracer
+
+CACHE_FORMAT = 1
+
+
+@cache
+def assembler_version() -> str:
+    '''
+    Hash of the assembler sources, so that any change to the assembler invalidates the cache.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    root = Path(__file__).parent
+    for path in sorted(root.rglob('*.py')):
+        digest.update(path.relative_to(root).as_posix().encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def build_key(**parts: Any) -> str:
+    '''
+    Key of a build depending on `parts`, which must have a stable repr or be JSON serializable.
+    '''
+    text = json.dumps({'format': CACHE_FORMAT, 'assembler': assembler_version(), **parts},
+                      sort_keys=True, default=repr)
+    return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+
+def portable_result(result: AssemblerResult) -> AssemblerResult:
+    '''
+    Copy of `result` that can be pickled. The unresolved lines hold closures, and are dropped.
+    '''
+    state = copy.copy(result.assembler_state)
+    state.lines_unresolved = []
+    state.tracer = Tracer()
+    return dataclasses.replace(result, assembler_state=state)
+
+
+@dataclass
+class BuildEntry:
+    result: AssemblerResult
+    artifacts: dict[str, bytes]
+    '''Contents of each output, by path'''
+
+
+def _umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def write_if_changed(path: str | Path, data: bytes) -> bool:
+    '''
+    Writes `data` to `path` unless the file already holds exactly these bytes. The file is replaced
+    atomically. Returns whether it was written.
+    '''
+    path = Path(path)
+    try:
+        stat = path.stat()
+        if stat.st_size == len(data) and path.read_bytes() == data:
+            return False
+        mode = stat.st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~_umask()
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        # mkstemp creates the file 0600, the replaced file keeps its mode as open() would
+        os.chmod(fd, mode)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return True
+
+
+@dataclass
+class BuildCache:
+    root: Path
+    max_bytes: int = 64 << 20
+    '''Size bound of the cache directory, enforced after every insertion'''
+
+    def __post_init__(self):
+        self.root = Path(self.root)
+
+    def path(self, key: str) -> Path:
+        return self.root / f'{key}.pickle'
+
+    def get(self, key: str) -> BuildEntry | None:
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Truncated or written by an incompatible version
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)
+        return entry
+
+    def put(self, key: str, entry: BuildEntry) -> BuildEntry:
+        '''
+        Stores `entry`, with a portable copy of its result. Returns the stored entry.
+        '''
+        entry = BuildEntry(portable_result(entry.result), dict(entry.artifacts))
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        if not write_if_changed(path, pickle.dumps(entry)):
+            os.utime(path)
+        self.evict()
+        return entry
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache fits in max_bytes. The most recent
+        entry is always kept.
+        '''
+        entries = []
+        for path in self.root.glob('*.pickle'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        entries.sort(reverse=True)
+        total = 0
+        for i, (_, size, path) in enumerate(entries):
+            total += size
+            if i and total > self.max_bytes:
+                path.unlink(missing_ok=True)
@@ -0,0 +1,226 @@
+'''
+Command line entry point of the assembler.
+
+    rtem-asm policy.rtem -s initial_state --maps maps.toml --data image.txt --xdc image.xdc
+    rtem-asm --manifest policies.toml [-j 8]
+    rtem-asm policy.rtem -s initial_state --maps maps.toml --object policy.rtemo
+    rtem-asm --link policy.rtemo [more.rtemo ...] --inputs pins.toml --data image.txt
+    rtem-asm --disassemble image.txt > policy.rtem
+
+The maps file holds the `clocks`, `inputs` and `constants` tables, and optionally the
+`initial_state` and the RTEMConfig parameters (`config`). Each table can also be given in a file of
+its own. Files ending in .toml are read as TOML, any other file as JSON. Unless configured, the
+program and tick lengths are the minimal ones found by the timing analysis.
+
+With --manifest, every policy of the manifest is assembled on a process pool (see manifest.py).
+With --object, the parsed source is also written as a relocatable object. --link links objects
+instead of assembling a source, the maps overriding the values the objects were parsed with (see
+link.py). --disassemble prints the source of a data file, preceded by the maps reassembling it.
+With --assign-clocks, the configured dividers set the rate of each clock, and the image is configured
+with the dividers and joins of the assignment (see clocks.py).
+'''
+import argparse
+import sys
+from time import perf_counter
+
+from .helpers import load_map
+
+MAPS = ('clocks', 'inputs', 'constants', 'config')
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='rtem-asm', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', nargs='?', help='RTEM assembly source')
+    parser.add_argument('-s', '--initial-state', help='State the policy starts in')
+    parser.add_argument('--maps', metavar='FILE',
+                        help='Table of the clocks, inputs, constants, config and initial_state')
+    for name in MAPS:
+        parser.add_argument(f'--{name}', metavar='FILE', help=f'Table of the {name}, overriding --maps')
+
+    outputs = parser.add_argument_group('outputs')
+    outputs.add_argument('--data', metavar='PATH', help='Simulation data file')
+    outputs.add_argument('--symbols', metavar='PATH', help='SystemVerilog symbol translation functions')
+    outputs.add_argument('--xdc', metavar='PATH', help='xdc constraints initialising the configuration')
+    outputs.add_argument('--listing', metavar='PATH', help='Listing of the image against the source')
+    outputs.add_argument('--coe', metavar='PATH', help='Xilinx coefficient file of the main memory')
+    outputs.add_argument('--mem', metavar='PATH', help='Memory file of the main memory, for updatemem')
+    outputs.add_argument('--hex', metavar='PATH', help='Intel HEX image of the main memory')
+    outputs.add_argument('--bin', metavar='PATH', help='Raw binary image of the main memory')
+    outputs.add_argument('--header', metavar='PATH', help='Raw binary of the configuration registers')
+    outputs.add_argument('--object', metavar='PATH', help='Relocatable object of the source')
+
+    batch = parser.add_argument_group('batch')
+    batch.add_argument('--manifest', metavar='FILE', help='Assemble every policy of a manifest instead of a source')
+    batch.add_argument('-j', '--jobs', type=int, help='Worker processes, defaults to the number of CPUs')
+    parser.add_argument('--link', metavar='OBJECT', nargs='+', help='Link relocatable objects instead of a source')
+    parser.add_argument('--disassemble', metavar='DATA', help='Print the source of a simulation data file')
+
+    parser.add_argument('--compress', action='store_true', help='Apply DO compression')
+    parser.add_argument('--minimize', action='store_true', help='Merge equivalent states')
+    parser.add_argument('--peephole', action='store_true', help='Apply the peephole rules to the code')
+    parser.add_argument('--jump-tables', action='store_true',
+                        help='Lay out the jump tables at their cheapest and renumber the transitions')
+    parser.add_argument('--assign-clocks', action='store_true',
+                        help='Merge equal clock constraints and assign the clocks of fewest constraint bytes')
+    parser.add_argument('--cache', metavar='DIR', help='Build cache directory')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='Print trace events (-v: info, -vv: debug) and phase timings')
+    return parser
+
+
+def run_manifest(args: argparse.Namespace) -> int:
+    from .manifest import PolicyOutcome, assemble_batch, load_manifest
+
+    try:
+        specs = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(f'rtem-asm: {e}', file=sys.stderr)
+        return 2
+
+    def report(outcome: PolicyOutcome):
+        if not outcome.ok:
+            print(f'{outcome.name}: {outcome.error}', file=sys.stderr)
+            return
+        for problem in outcome.warnings:
+            print(f'{outcome.name}: Warning: {problem}', file=sys.stderr)
+        if args.verbose:
+            phases = ' '.join(f'{phase}={seconds * 1000:.1f}ms' for phase, seconds in outcome.timings.items()
+                              if ':' not in phase)
+            print(f'{outcome.name}: {outcome.seconds * 1000:.1f}ms {phases}, wrote {len(outcome.written)}')
+
+    start = perf_counter()
+    outcomes = assemble_batch(specs, args.jobs, report)
+    failed = [outcome.name for outcome in outcomes if not outcome.ok]
+    print(f'{len(outcomes) - len(failed)}/{len(outcomes)} policies assembled in {perf_counter() - start:.2f}s'
+          + (f', failed: {", ".join(failed)}' if failed else ''))
+    return 1 if failed else 0
+
+
+def run_disassemble(args: argparse.Namespace) -> int:
+    import json
+
+    from .config import RTEMConfig
+    from .disassemble import disassemble
+
+    try:
+        dis = disassemble(RTEMConfig.from_data_file(args.disassemble))
+    except (OSError, ValueError) as e:
+        print(f'rtem-asm: {e}', file=sys.stderr)
+        return 1
+    print(f'# maps: {json.dumps(dis.settings())}')
+    print(dis.source, end='')
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.disassemble:
+        if args.source or args.link or args.manifest:
+            parser.error('--disassemble takes no other input')
+        return run_disassemble(args)
+    if args.manifest:
+        if args.source or args.link:
+            parser.error('a source or --link cannot be given with --manifest')
+        return run_manifest(args)
+    if args.link:
+        if args.source or args.object:
+            parser.error('a source or --object cannot be given with --link')
+        if args.minimize or args.peephole or args.jump_tables:
+            parser.error('objects are optimized when they are written, not when they are linked')
+    elif not args.source:
+        parser.error('a source, --link or --manifest is required')
+    # Imported after parsing the arguments, so that --help does not load the assembler
+    from .build_cache import BuildCache, BuildEntry, build_key, write_if_changed
+    from .emit import ARTIFACTS, CLOCK_FIELDS, emit_artifacts, fit_config, timing_problems
+    from .helpers import ParsingException
+    from .link import RTEMLinker, RTEMObject
+    from .main import RTEMAssembler
+    from .trace import Level, Tracer, print_event
+
+    try:
+        maps = load_map(args.maps) if args.maps else {}
+        for name in MAPS:
+            if path := getattr(args, name):
+                maps[name] = load_map(path)
+        if args.link:
+            objects = [RTEMObject.load(path) for path in args.link]
+        else:
+            with open(args.source) as f:
+                source = f.read()
+    except (OSError, ValueError) as e:
+        print(f'rtem-asm: {e}', file=sys.stderr)
+        return 2
+
+    initial_state = args.initial_state or maps.get('initial_state')
+    if initial_state is None and not args.link:
+        print('rtem-asm: no initial state, use --initial-state or set initial_state in the maps',
+              file=sys.stderr)
+        return 2
+    settings = dict(
+        initial_state=initial_state,
+        clocks=maps.get('clocks'),
+        inputs=maps.get('inputs'),
+        constants=maps.get('constants'),
+        compress=args.compress,
+        minimize=args.minimize,
+        peephole=args.peephole,
+        jump_tables=args.jump_tables,
+        assign_clocks=args.assign_clocks,
+    )
+    config_params = dict(maps.get('config', {}))
+    if 'clock_divider_immediate_values' in config_params:
+        config_params['clock_divider_immediate_values'] = tuple(config_params['clock_divider_immediate_values'])
+    if args.assign_clocks:
+        # The assignment starts from the configured clocks, and chooses those of the image
+        settings.update({name: config_params.pop(name) for name in CLOCK_FIELDS if name in config_params})
+    outputs = {artifact: getattr(args, artifact) for artifact in ARTIFACTS if getattr(args, artifact)}
+
+    name = args.source or ' '.join(args.link)
+    build_cache = BuildCache(args.cache) if args.cache else None
+    key = build_key(source=[obj.to_dict() for obj in objects] if args.link else source, settings=settings,
+                    config=config_params, outputs=outputs, object=args.object)
+    entry = build_cache.get(key) if build_cache else None
+    if entry is None:
+        tracer = Tracer()
+        if args.verbose:
+            tracer = Tracer.verbose(level=Level.DEBUG if args.verbose > 1 else Level.INFO)
+            tracer.sink = print_event
+        try:
+            if args.link:
+                del settings['minimize'], settings['peephole'], settings['jump_tables']
+                ass = RTEMLinker(objects, tracer=tracer, **settings)
+            else:
+                ass = RTEMAssembler(tracer=tracer, **settings)
+                ass.parse_source(source)
+                if args.object:
+                    obj = ass.to_object()
+            result = ass.resolve()
+        except (ParsingException, ValueError) as e:
+            print(f'{name}: {e}', file=sys.stderr)
+            return 1
+        if args.verbose:
+            for phase, timing in tracer.timings.items():
+                print(f'{phase:>16} {timing.calls:8} {timing.seconds * 1000:10.3f}ms')
+    else:
+        result = entry.result
+
+    config = fit_config(result, **config_params)
+    for problem in timing_problems(result, config):
+        print('Warning:', problem, file=sys.stderr)
+
+    if entry is None:
+        entry = BuildEntry(result, emit_artifacts(result, outputs, config))
+        if args.object:
+            entry.artifacts[args.object] = obj.to_json().encode()
+        if build_cache:
+            build_cache.put(key, entry)
+    for path, artifact in entry.artifacts.items():
+        if write_if_changed(path, artifact) and args.verbose:
+            print('Wrote', path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
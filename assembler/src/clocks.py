@@ -0,0 +1,169 @@
+'''
+Joint assignment of the logical clocks to the physical clocks, over canonical clock constraints.
+
+A constraint is canonical once its constant is resolved: `v<=c` is `v<c+1` and `v=c` is `v==c`.
+Constraints with the same canonical form share a slot, so the clock constraint region holds them
+once and a tick evaluates them once.
+
+The physical clocks 0, 2, 4 and 6 count to 15 and are compared by 1 byte constraints, the clocks 1,
+3, 5 and 7 count to 4095 and are compared by 2 byte constraints. Clocks 0, 1, 4 and 5 advance on
+their divider, the others on every flush. Bit j of clock_joins makes clock j count the carries of
+clock j-1, a wider counter compared through its high clock: `v<c` is `hi<c>>w` when the w bits of
+the low clock are zero in c.
+
+Each logical clock takes the placement of fewest constraint bytes that compares all its canonical
+constraints: a single clock, or a joined pair only where no single clock counts far enough. A
+clock keeps the rate of the clock it was mapped to, taking its divider along to another clock with a
+divider, unless it advances on every flush (no divider, or a divider of 0). Clocks compete for the
+4 bit ones, so the placements are searched jointly, and among the cheapest the fewest clocks move.
+
+As with a mapping by hand, a counter wraps past its width: a clock moved to a narrower counter must
+be reset before it wraps there. The low clock of a pair also carries into the high one in the
+flush resetting both (see simulator.advance_clocks).
+'''
+from dataclasses import dataclass
+from typing import Iterable, Sequence
+
+from .sections import AssemblerState
+from .tokens import Code, RTEMClock, RTEMClockConstraint, clock_constraint_code
+
+CLOCKS = 8
+
+DIVIDERS = {0: 0, 1: 1, 4: 2, 5: 3}
+'''Index in clock_divider_immediate_values of the divider of each divided clock'''
+
+Placement = tuple[int, ...]
+'''Physical clocks of a logical clock, lowest first: a single clock, or a pair joined into the high one'''
+
+PLACEMENTS: tuple[Placement, ...] = (*((c,) for c in range(CLOCKS)), *((c - 1, c) for c in range(1, CLOCKS)))
+
+
+def counter_bits(clock: int) -> int:
+    return 12 if clock % 2 else 4
+
+
+@dataclass
+class ClockAssignment:
+    placements: dict[RTEMClock, Placement]
+    clock_map: dict[RTEMClock, int]
+    '''Clock compared by the constraints of each logical clock, the high clock of a pair'''
+    clock_divider_immediate_values: tuple[int, int, int, int]
+    clock_joins: int
+    canonical: dict[RTEMClockConstraint, RTEMClockConstraint]
+    '''Constraint whose slot each constraint shares, the first of its canonical form'''
+    codes: dict[RTEMClockConstraint, Code]
+    '''Encoding of each constraint of `canonical`'s values, in order of first use'''
+    bytes: int = 0
+    '''Clock constraint bytes saved, before they are placed around the fixed inputs'''
+    cycles: int = 0
+    '''Clock constraint reads saved, summed over the blocks'''
+
+
+def compared(placement: Placement, op: int, imm: int) -> int | None:
+    '''
+    Immediate value comparing the high clock of `placement` for the canonical (op, imm), None if it
+    cannot be compared there
+    '''
+    shift = counter_bits(placement[0]) if len(placement) > 1 else 0
+    if shift and (op or imm % (1 << shift)):
+        return None
+    imm >>= shift
+    return imm if 0 <= imm < 1 << counter_bits(placement[-1]) else None
+
+
+def placement_cost(placement: Placement, forms: Sequence[tuple[int, int]]) -> int:
+    return len(forms) * (1 + placement[-1] % 2)
+
+
+def clock_options(clock: RTEMClock, forms: Sequence[tuple[int, int]], divided: bool,
+                  hand: int | None) -> list[Placement]:
+    '''
+    Placements comparing every form of `clock`, cheapest first and then its own clock. Raises
+    ValueError if there is none.
+    '''
+    options = [p for p in PLACEMENTS if (not divided or p[0] in DIVIDERS) and
+               all(compared(p, op, imm) is not None for op, imm in forms)]
+    options = [p for p in options if len(p) == 1] or options
+    if not options:
+        raise ValueError(f'No clock{" with a divider" if divided else ""} compares {clock} with '
+                         f'{", ".join(str(imm) for _, imm in forms)}')
+    return sorted(options, key=lambda p: (placement_cost(p, forms), p != (hand,), p))
+
+
+def search(options: dict[RTEMClock, list[Placement]], costs: dict[RTEMClock, dict[Placement, int]],
+           hand: dict[RTEMClock, int]) -> dict[RTEMClock, Placement]:
+    '''
+    The disjoint placements of fewest bytes, then of fewest clocks moved. Raises ValueError if the
+    clocks do not fit.
+    '''
+    order = sorted(options, key=lambda c: len(options[c]))
+    rest = [0] * (len(order) + 1)
+    for i in reversed(range(len(order))):
+        rest[i] = rest[i + 1] + costs[order[i]][options[order[i]][0]]
+    best: tuple[tuple[int, int], dict[RTEMClock, Placement]] | None = None
+    chosen: dict[RTEMClock, Placement] = {}
+
+    def visit(i: int, used: int, cost: int, moved: int):
+        nonlocal best
+        if best is not None and (cost + rest[i], moved) >= best[0]:
+            return
+        if i == len(order):
+            best = (cost, moved), dict(chosen)
+            return
+        clock = order[i]
+        for p in options[clock]:
+            mask = sum(1 << c for c in p)
+            if not used & mask:
+                chosen[clock] = p
+                visit(i + 1, used | mask, cost + costs[clock][p], moved + (p != (hand.get(clock),)))
+        chosen.pop(clock, None)
+
+    visit(0, 0, 0, 0)
+    if best is None:
+        raise ValueError(f'The clocks {", ".join(map(str, order))} do not fit the {CLOCKS} clocks')
+    return best[1]
+
+
+def assign_clocks(data: AssemblerState, reads: Iterable[Sequence[RTEMClockConstraint]] = ()) -> ClockAssignment:
+    '''
+    Assigns the clocks of the constraints and transitions of `data`, which keep the rates given by its
+    clock_map and clock_divider_immediate_values.
+    reads: the constraints read by each block, to count the reads saved
+    '''
+    if data.clock_joins:
+        raise ValueError(f'Clocks joined by hand (clock_joins={data.clock_joins:#x}) cannot be assigned')
+    constraints = [c for c in data.input_map if isinstance(c, RTEMClockConstraint)]
+    forms: dict[tuple[RTEMClock, int, int], RTEMClockConstraint] = {}
+    canonical = {c: forms.setdefault((c.clk, *c.canonical(data.constant_map)), c) for c in constraints}
+
+    resets = (r for t in data.trans_map for r in sorted(t.resets, key=lambda r: r.name))
+    clocks = list(dict.fromkeys([*data.clock_map, *(c.clk for c in constraints), *resets]))
+    compares = {clock: [(op, imm) for clk, op, imm in forms if clk == clock] for clock in clocks}
+    hand = {clock: data.clock_map[clock] for clock in clocks if clock in data.clock_map}
+    rate = {clock: data.clock_divider_immediate_values[DIVIDERS[hand[clock]]]
+            if hand.get(clock) in DIVIDERS else 0 for clock in clocks}
+    options = {clock: clock_options(clock, compares[clock], bool(rate[clock]), hand.get(clock))
+               for clock in clocks}
+    costs = {clock: {p: placement_cost(p, compares[clock]) for p in options[clock]} for clock in clocks}
+    placements = search(options, costs, hand)
+
+    dividers = list(data.clock_divider_immediate_values)
+    joins = 0
+    for clock, p in placements.items():
+        if p[0] in DIVIDERS:
+            dividers[DIVIDERS[p[0]]] = rate[clock]
+        if len(p) > 1:
+            joins |= 1 << p[-1]
+    codes = {c: clock_constraint_code(op, placements[clk][-1], compared(placements[clk], op, imm))  # type: ignore
+             for (clk, op, imm), c in forms.items()}
+
+    before = sum(1 + hand[c.clk] % 2 if c.clk in hand else len(codes[canonical[c]]) for c in constraints)
+    return ClockAssignment(
+        placements=placements,
+        clock_map={clock: p[-1] for clock, p in placements.items()},
+        clock_divider_immediate_values=tuple(dividers),  # type: ignore
+        clock_joins=joins,
+        canonical=canonical,
+        codes=codes,
+        bytes=before - sum(map(len, codes.values())),
+        cycles=sum(len(set(block)) - len({canonical[c] for c in block}) for block in reads))
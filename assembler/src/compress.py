@@ -0,0 +1,136 @@
+'''
+DO compression of the code section.
+
+`DO n addr` replays the n+1 bytes ending `addr` bytes before it, then returns to the byte after
+the DO. A run of 2 to 4 bytes can therefore be replaced by a single DO whenever the same bytes
+were emitted within the previous 15 bytes: the DO offset is 5 bits wide, so addr+n <= 14.
+
+A byte's meaning depends on the execution state (ES) it is read in, so a run is only replaced if:
+- It starts in STD (DO is only decoded in STD). The replay then follows the same ES sequence as
+  the original run, as it reads the same bytes.
+- It contains no NXT, TAB table, finishing EDI or DO byte, as these modify the jump counter or
+  leave the state's code.
+- No label points inside it.
+Clock constraint reads hold the jump counter while the constraint is evaluated, so PSH/ACC of a
+clock input may be replayed.
+'''
+from dataclasses import dataclass, field
+from typing import Mapping
+
+from .isa import DECODE, ES, Machine, Op
+from .tokens import ByteCode
+
+MAX_DO_DISTANCE = 15
+'''Maximum distance between the DO and the first byte it replays (addr + n + 1)'''
+MAX_DO_LENGTH = 4
+
+
+@dataclass
+class DOCompression:
+    code: ByteCode
+    address_map: list[int]
+    '''New address of each original byte. Every byte of a replaced run maps to its DO.'''
+    replaced: list[tuple[int, int, int]] = field(default_factory=list)
+    '''(DO address, source address, length) of each replaced run, in new addresses'''
+
+    @property
+    def saved(self) -> int:
+        return sum(length - 1 for _, _, length in self.replaced)
+
+    def remap_address(self, addr: int) -> int:
+        if addr >= len(self.address_map):
+            return addr - len(self.address_map) + len(self.code)
+        return self.address_map[addr]
+
+    def remap_bit(self, bit: int) -> int:
+        '''
+        Maps a bit position in the original code to the compressed code. Positions inside a replaced
+        run are moved to the end of its DO, so that ranges stay ordered and non-overlapping.
+        '''
+        addr, offset = divmod(bit, 8)
+        new_addr = self.remap_address(addr)
+        if 0 < addr < len(self.address_map) and self.address_map[addr - 1] == new_addr:
+            return 8 * new_addr + 8
+        return 8 * new_addr + offset
+
+
+def walk_code(code: ByteCode, entry_points: Mapping[int, Machine]) -> tuple[list[ES | None], list[bool]]:
+    '''
+    Linearly follows the code from every entry point (label), assuming it starts in STD.
+    Returns the ES each byte is read in (None if unreachable) and whether the byte may be part of
+    a replayed run.
+    '''
+    es_at: list[ES | None] = [None] * len(code)
+    replayable = [False] * len(code)
+    conflict = [False] * len(code)
+    for entry, machine in sorted(entry_points.items()):
+        decode_tables = DECODE[machine]
+        es = ES.STD
+        pc = entry
+        while pc < len(code):
+            if es_at[pc] is not None:
+                if es_at[pc] == es:
+                    break  # already followed from here
+                conflict[pc] = True
+            es_at[pc] = es
+            insn = decode_tables[es][code[pc]]
+            replayable[pc] = True
+            match insn.op:
+                case Op.PSH | Op.OP:
+                    es = ES.ACC if insn.a else ES.STD
+                case Op.VIO:
+                    es = ES.E_ACC if insn.a else ES.E_EDIT
+                case Op.ACC if es == ES.E_ACC:
+                    es = ES.E_ACC if insn.b else ES.E_EDIT
+                case Op.ACC:
+                    es = ES.ACC if insn.b else ES.STD
+                case Op.EDI if not insn.a:
+                    es = ES.E_EDIT if insn.c else ES.STD
+                case _:
+                    # NXT, DO or a finishing EDI
+                    replayable[pc] = False
+                    if insn.op != Op.DO:
+                        break
+            pc += 1
+    return es_at, [r and not c for r, c in zip(replayable, conflict)]
+
+
+def compress_code(code: ByteCode, entry_points: Mapping[int, Machine]) -> DOCompression:
+    '''
+    Greedily replaces the longest replayable run at each position with a DO.
+    `entry_points` maps each label address to the machine that executes it.
+    '''
+    es_at, replayable = walk_code(code, entry_points)
+    out: ByteCode = bytearray()
+    address_map: list[int] = []
+    replaced: list[tuple[int, int, int]] = []
+    i = 0
+    while i < len(code):
+        found = None
+        if es_at[i] == ES.STD:
+            for length in range(MAX_DO_LENGTH, 1, -1):
+                run = code[i:i + length]
+                if len(run) < length or not all(replayable[i:i + length]) \
+                        or any(j in entry_points for j in range(i + 1, i + length)):
+                    continue
+                p = len(out)
+                for src in range(max(0, p - MAX_DO_DISTANCE), p - length + 1):
+                    if out[src:src + length] == run:
+                        found = src, length
+                        break
+                if found:
+                    break
+        if found:
+            src, length = found
+            p = len(out)
+            n = length - 1
+            addr = p - 1 - src - n
+            out.append(0b1100_0000 | (n << 4) | addr)
+            address_map.extend([p] * length)
+            replaced.append((p, src, length))
+            i += length
+        else:
+            address_map.append(len(out))
+            out.append(code[i])
+            i += 1
+    return DOCompression(out, address_map, replaced)
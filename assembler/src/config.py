@@ -14,12 +14,106 @@ the RTEM.
 # 8: Clock Divider Immediate Values #10
 # 9: Clock Divider Immediate Values #10
 # 10: Main Memory #8x256
+from contextlib import contextmanager
 from dataclasses import dataclass, field
+from functools import lru_cache
 import itertools
-from typing import Annotated, Any, ClassVar, Sequence, get_origin
+from typing import IO, Annotated, Any, ClassVar, Iterator, Sequence, TextIO, get_args, get_origin
 import sys
+
+MEMORY_DEPTH = 256
+'''Bytes of the main memory (cfg_main_memory), the depth of a BRAM holding it'''
+
 # Fields are additionally annotated with the bit length
 
+_BIT_REVERSED = bytes(int(f'{i:08b}'[::-1], 2) for i in range(256))
+'''Translation table reversing the bit order of a byte'''
+_HEX_LINES = tuple(f'{byte:02x}\n' for byte in range(256))
+'''Line of the data file holding each byte'''
+
+
+@contextmanager
+def open_output(filename: None | str | IO, binary: bool = False) -> Iterator[IO]:
+    '''
+    Yields the file given by name or as an open file, which is only closed if it was opened here.
+    If filename is None, yields stdout.
+    '''
+    if filename is None:
+        yield sys.stdout.buffer if binary else sys.stdout
+    elif isinstance(filename, str):
+        with open(filename, 'wb' if binary else 'w') as file:
+            yield file
+    else:
+        yield filename
+
+
+class BitWriter:
+    '''
+    Packs fields LSB first into a preallocated buffer: the first bit written is bit 0 of byte 0.
+    '''
+
+    def __init__(self, nbits: int):
+        self.buffer = bytearray((nbits + 7) // 8)
+        self.pos = 0
+
+    def write(self, value: int, width: int):
+        if value >> width or value < 0:
+            raise ValueError(f'{value} does not fit in {width} bits')
+        pos = self.pos
+        self.pos += width
+        while width:
+            byte, bit = divmod(pos, 8)
+            n = min(8 - bit, width)
+            self.buffer[byte] |= (value & ((1 << n) - 1)) << bit
+            value >>= n
+            width -= n
+            pos += n
+
+    def write_bytes(self, data: Sequence[int]):
+        '''
+        Writes a run of 8 bit fields. When the writer is byte aligned, they are copied in one slice.
+        '''
+        if self.pos % 8:
+            for value in data:
+                self.write(value, 8)
+            return
+        start = self.pos // 8
+        self.buffer[start:start + len(data)] = bytes(data)
+        self.pos += 8 * len(data)
+
+
+class BitReader:
+    '''
+    Reads the fields written by a BitWriter.
+    '''
+
+    def __init__(self, data: bytes | bytearray | memoryview):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def read(self, width: int) -> int:
+        if self.pos + width > 8 * len(self.data):
+            raise ValueError(f'Reading {width} bits at bit {self.pos} of a {len(self.data)} byte stream')
+        value = 0
+        shift = 0
+        while width:
+            byte, bit = divmod(self.pos, 8)
+            n = min(8 - bit, width)
+            value |= (self.data[byte] >> bit & ((1 << n) - 1)) << shift
+            shift += n
+            width -= n
+            self.pos += n
+        return value
+
+    def read_bytes(self, count: int) -> bytearray:
+        if self.pos % 8:
+            return bytearray(self.read(8) for _ in range(count))
+        start = self.pos // 8
+        if start + count > len(self.data):
+            raise ValueError(f'Reading {count} bytes at byte {start} of a {len(self.data)} byte stream')
+        self.pos += 8 * count
+        return bytearray(self.data[start:start + count])
+
 
 @dataclass
 class RTEMConfigFieldMeta:
@@ -50,15 +144,14 @@ class RTEMConfig:
     # Cycle time - 1
     clock_divider_immediate_values: Annotated[tuple[int, int, int, int], RTEMConfigFieldMeta(
         10, 'genblk1[*].cfg_clk_div_imm_reg/scan_reg_reg')]
-    main_memory: Annotated[list[int], RTEMConfigFieldMeta(
+    main_memory: Annotated[Sequence[int], RTEMConfigFieldMeta(
         8, 'cfg_main_memory/memory_reg[*]')]
 
 
     config_root_cell: str = 'design_1_i/top_0/inst/cfg/'
     comments: dict[int, list[str]] = field(init=False)
-    '''
-    
-    '''
+    '''Names of the fields and sections starting at each byte of the bytestream'''
+
     @classmethod
     def get_meta(cls, field: str) -> RTEMConfigFieldMeta:
         return cls.__annotations__[field].__metadata__[0]
@@ -74,7 +167,15 @@ class RTEMConfig:
                 continue
             yield field_name
 
+    def __setattr__(self, name: str, value: Any):
+        super().__setattr__(name, value)
+        if name in _ENCODED_FIELDS and 'comments' in self.__dict__:
+            # The offsets and the memory length place the comments, and every field is encoded
+            self.__post_init__()
+
     def __post_init__(self):
+        self._bytestream: bytes | None = None
+        self._encoded_memory = b''
         size = 0
         comments = {}
         for field_name in self.iter_fields():
@@ -110,79 +211,209 @@ class RTEMConfig:
     def to_bytestream(self) -> bytes:
         '''
         Generates a bytestream from this object. Bit lengths of each field are
-        inferred from the annotation
+        inferred from the annotation. The fields are packed LSB first, and each byte of the stream
+        holds the next 8 bits of the packing, the first of them in bit 7.
+
+        The stream is cached until a field is assigned or main_memory is modified.
         '''
-        bytestream = ''
-        for field_name in self.iter_fields():
-            meta = self.get_meta(field_name)
-            bit_length = meta.reg_size
-            field_value = getattr(self, field_name)
-            if isinstance(field_value, Sequence):
-                for value in field_value:
-                    bytestream += format(value, f'0{bit_length}b')[::-1]
+        memory = bytes(self.main_memory)
+        if self._bytestream is not None and memory == self._encoded_memory:
+            return self._bytestream
+
+        nbits = sum(bit_length * (len(memory) if count is None else max(count, 1))
+                    for _, bit_length, count in _FIELD_LAYOUT)
+        writer = BitWriter(nbits)
+        for field_name, bit_length, count in _FIELD_LAYOUT:
+            if count == 0:
+                writer.write(getattr(self, field_name), bit_length)
+            elif field_name == 'main_memory':
+                writer.write_bytes(memory)
             else:
-                bytestream += format(field_value, f'0{bit_length}b')[::-1]
+                for value in getattr(self, field_name):
+                    writer.write(value, bit_length)
 
-        # Convert bytestream to bytes in chunks
-        byte_array = bytearray()
-        for i in range(0, len(bytestream), 8):
-            byte_array.append(int(bytestream[i:i+8], 2))
+        self._bytestream = bytes(writer.buffer.translate(_BIT_REVERSED))
+        self._encoded_memory = memory
+        return self._bytestream
 
-        return bytes(byte_array)
+    @classmethod
+    def from_bytestream(cls, data: bytes | bytearray | memoryview, **kwargs) -> 'RTEMConfig':
+        '''
+        Parses a bytestream generated by to_bytestream. main_memory takes the rest of the stream.
+        kwargs: the fields that are not encoded, e.g. config_root_cell
+        '''
+        reader = BitReader(bytes(data).translate(_BIT_REVERSED))
+        values: dict[str, Any] = {}
+        for field_name, bit_length, count in _FIELD_LAYOUT:
+            if count == 0:
+                values[field_name] = reader.read(bit_length)
+            elif count is not None:
+                values[field_name] = tuple(reader.read(bit_length) for _ in range(count))
+            elif bit_length == 8:
+                values[field_name] = reader.read_bytes(len(reader.data) - reader.pos // 8)
+            else:
+                values[field_name] = [reader.read(bit_length) for _ in range((8 * len(reader.data) - reader.pos) // bit_length)]
+        return cls(**values, **kwargs)
 
-    def to_data_file(self, filename: None | str = None):
+    @classmethod
+    def from_data_file(cls, filename: str, **kwargs) -> 'RTEMConfig':
         '''
-        Writes the bytestream to a verilog data file. If filename is None, the bytestream is printed
+        Parses a data file written by to_data_file, one hex byte per line, ignoring the comments.
         '''
+        with open(filename) as file:
+            lines = [line.split('//', 1)[0].strip() for line in file]
+        try:
+            return cls.from_bytestream(bytes(int(line, 16) for line in lines if line), **kwargs)
+        except ValueError as e:
+            raise ValueError(f'{filename} is not a data file: {e}') from None
 
-        if filename is None:
-            file = sys.stdout
-        else:
-            file = open(filename, 'w')
+    def to_data_file(self, filename: None | str | TextIO = None):
+        '''
+        Writes the bytestream to a verilog data file, given by name or as an open file. If filename is None,
+        the bytestream is printed
+        '''
         byte_array = self.to_bytestream()
-        for idx, byte in enumerate(byte_array):
-            if self.comments.get(idx) is not None:
-                file.write(f"{byte:02x} // {' '.join(self.comments[idx])}\n")
-            else:
-                file.write(f"{byte:02x}\n")
+        comments = self.comments
+        with open_output(filename) as file:
+            file.write(''.join(
+                f"{byte:02x} // {' '.join(comments[idx])}\n" if idx in comments else _HEX_LINES[byte]
+                for idx, byte in enumerate(byte_array)))
+
+    def header_bytestream(self) -> bytes:
+        '''
+        The configuration registers: the bytestream up to main_memory, in the bit order of the data file.
+        '''
+        return self.to_bytestream()[:_HEADER_BITS // 8]
+
+    def memory_image(self, depth: int = MEMORY_DEPTH) -> bytes:
+        '''
+        The main memory as a ROM holds it, byte i at address i, padded with zeros to `depth` bytes.
+        '''
+        if len(self.main_memory) > depth:
+            raise ValueError(f'The main memory holds {len(self.main_memory)} bytes, more than the depth of {depth}')
+        return bytes(self.main_memory) + bytes(depth - len(self.main_memory))
 
-        if filename is not None:
-            file.close()
+    def to_coe(self, filename: None | str | TextIO = None, depth: int = MEMORY_DEPTH):
+        '''
+        Writes the main memory as a Xilinx coefficient file, to initialize a block memory generator.
+        '''
+        image = self.memory_image(depth)
+        with open_output(filename) as file:
+            file.write(f'; RTEM main memory, {len(self.main_memory)} of {depth} bytes used\n'
+                       'memory_initialization_radix=16;\n'
+                       'memory_initialization_vector=\n')
+            file.write(',\n'.join(f'{byte:02x}' for byte in image) + ';\n')
+
+    def to_mem(self, filename: None | str | TextIO = None, depth: int = MEMORY_DEPTH, per_line: int = 16):
+        '''
+        Writes the main memory as a memory file, as read by updatemem and $readmemh.
+        '''
+        image = self.memory_image(depth)
+        with open_output(filename) as file:
+            file.write('@00000000\n')
+            file.write(''.join(image[i:i + per_line].hex(' ') + '\n' for i in range(0, depth, per_line)))
 
-    def to_xdc(self, filename: None | str = None):
+    def to_intel_hex(self, filename: None | str | TextIO = None, depth: int = MEMORY_DEPTH, per_record: int = 16):
         '''
-        Writes the bytestream to a xdc file. If filename is None, the bytestream is printed
+        Writes the main memory as Intel HEX data records, followed by the end of file record.
         '''
+        image = self.memory_image(depth)
+        with open_output(filename) as file:
+            for addr in range(0, depth, per_record):
+                record = bytes([min(per_record, depth - addr), addr >> 8 & 0xff, addr & 0xff, 0x00]) + \
+                    image[addr:addr + per_record]
+                checksum = -sum(record) & 0xff
+                file.write(f':{record.hex().upper()}{checksum:02X}\n')
+            file.write(':00000001FF\n')
 
-        if filename is None:
-            file = sys.stdout
+    def to_bin(self, filename: None | str | IO[bytes] = None, depth: int = MEMORY_DEPTH):
+        '''
+        Writes the main memory as raw bytes.
+        '''
+        with open_output(filename, binary=True) as file:
+            file.write(self.memory_image(depth))
+
+    def to_header(self, filename: None | str | IO[bytes] = None):
+        '''
+        Writes the configuration registers (header_bytestream) as raw bytes.
+        '''
+        with open_output(filename, binary=True) as file:
+            file.write(self.header_bytestream())
+
+    def to_xdc(self, filename: None | str | TextIO = None):
+        '''
+        Writes the INIT values of the configuration registers to a xdc file, given by name or as an
+        open file. If filename is None, the constraints are printed.
+        The cells of each register are set in at most two lines, one per INIT value, and every line
+        is written as soon as it is rendered.
+        '''
+
+        with open_output(filename) as file:
+            template = xdc_template(self.config_root_cell, len(self.main_memory))
+            file.write(template.keep)
+            memory = bytes(self.main_memory)
+            for field_name, bit_length, count in _FIELD_LAYOUT:
+                value = memory if field_name == 'main_memory' else getattr(self, field_name)
+                if count == 0:
+                    bits = [value >> i & 1 for i in range(bit_length)]
+                else:
+                    bits = [v >> i & 1 for v in value for i in range(bit_length)]
+                cells = template.cells[field_name]
+                if len(bits) != len(cells):
+                    raise ValueError(f'{field_name} has {len(bits)} bits, expected {len(cells)}')
+                for bit in (0, 1):
+                    selected = ' '.join(itertools.compress(cells, (b == bit for b in bits)))
+                    if selected:
+                        file.write(f"set_property INIT 1'b{bit} [get_cells {{{selected}}}]\n")
+
+
+@dataclass(frozen=True)
+class XdcTemplate:
+    '''
+    The cell paths of the xdc constraints, which only depend on the root cell and the memory length,
+    so that configurations only render their INIT values.
+    '''
+    keep: str
+    '''KEEP constraint of every register'''
+    cells: dict[str, tuple[str, ...]]
+    '''Cell of each bit of each field, in bytestream order'''
+
+
+@lru_cache(maxsize=16)
+def xdc_template(config_root_cell: str, memory_length: int) -> XdcTemplate:
+    keep = []
+    cells: dict[str, tuple[str, ...]] = {}
+    for field_name, bit_length, count in _FIELD_LAYOUT:
+        cell = RTEMConfig.get_meta(field_name).cell
+        keep.append(f'set_property KEEP 1 [get_cells {config_root_cell}{cell}[*]]\n')
+        if count == 0:
+            cells[field_name] = tuple(f'{config_root_cell}{cell}[{bit}]' for bit in range(bit_length))
         else:
-            file = open(filename, 'w')
+            cells[field_name] = tuple(f'{config_root_cell}{cell.replace("*", str(idx))}[{bit}]'
+                                      for idx in range(memory_length if count is None else count)
+                                      for bit in range(bit_length))
+    return XdcTemplate(''.join(keep), cells)
 
-        def init_line(bit, cell):
-            return [f"set_property INIT 1'b{bit} [get_cells {self.config_root_cell + cell}]"]
-    
-        # keep constraints
-        lines = []
-        for field_name in self.iter_fields():
-            meta = self.get_meta(field_name)
-            lines.append(f'set_property KEEP 1 [get_cells {self.config_root_cell}{meta.cell}[*]]')
-            
-        for field_name in self.iter_fields():
-            meta = self.get_meta(field_name)
-            field_value = getattr(self, field_name)
-            
-            if isinstance(field_value, Sequence):
-                for idx, value in enumerate(field_value):
-                    for idx2, bit in enumerate(reversed(f"{{:0{meta.reg_size}b}}".format(value))):
-                        lines.extend(init_line(int(bit), meta.cell.replace('*', str(idx)) + f'[{idx2}]'))
 
-            else:
-                for idx, bit in enumerate(reversed(f"{{:0{meta.reg_size}b}}".format(field_value))):
-                    lines.extend(init_line(int(bit), meta.cell + f'[{idx}]'))
+def _field_layout(field_name: str) -> tuple[str, int, int | None]:
+    value_type = get_args(RTEMConfig.__annotations__[field_name])[0]
+    if value_type is int:
+        count = 0
+    elif get_origin(value_type) is tuple:
+        count = len(get_args(value_type))
+    else:
+        count = None
+    return field_name, RTEMConfig.get_meta(field_name).reg_size, count
+
+
+_FIELD_LAYOUT = tuple(_field_layout(field_name) for field_name in RTEMConfig.iter_fields())
+'''(field, bit length, number of values) of each encoded field, in order. The number of values is 0
+for an int, and None for a list of any length (main_memory, at the end of the stream)'''
+_ENCODED_FIELDS = frozenset(RTEMConfig.iter_fields())
+_HEADER_BITS = sum(bit_length * max(count, 1) for _, bit_length, count in _FIELD_LAYOUT if count is not None)
+'''Bits of the registers preceding main_memory in the bytestream'''
 
-        file.write("\n".join(lines))
-                    
 
-RTEMConfig(8, 13, 124, 45662, 0b00110011001100110011001100110011, 0b00110011, (0b0000000000,
-           0b0000000000, 0b0000000000, 0b0000000000), [0b0010101]*256).to_data_file('test.hex')
+if __name__ == '__main__':
+    RTEMConfig(8, 13, 124, 45662, 0b00110011001100110011001100110011, 0b00110011, (0b0000000000,
+               0b0000000000, 0b0000000000, 0b0000000000), [0b0010101]*256).to_data_file('test.hex')
@@ -0,0 +1,230 @@
+'''
+Disassembler: main memory back to RTEM assembly source.
+
+The code of every state in the state address table is followed from its entry point, each byte
+being decoded with the decode table of the ES it is read in (isa.DECODE), as the machine would run
+it. DO replays are followed and written out in full, so compressed images disassemble too.
+Transitions are recovered from the tables around trans_offset, and the clock constraints from the
+clock constraint region (the inputs set in clock_flags).
+
+Blocks are written in the order of their code, so that reassembling the source with the returned
+maps numbers states, transitions and clock constraints as in the image and reproduces it. Names
+are taken from SymbolNames where known, otherwise made up from ids: s<id> for states, in<slot>
+for inputs, clk<id> for clocks and k<value> for clock constraint immediates (k<value>_<slot> when
+an equal constraint is in another slot).
+'''
+from dataclasses import dataclass, field
+from typing import Sequence
+
+from .config import RTEMConfig
+from .isa import CLK_DECODE, DECODE, ES, Machine, Op, table_states
+from .result import AssemblerResult
+from .tokens import RTEMClockConstraint, RTEMVar
+
+MAX_STEPS = 256
+'''Bytes read from an entry point before the code is considered not to finish'''
+
+EXTENSION_NAMES = ('|', '!|', '|!', '!|!')
+'''Extension operators by ACC op (see states.EXTENSION_OPS)'''
+
+OP2_NAMES: dict[int, str] = {
+    0b1111: 'T', 0b0000: 'F', 0b0101: '[0]', 0b1010: '[1]', 0b1110: '|', 0b1000: '&', 0b0010: '>',
+    0b0100: '<', 0b0001: '!|', 0b0111: '!&', 0b1101: '!>', 0b1011: '!<', 0b1001: '!^', 0b0110: '^',
+}
+'''OP2 mnemonic of each LUT (see states.Commands.OP2.op_map)'''
+
+EDI_EXPRS: tuple[str, ...] = (
+    'False', '~$0 & ~$1', '$0 & ~$1', '~$1', '~$0 & $1', '~$0', '$0 ^ $1', '~($0 & $1)',
+    '$0 & $1', '~($0 ^ $1)', '$0', '~(~$0 & $1)', '$1', '~($0 & ~$1)', '~(~$0 & ~$1)', 'True',
+)
+'''
+Stack logic expression of each EDI LUT, where bit i is the value for $0 = i & 1, $1 = i & 2.
+They do not use |, which would end the expression at an extension operator.
+'''
+
+
+@dataclass
+class SymbolNames:
+    states: dict[int, str] = field(default_factory=dict)
+    inputs: dict[int, str] = field(default_factory=dict)
+    '''Name of the input, or text of the clock constraint, in each IN slot'''
+    clocks: dict[int, str] = field(default_factory=dict)
+    constants: dict[str, int] = field(default_factory=dict)
+    '''Constants named by the clock constraints of `inputs`, all of them written to the source'''
+
+    @classmethod
+    def from_result(cls, result: AssemblerResult) -> 'SymbolNames':
+        data = result.assembler_state
+        inputs = {}
+        for symbol, slot in result.final_input_map.items():
+            if isinstance(symbol, RTEMClockConstraint):
+                # A joined clock is compared through its high clock, with the immediate shifted
+                if not (data.clock_joins >> data.clock_map.get(symbol.clk, 0)) & 1:
+                    inputs[slot] = f'{symbol.clk}{symbol.op}{symbol.imm}'
+            elif isinstance(symbol, RTEMVar):
+                inputs[slot] = symbol.name
+        return cls(
+            states={v: k.name for k, v in data.state_map.items()},
+            inputs=inputs,
+            clocks={v: k.name for k, v in data.clock_map.items()},
+            constants={k.name: v for k, v in data.constant_map.items()})
+
+
+@dataclass
+class Disassembly:
+    source: str
+    initial_state: str
+    clocks: dict[str, int]
+    inputs: dict[str, int]
+    '''Slot of every input that is not a clock constraint'''
+
+    def settings(self) -> dict[str, object]:
+        '''
+        Arguments of RTEMAssembler reassembling the source.
+        '''
+        return dict(initial_state=self.initial_state, clocks=self.clocks, inputs=self.inputs)
+
+
+class _Disassembler:
+    def __init__(self, memory: Sequence[int], trans_offset: int, clock_flags: int, names: SymbolNames):
+        self.memory = memory
+        self.trans_offset = trans_offset
+        self.clock_flags = clock_flags
+        self.names = names
+        self.clocks: dict[str, int] = {}
+        self.inputs: dict[str, int] = {}
+        self.constants: dict[str, int] = dict(names.constants)
+        self.constraint_slots: dict[tuple[int, int, int], int] = {}
+        '''First slot of each (op, clock, immediate)'''
+
+    def byte(self, addr: int) -> int:
+        if not 0 <= addr < len(self.memory):
+            raise ValueError(f'Address {addr} is outside the {len(self.memory)} bytes of main memory')
+        return self.memory[addr]
+
+    def clock(self, clk: int) -> str:
+        name = self.names.clocks.get(clk, f'clk{clk}')
+        self.clocks[name] = clk
+        return name
+
+    def state(self, state: int) -> str:
+        return self.names.states.get(state, f's{state}')
+
+    def input(self, slot: int) -> str:
+        if not (self.clock_flags >> slot) & 1:
+            name = self.names.inputs.get(slot, f'in{slot}')
+            self.inputs[name] = slot
+            return name
+        # A clock constraint: the instruction in the clock constraint region at MEM[slot]
+        insn = CLK_DECODE[self.byte(slot)]
+        imm = insn.c | (self.byte(slot + 1) << 4 if insn.op == Op.CLK1 else 0)
+        clock = self.clock(insn.b)
+        if slot in self.names.inputs:
+            return self.names.inputs[slot]
+        # Equal constraints in several slots get a constant each, or they would share a slot
+        first = self.constraint_slots.setdefault((insn.a, insn.b, imm), slot)
+        constant = f'k{imm}' if first == slot else f'k{imm}_{slot}'
+        self.constants[constant] = imm
+        return f'{clock}{"==" if insn.a else "<"}{constant}'
+
+    def transition(self, trans: int) -> str:
+        states = self.byte(self.trans_offset - 1 - (trans >> 1))
+        state = states >> 4 if trans & 1 else states & 0xf
+        resets = self.byte(self.trans_offset + trans)
+        clocks = ', '.join(f'{self.clock(clk)}=0' for clk in range(8) if (resets >> clk) & 1)
+        return f'{self.state(state)} {clocks}' if clocks else self.state(state)
+
+    def block(self, machine: Machine, pc: int) -> list[str]:
+        '''
+        Source lines of the code starting at `pc`, up to the instruction finishing the state.
+        '''
+        tables = DECODE[machine]
+        lines: list[str] = []
+        es = ES.STD
+        jc = ra = 0
+        line = ''
+        for _ in range(MAX_STEPS):
+            byte = self.byte(pc)
+            insn = tables[es][byte]
+            new_pc = pc + 1
+            if jc:
+                jc -= 1
+                if jc == 1:
+                    # The last byte of a DO replay, the machine then returns after the DO
+                    new_pc = ra
+            match insn.op:
+                case Op.DO:
+                    offset = ((0x10 | (~insn.b & 0xf)) + (0x1c | (~insn.a & 0b11))) & 0x1f
+                    ra = pc + 1
+                    new_pc = pc + 1 + (offset - 0x20 if offset & 0x10 else offset)
+                    jc = insn.a + 2
+                case Op.PSH:
+                    line = f'PSH {self.input(insn.b)}'
+                    es = ES.ACC if insn.a else ES.STD
+                case Op.ACC:
+                    line += f' {EXTENSION_NAMES[insn.a]} {self.input(insn.c)}'
+                    if es == ES.E_ACC:
+                        es = ES.E_ACC if insn.b else ES.E_EDIT
+                    else:
+                        es = ES.ACC if insn.b else ES.STD
+                case Op.OP:
+                    if insn.c not in OP2_NAMES:
+                        raise ValueError(f'OP2 has no mnemonic for LUT {insn.c:04b}, at {pc}')
+                    line = f'OP2 {OP2_NAMES[insn.c]}' + ' pop' * insn.b
+                    es = ES.ACC if insn.a else ES.STD
+                case Op.VIO:
+                    line = 'EDI ' + 'pop ' * insn.b + EDI_EXPRS[insn.c]
+                    es = ES.E_ACC if insn.a else ES.E_EDIT
+                case Op.EDI:
+                    line = f'    {self.input(insn.d)}={insn.b}' + ' END' * insn.a + ',' * insn.c
+                    es = ES.E_EDIT if insn.c else ES.STD
+                case Op.NXT1:
+                    lines.append(f'NXT {self.transition(insn.a)}')
+                    return lines
+                case Op.NXT2:
+                    count = insn.b
+                    if not count or count & (count - 1):
+                        raise ValueError(f'NXT jump table of {count} entries at {pc}, expected a power of 2')
+                    lines.append(f'NXT {insn.a} {count.bit_length() - 1}')
+                    for i in range(count):
+                        entry = self.byte(pc + 1 + i // 2)
+                        lines.append('    ' + self.transition(insn.a << 4 | (entry >> 4 if i & 1 else entry & 0xf)))
+                    return lines
+                case _:
+                    raise ValueError(f'Byte {byte:08b} at {pc} is not an instruction of the {machine} machine in {es.name}')
+            # A line is complete once its extensions are read
+            if insn.op != Op.DO and es not in (ES.ACC, ES.E_ACC):
+                lines.append(line)
+                if insn.op == Op.EDI and insn.a:
+                    return lines
+            pc = new_pc
+        raise ValueError(f'The code at {pc} did not finish within {MAX_STEPS} bytes')
+
+
+def disassemble(image: RTEMConfig | AssemblerResult, names: SymbolNames | None = None) -> Disassembly:
+    '''
+    Disassembles the main memory of `image`. The names of an AssemblerResult are used unless
+    `names` is given.
+    '''
+    if names is None:
+        names = SymbolNames.from_result(image) if isinstance(image, AssemblerResult) else SymbolNames()
+    memory = image.main_memory
+    dis = _Disassembler(memory, image.trans_offset, image.clock_flags, names)
+    blocks: list[tuple[int, Machine, int]] = []
+    for state in table_states(memory, image.state_offset, image.trans_offset):
+        for machine, entry in zip(('trans', 'edit'), (0, 1)):
+            blocks.append((image.trans_offset + memory[image.state_offset + 2 * state + entry], machine, state))
+    blocks.sort()
+
+    lines: list[str] = []
+    section = None
+    for addr, machine, state in blocks:
+        if machine != section:
+            section = machine
+            lines.append('.NextTrans' if machine == 'trans' else '.NextEdits')
+        lines.append(f'{dis.state(state)}:')
+        lines.extend('    ' + line for line in dis.block(machine, addr))
+
+    constants = [f'{name}={value}' for name, value in dis.constants.items()]
+    source = '\n'.join((['.Constants', *constants] if constants else []) + lines) + '\n'
+    return Disassembly(source, dis.state(0), dis.clocks, dis.inputs)
@@ -0,0 +1,148 @@
+'''
+Artifacts emitted from an assembled image: the simulation data file, the SystemVerilog symbol
+translation functions, the xdc constraints initialising the configuration registers, the listing of
+the image against the source, and the block memory images of the main memory.
+
+The memory images (coe, mem, hex, bin) hold only the main memory, and the header only the
+configuration registers, so that a policy can be patched into the block memory of an implemented
+design (e.g. with updatemem) without synthesising it again.
+'''
+import io
+from typing import Any, Literal, Mapping
+
+from .analysis import analyze
+from .config import RTEMConfig
+from .result import AssemblerResult
+
+Artifact = Literal['data', 'symbols', 'xdc', 'listing', 'coe', 'mem', 'hex', 'bin', 'header']
+ARTIFACTS: tuple[Artifact, ...] = ('data', 'symbols', 'xdc', 'listing', 'coe', 'mem', 'hex', 'bin', 'header')
+
+CLOCK_FIELDS = ('clock_divider_immediate_values', 'clock_joins')
+'''RTEMConfig fields that assign_clocks starts from, and chooses for the image'''
+
+
+def verilog_translate_symbols(name: str, bit_len: int, map: dict[Any, int], file=None):
+    tab = '    '
+    print(f'function string {name}(input [{bit_len-1}:0] bits);', file=file)
+    print(f'{tab}case(bits)', file=file)
+    for k, v in map.items():
+        print(f"{tab}{tab}{bit_len}'d{v}: {name} = \"{k}\";", file=file)
+    print(f"{tab}{tab}default: {name} = $sformatf(\"<UNRECOGNIZED %d>\", bits);", file=file)
+    print(f'{tab}endcase', file=file)
+    print('endfunction', file=file)
+
+
+def verilog_translate_ids(name: str, bit_len: int, map: dict[Any, int], file=None):
+    tab = '    '
+    print(f'function [{bit_len-1}:0] {name}(input string symbol);', file=file)
+    print(f'{tab}case(symbol)', file=file)
+    for v, k in map.items():
+        print(f"{tab}{tab}\"{v}\": {name} = {bit_len}'d{k};", file=file)
+    print(f"{tab}{tab}default: {name} = {{{bit_len}{{1'bx}}}};", file=file)
+    print(f'{tab}endcase', file=file)
+    print('endfunction', file=file)
+
+
+def verilog_set_defines(map: dict[str, int], prefix: str = "", file=None):
+    for k, v in map.items():
+        print(f'`define {prefix}{k} {v}', file=file)
+
+
+def make_config(result: AssemblerResult, **params) -> RTEMConfig:
+    '''
+    Configuration of the image in `result`. params: the remaining RTEMConfig fields, the clock
+    dividers and joins defaulting to those of the image. Raises ValueError if they differ from the
+    assigned clocks of the image.
+    '''
+    data = result.assembler_state
+    image = {name: getattr(data, name) for name in CLOCK_FIELDS}
+    if data.clocks_assigned:
+        for name, value in image.items():
+            if name in params and params[name] != value:
+                raise ValueError(f'{name}={params[name]} differs from the assigned clocks, which use {value}')
+    params = image | params
+    return RTEMConfig(
+        state_offset=result.state_offset,
+        trans_offset=result.trans_offset,
+        clock_flags=result.clock_flags,
+        main_memory=result.main_memory,
+        **params)
+
+
+def fit_config(result: AssemblerResult, **params) -> RTEMConfig:
+    '''
+    Configuration of the image in `result`, where the missing program and tick lengths are the
+    minimal ones found by the timing analysis. The clock dividers and joins default to those of the
+    image, 0 unless its clocks were assigned.
+    '''
+    if 'program_length_sub1' not in params or 'tick_length_sub1' not in params:
+        minimal = analyze(make_config(result, **params | dict(program_length_sub1=0, tick_length_sub1=0)),
+                          sorted(result.assembler_state.state_map.values()))
+        params.setdefault('program_length_sub1', minimal.program_length_sub1)
+        params.setdefault('tick_length_sub1', minimal.tick_length_sub1)
+    return make_config(result, **params)
+
+
+def timing_problems(result: AssemblerResult, config: RTEMConfig) -> list[str]:
+    return analyze(config, sorted(result.assembler_state.state_map.values())).check(config)
+
+
+def render_symbols(result: AssemblerResult, config: RTEMConfig) -> str:
+    data = result.assembler_state
+    symbol_translation_file = io.StringIO()
+    verilog_set_defines({
+        "TICK_LENGTH": config.tick_length_sub1 + 1,
+        "TICK_LENGTH_NS": (config.tick_length_sub1 + 1)*20,
+        "PROGRAM_LENGTH": config.program_length_sub1 + 1
+    }, file=symbol_translation_file)
+
+    verilog_translate_symbols('get_input_symbol', 5,
+                              result.final_input_map, file=symbol_translation_file)
+    verilog_translate_symbols('get_clock_symbol', 3,
+                              data.clock_map, file=symbol_translation_file)
+    verilog_translate_symbols('get_imm_symbol', 12,
+                              data.constant_map, file=symbol_translation_file)
+    verilog_translate_symbols('get_trans_symbol', 5,
+                              data.trans_map, file=symbol_translation_file)
+    verilog_translate_symbols('get_state_symbol', 4,
+                              data.state_map, file=symbol_translation_file)
+    verilog_translate_ids('get_input_id', 5, result.final_input_map, file=symbol_translation_file)
+    return symbol_translation_file.getvalue()
+
+
+def render(artifact: Artifact, result: AssemblerResult, config: RTEMConfig) -> bytes:
+    file = io.StringIO()
+    match artifact:
+        case 'data':
+            config.to_data_file(file)
+        case 'symbols':
+            file.write(render_symbols(result, config))
+        case 'xdc':
+            config.to_xdc(file)
+        case 'listing':
+            file.write(result.print_corresponence() + '\n')
+        case 'coe':
+            config.to_coe(file)
+        case 'mem':
+            config.to_mem(file)
+        case 'hex':
+            config.to_intel_hex(file)
+        case 'bin':
+            return config.memory_image()
+        case 'header':
+            return config.header_bytestream()
+        case _:
+            raise ValueError(f'Unknown artifact {artifact}, expected one of {", ".join(ARTIFACTS)}')
+    return file.getvalue().encode()
+
+
+def emit_artifacts(result: AssemblerResult, outputs: Mapping[Artifact, str], config: RTEMConfig,
+                   configs: Mapping[Artifact, RTEMConfig] | None = None) -> dict[str, bytes]:
+    '''
+    Renders the selected artifacts.
+    outputs: path of each artifact to render
+    configs: configuration used for specific artifacts instead of `config`
+    Returns the contents of each output, by path.
+    '''
+    configs = configs or {}
+    return {path: render(artifact, result, configs.get(artifact, config)) for artifact, path in outputs.items()}
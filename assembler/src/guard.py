@@ -0,0 +1,483 @@
+'''
+Guard compiler: boolean expressions over inputs, synthesized into PSH/OP2/ACC sequences.
+
+    GRD (VS | VP) & !v<aviTicks
+
+pushes the value of the expression as one stack entry, like a hand-written PSH chain. Expressions
+are made of inputs, clock constraints, True and False, the operators ! (or ~), &, ^ and |, in
+decreasing order of precedence, and parentheses. They are parsed without eval, as are the stack
+logic expressions of EDI, which keep the precedence of the Python expressions they used to be
+evaluated as (see EDI_OPS).
+
+A guard is reduced to its truth table over the inputs it depends on, and the cheapest program for
+the table is searched among:
+- PSH x for an input, OP2 T or OP2 F for a constant
+- g | l, where l is an input or its negation and g (or !g) does not read it: the program of g
+  extended by one ACC
+- L(a, b), where a and b read disjoint inputs: the programs of a and b, then OP2 L pop
+- (!x | f1) & (x | f0), where f1 and f0 are f for x = 1 and x = 0 (Shannon expansion)
+- the minimal sum of products of f or !f (Quine-McCluskey): the programs of its products or'ed
+  by OP2 pop, and its single inputs by ACC
+Every ACC and OP2 LUT absorbs negations, so the programs of subexpressions are found for whichever
+polarity is cheaper. Programs are ranked by bytes, then stack depth. Each byte is one step, and
+each clock constraint costs one more step to evaluate, so the cheapest program in bytes is also the
+cheapest in cycles. Every program is checked against the truth table by running it.
+'''
+from dataclasses import dataclass
+from functools import cache
+from itertools import combinations
+from typing import Callable, Hashable, NamedTuple, Sequence
+
+from .helpers import ParsingException
+from .isa import Op, acc_eval, lut_eval
+from .lexer import Token, TokenKind, source_text
+from .tokens import RTEMClockConstraint
+
+MAX_GUARD_INPUTS = 8
+'''Inputs a guard may depend on, its truth table has 2**MAX_GUARD_INPUTS bits'''
+
+MAX_DECOMPOSE_INPUTS = 6
+'''Inputs up to which disjoint decompositions and Shannon expansions are searched'''
+
+Expr = tuple
+'''Parsed expression: ('var', index), ('const', value), ('!', x), or (op, x, y) for op in &^|'''
+
+BINARY_OPS = ('|', '^', '&')
+'''Binary operators of guards, in increasing order of precedence'''
+
+EDI_OPS = ('|', '&', '!', '^')
+'''
+Operators of EDI stack logic expressions, in increasing order of precedence: those of | as or, & as
+and, ! and ~ as not, and ^, so that !$0 ^ $1 is !($0 ^ $1) and $0 & $1 ^ $1 is $0 & ($1 ^ $1)
+'''
+
+
+class GuardStep(NamedTuple):
+    op: Op
+    '''Op.PSH, Op.ACC or Op.OP'''
+    arg: int
+    '''Index of the input (PSH, ACC), or the LUT (OP)'''
+    mode: int = 0
+    '''Extension operator (ACC, see states.EXTENSION_OPS), or pop (OP)'''
+
+
+Program = tuple[GuardStep, ...]
+
+
+@dataclass
+class GuardProgram:
+    inputs: list[Hashable]
+    '''Inputs of the guard, indexed by the steps'''
+    table: int
+    '''Truth table, bit m being the value for input i = (m >> i) & 1'''
+    steps: Program
+
+    @property
+    def bytes(self) -> int:
+        return len(self.steps)
+
+    @property
+    def cycles(self) -> int:
+        '''
+        Steps to run the program, evaluating each clock constraint it reads
+        '''
+        clocks = {s.arg for s in self.steps if s.op != Op.OP and isinstance(self.inputs[s.arg], RTEMClockConstraint)}
+        return len(self.steps) + len(clocks)
+
+    @property
+    def depth(self) -> int:
+        return program_depth(self.steps)
+
+
+def parse_expr(toks: Sequence[Token],
+               leaf: Callable[[Token], Hashable | bool],
+               variables: dict[Hashable, int],
+               ops: Sequence[str] = BINARY_OPS) -> Expr:
+    '''
+    Parses a boolean expression. `leaf` converts the tokens of operands to a variable, or a bool
+    for a constant; variables are numbered in `variables` as they are first read.
+    ops: the operators in increasing order of precedence, ! among them if it binds looser than an
+    operand
+    '''
+    items: list[tuple[str, Token]] = []
+    for tok in toks:
+        if tok.kind is TokenKind.OP:
+            # Operators are lexed in runs, such as the !| of a | !b
+            items.extend((c, tok) for c in tok.text)
+        elif tok.kind is TokenKind.PAREN:
+            items.append((tok.text, tok))
+        else:
+            items.append(('', tok))
+    pos = 0
+
+    def error(msg: str) -> ParsingException:
+        where = f' at {items[pos][1].where}' if pos < len(items) else ''
+        return ParsingException(None, source_text(list(toks)), msg + where)
+
+    def binary(level: int) -> Expr:
+        nonlocal pos
+        if level == len(ops):
+            return unary()
+        if ops[level] == '!':
+            if pos < len(items) and items[pos][0] in ('!', '~'):
+                pos += 1
+                return ('!', binary(level))
+            return binary(level + 1)
+        expr = binary(level + 1)
+        while pos < len(items) and items[pos][0] == ops[level]:
+            pos += 1
+            expr = (ops[level], expr, binary(level + 1))
+        return expr
+
+    def unary() -> Expr:
+        nonlocal pos
+        if pos == len(items):
+            raise error('Expected an operand')
+        op, tok = items[pos]
+        pos += 1
+        if op in ('!', '~'):
+            return ('!', unary())
+        if op == '(':
+            expr = binary(0)
+            if pos == len(items) or items[pos][0] != ')':
+                raise error('Expected )')
+            pos += 1
+            return expr
+        if op:
+            pos -= 1
+            raise error(f'Unexpected {op}')
+        if tok.kind is TokenKind.NAME and tok.text in ('True', 'False'):
+            return ('const', tok.text == 'True')
+        var = leaf(tok)
+        if isinstance(var, bool):
+            return ('const', var)
+        return ('var', variables.setdefault(var, len(variables)))
+
+    expr = binary(0)
+    if pos < len(items):
+        raise error(f'Unexpected {items[pos][1].text}')
+    return expr
+
+
+def variable_table(i: int, n: int) -> int:
+    '''
+    Truth table of input i among n
+    '''
+    half = 1 << i
+    block = ((1 << half) - 1) << half
+    return sum(block << k for k in range(0, 1 << n, 2 * half))
+
+
+def truth_table(expr: Expr, n: int) -> int:
+    '''
+    Truth table of `expr` over n inputs
+    '''
+    full = (1 << (1 << n)) - 1
+    match expr:
+        case ('var', i):
+            return variable_table(i, n)
+        case ('const', value):
+            return full if value else 0
+        case ('!', x):
+            return full ^ truth_table(x, n)
+        case ('&', x, y):
+            return truth_table(x, n) & truth_table(y, n)
+        case ('^', x, y):
+            return truth_table(x, n) ^ truth_table(y, n)
+        case ('|', x, y):
+            return truth_table(x, n) | truth_table(y, n)
+    raise ValueError(f'Not an expression: {expr!r}')
+
+
+def program_depth(steps: Program) -> int:
+    '''
+    Largest number of stack entries the program pushes at once
+    '''
+    depth = high = 0
+    for step in steps:
+        if step.op == Op.PSH or (step.op == Op.OP and not step.mode):
+            depth += 1
+        elif step.op == Op.OP:
+            depth -= 1
+        high = max(high, depth)
+    return high
+
+
+def run_program(steps: Program, values: int, stack: Sequence[int] = ()) -> list[int]:
+    '''
+    Stack left by the program, top first, when input i has value (values >> i) & 1 and the
+    program starts on `stack`. Follows isa.execute.
+    '''
+    stack = list(stack)
+    for step in steps:
+        match step.op:
+            case Op.PSH:
+                stack.insert(0, (values >> step.arg) & 1)
+            case Op.ACC:
+                stack[0] = acc_eval(step.mode, stack[0], (values >> step.arg) & 1)
+            case Op.OP:
+                res = lut_eval(step.arg, (stack[1] << 1 if len(stack) > 1 else 0) | (stack[0] if stack else 0))
+                if step.mode:
+                    stack[:2] = [res]
+                else:
+                    stack.insert(0, res)
+    return stack
+
+
+def prime_implicants(table: int, n: int, care: int) -> list[tuple[int, int]]:
+    '''
+    Prime implicants (mask, value) of `table` over the inputs set in `care`: minterm m is covered
+    when m & mask == value.
+    '''
+    cubes = {(care, m) for m in range(1 << n) if not m & ~care and (table >> m) & 1}
+    primes = set()
+    while cubes:
+        merged = set()
+        used = set()
+        for mask, value in cubes:
+            for i in range(n):
+                bit = 1 << i
+                if mask & bit and not value & bit and (mask, value | bit) in cubes:
+                    merged.add((mask & ~bit, value))
+                    used.add((mask, value))
+                    used.add((mask, value | bit))
+        primes |= cubes - used
+        cubes = merged
+    return sorted(primes, key=lambda c: (-bin(~c[0] & care).count('1'), c))
+
+
+def cube_table(cube: tuple[int, int], n: int) -> int:
+    mask, value = cube
+    return sum(1 << m for m in range(1 << n) if m & mask == value)
+
+
+def minimal_cover(table: int, n: int, care: int) -> list[int]:
+    '''
+    Tables of the cubes of a minimal sum of products of `table`: the essential prime implicants,
+    then greedily the prime covering the most remaining minterms.
+    '''
+    primes = [cube_table(c, n) for c in prime_implicants(table, n, care)]
+    cover = []
+    left = table
+    for m in range(1 << n):
+        if (left >> m) & 1:
+            covering = [p for p in primes if (p >> m) & 1]
+            if len(covering) == 1:
+                cover.append(covering[0])
+                left &= ~covering[0]
+    while left:
+        best = max(primes, key=lambda p: bin(p & left).count('1'))
+        cover.append(best)
+        left &= ~best
+    return cover
+
+
+class _Synthesis:
+    '''
+    Search for the cheapest programs of the truth tables over n inputs
+    '''
+
+    def __init__(self, n: int):
+        self.n = n
+        self.full = (1 << (1 << n)) - 1
+        self.vars = [variable_table(i, n) for i in range(n)]
+        self.programs: dict[int, Program | None] = {}
+        '''Cheapest program of each table, None while it is being searched'''
+
+    def cofactor(self, table: int, i: int, value: int) -> int:
+        '''
+        Table with input i fixed to value
+        '''
+        shift = 1 << i
+        if value:
+            half = table & self.vars[i]
+            return half | half >> shift
+        half = table & ~self.vars[i] & self.full
+        return half | half << shift
+
+    def support(self, table: int) -> list[int]:
+        return [i for i in range(self.n) if self.cofactor(table, i, 0) != self.cofactor(table, i, 1)]
+
+    def support_mask(self, table: int) -> int:
+        return sum(1 << i for i in self.support(table))
+
+    def literals(self, table: int) -> int:
+        return len(self.support(table))
+
+    @staticmethod
+    def cost(steps: Program) -> tuple[int, int]:
+        return len(steps), program_depth(steps)
+
+    def best(self, table: int) -> Program | None:
+        '''
+        Cheapest program pushing `table`
+        '''
+        if table in self.programs:
+            return self.programs[table]
+        # Searches reaching the table again from within give up on it
+        self.programs[table] = None
+        steps = None
+        bound = len(self.support(table)), 1
+        for candidate in self.candidates(table):
+            if steps is None or self.cost(candidate) < self.cost(steps):
+                steps = candidate
+            # Every input is read at least once
+            if self.cost(steps) <= bound:
+                break
+        else:
+            # Sums of products read an input for each of their literals
+            for neg in (0, 1):
+                cover = minimal_cover(table ^ (self.full if neg else 0), self.n, self.support_mask(table))
+                if len(cover) > 1 and (steps is None or sum(map(self.literals, cover)) < len(steps)):
+                    candidate = self.sum_of_products(cover, neg)
+                    if candidate is not None and (steps is None or self.cost(candidate) < self.cost(steps)):
+                        steps = candidate
+        self.programs[table] = steps
+        return steps
+
+    def either(self, table: int) -> tuple[Program, int] | None:
+        '''
+        Cheapest program pushing `table` or its negation, and whether it is negated
+        '''
+        options = [(steps, neg) for neg in (0, 1)
+                   if (steps := self.best(table ^ (self.full if neg else 0))) is not None]
+        return min(options, key=lambda o: self.cost(o[0])) if options else None
+
+    def combine(self, a: int, b: int, fn: Callable[[int, int], int]):
+        '''
+        Programs pushing fn(a, b) by OP2 pop
+        '''
+        pa, pb = self.either(a), self.either(b)
+        if pa is None or pb is None:
+            return
+        (sa, na), (sb, nb) = pa, pb
+        # Either operand may be pushed first, it then is $1
+        yield sa + sb + (GuardStep(Op.OP, sum(fn(i >> 1 ^ na, i & 1 ^ nb) << i for i in range(4)), 1),)
+        yield sb + sa + (GuardStep(Op.OP, sum(fn(i & 1 ^ na, i >> 1 ^ nb) << i for i in range(4)), 1),)
+
+    def candidates(self, table: int):
+        if table in (0, self.full):
+            yield (GuardStep(Op.OP, 0b1111 if table else 0b0000),)
+            return
+        if table in self.vars:
+            yield (GuardStep(Op.PSH, self.vars.index(table)),)
+            return
+        support = self.support(table)
+
+        # f = g | l
+        for i in support:
+            for value in (0, 1):
+                if self.cofactor(table, i, value) == self.full:
+                    rest = self.either(self.cofactor(table, i, 1 - value))
+                    if rest is not None:
+                        steps, neg = rest
+                        yield steps + (GuardStep(Op.ACC, i, (1 - value) << 1 | neg),)
+
+        # f = L(a, b), a and b reading disjoint inputs, a reading one or two for wide tables
+        small = len(support) <= MAX_DECOMPOSE_INPUTS
+        if small:
+            firsts = [(support[0], *first) for size in range(1, len(support))
+                      for first in combinations(support[1:], size - 1)]
+        else:
+            firsts = [*combinations(support, 1), *combinations(support, 2)]
+        for first in firsts:
+            decomposition = self.decompose(table, support, first)
+            if decomposition is not None:
+                yield from self.combine(*decomposition)
+
+        # f = (!x | f1) & (x | f0), expanding around an input, the first one for wide tables
+        for i in support if small else support[:1]:
+            high, low = self.either(self.cofactor(table, i, 1)), self.either(self.cofactor(table, i, 0))
+            if high is not None and low is not None:
+                a = high[0] + (GuardStep(Op.ACC, i, 0b10 | high[1]),)
+                b = low[0] + (GuardStep(Op.ACC, i, low[1]),)
+                yield a + b + (GuardStep(Op.OP, 0b1000, 1),)
+                yield b + a + (GuardStep(Op.OP, 0b1000, 1),)
+
+    def sum_of_products(self, cover: list[int], neg: int) -> Program | None:
+        '''
+        Program pushing the sum of the cubes of `cover`, negated if `neg`: single inputs are or'ed
+        by ACC to the first product, the other products pushed and or'ed by OP2 pop, the last of
+        which negates.
+        '''
+        literals = [c for c in cover if self.literals(c) == 1]
+        products = [c for c in cover if self.literals(c) > 1]
+        # One product to extend, and one more for the OP2 negating
+        while len(products) < 1 + neg:
+            products.append(literals.pop())
+        items = [self.either(c) for c in products]
+        if None in items:
+            return None
+        # The deepest product first, the others are pushed above it
+        items.sort(key=lambda item: -program_depth(item[0]))  # type: ignore
+        steps, acc_neg = items[0]  # type: ignore
+        for literal in literals:
+            i = self.support(literal)[0]
+            steps += (GuardStep(Op.ACC, i, int(literal != self.vars[i]) << 1 | acc_neg),)
+            acc_neg = 0
+        for i, (item, item_neg) in enumerate(items[1:], 2):  # type: ignore
+            last = neg if i == len(items) else 0
+            lut = sum(((((j >> 1) ^ acc_neg) | ((j & 1) ^ item_neg)) ^ last) << j for j in range(4))
+            steps += item + (GuardStep(Op.OP, lut, 1),)
+            acc_neg = 0
+        return steps
+
+    def decompose(self, table: int, support: list[int], first: tuple[int, ...]):
+        '''
+        (a, b, L) with table = L(a, b), a reading the inputs `first` and b the rest of the support,
+        if there are such a and b
+        '''
+        first_mask = sum(1 << i for i in first)
+        second_mask = sum(1 << i for i in support) & ~first_mask
+        rows = [m for m in range(1 << self.n) if not m & ~first_mask]
+        cols = [m for m in range(1 << self.n) if not m & ~second_mask]
+        patterns: dict[tuple[int, ...], int] = {}
+        a_of = {}
+        for r in rows:
+            pattern = tuple((table >> (r | c)) & 1 for c in cols)
+            if pattern not in patterns and len(patterns) == 2:
+                return None
+            a_of[r] = patterns.setdefault(pattern, len(patterns))
+        if len(patterns) != 2:
+            return None
+        p0, p1 = patterns
+        pairs: dict[tuple[int, int], int] = {}
+        b_of = {}
+        for j, c in enumerate(cols):
+            pair = (p0[j], p1[j])
+            if pair not in pairs and len(pairs) == 2:
+                return None
+            b_of[c] = pairs.setdefault(pair, len(pairs))
+        if len(pairs) != 2:
+            return None
+        values = list(pairs)
+        a = sum(1 << m for m in range(1 << self.n) if a_of[m & first_mask])
+        b = sum(1 << m for m in range(1 << self.n) if b_of[m & second_mask])
+        return a, b, lambda x, y: values[y][x]
+
+
+@cache
+def synthesize(table: int, n: int) -> Program:
+    '''
+    Cheapest program pushing the truth table over n inputs
+    '''
+    steps = _Synthesis(n).best(table)
+    assert steps is not None, f'No program for {table:x}'
+    for m in range(1 << n):
+        assert run_program(steps, m) == [(table >> m) & 1], f'{steps} does not compute {table:x} for {m:b}'
+    return steps
+
+
+def compile_guard(toks: Sequence[Token], leaf: Callable[[Token], Hashable | bool]) -> GuardProgram:
+    '''
+    Parses and compiles the guard expression of `toks`, whose operands are converted by `leaf`
+    (states.parse_input).
+    '''
+    variables: dict[Hashable, int] = {}
+    expr = parse_expr(toks, leaf, variables)
+    inputs = list(variables)
+    if len(inputs) > MAX_GUARD_INPUTS:
+        raise ParsingException(None, source_text(list(toks)),
+                               f'A guard reads at most {MAX_GUARD_INPUTS} inputs, not {len(inputs)}')
+    table = truth_table(expr, len(inputs))
+    return GuardProgram(inputs, table, synthesize(table, len(inputs)))
@@ -1,7 +1,6 @@
 
 
 import itertools
-import re
 from typing import *
 
 T = TypeVar('T')
@@ -13,23 +12,14 @@ class ParsingException(Exception):
         self.state = state
         self.line = line
         self.msg = msg
+        self.line_number: int | None = None
+        '''1 based number of the source line, set by the assembler'''
 
-
-def parse_re(parent, line, regex):
-    match = re.match(regex, line)
-    if not match:
-        raise ParsingException(parent, line, f'Expected {regex}')
-    return match.groups()
-
-
-def regular_tokenizer(line: str) -> list[str]:
-    '''
-    Tokenizes a line of code. Splits on whitespace and removes comments.
-    '''
-    # remove comment
-    line = re.sub(r' *#.*', '', line)
-
-    return [x for x in re.split(r'[,\s]+', line) if x]
+    def __str__(self):
+        # Most messages give the position of their token already (Token.where)
+        if self.line_number is None or f' at {self.line_number}:' in self.msg:
+            return self.msg
+        return f'line {self.line_number}: {self.msg}'
 
 
 def grouper(iterable, n, *, incomplete='fill', fillvalue=None):
@@ -74,3 +64,20 @@ def int_map_to_list(map: dict[T, int], length: int | None = None) -> list[T | No
     for k, v in map.items():
         res[v] = k
     return res
+
+
+def load_map(path: str) -> dict[str, Any]:
+    '''
+    Reads a JSON or TOML (by extension) table.
+    '''
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as f:
+            data = tomllib.load(f)
+    else:
+        import json
+        with open(path) as f:
+            data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f'{path}: expected a table, got {type(data).__name__}')
+    return data
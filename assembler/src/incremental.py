@@ -0,0 +1,82 @@
+'''
+Incremental reassembly.
+
+A block is a label of a code section and the lines up to the next label or section. Starting from
+the STD parse state, the parse output of a block only depends on its text, its section and the
+alignment of its first bit, so a BlockCache keeps it under a hash of those. Reassembling an edited
+source then only parses the blocks that changed. The references of a reused block are registered
+again, in order, so that states, transitions and inputs are numbered exactly as in a full parse.
+
+The cache also keeps the resolved code section of the last run. Code resolution does not depend on
+label addresses, so when the resolved symbols are unchanged, the code of the leading blocks that
+kept their position is reused and only the code from the first moved block on is resolved again.
+'''
+from dataclasses import dataclass, field
+import hashlib
+from typing import Any
+
+from .states import State
+from .tokens import Code, UnresolvedCode
+
+
+@dataclass
+class ParsedBlock:
+    code: UnresolvedCode
+    '''Parse output of the block, as added to lines_unresolved'''
+    correspondence: list[tuple[int, int, str]]
+    '''code_correspondence of the block, relative to its first bit'''
+    nbits: int
+    end_state: State
+    '''Parse state following the block'''
+
+
+@dataclass(frozen=True)
+class BlockPosition:
+    key: str
+    item: int
+    '''Index in lines_unresolved of the first item of the block'''
+    bit: int
+    nitems: int
+
+
+@dataclass
+class BlockCache:
+    blocks: dict[str, ParsedBlock] = field(default_factory=dict)
+    layout: list[BlockPosition] = field(default_factory=list)
+    '''Blocks of the last resolved run, in order'''
+    symbols: dict[Any, int] | None = None
+    '''Values the code section of the last run was resolved against'''
+    resolved: Code = field(default_factory=list)
+    '''Resolved code section of the last run'''
+
+    @staticmethod
+    def block_key(section: str, alignment: int, lines: list[str]) -> str:
+        text = f'{section}:{alignment}\n' + '\n'.join(lines)
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def reusable_items(self, layout: list[BlockPosition], symbols: dict[Any, int]) -> int:
+        '''
+        Number of leading items of lines_unresolved whose resolved code can be taken from the last
+        run: they must come from the same blocks, at the same positions, resolved against the same
+        symbols.
+        '''
+        if symbols != self.symbols:
+            return 0
+        n = 0
+        for old, new in zip(self.layout, layout):
+            if old != new or new.item != n:
+                break
+            n = new.item + new.nitems
+        return min(n, len(self.resolved))
+
+    def update(self, layout: list[BlockPosition], symbols: dict[Any, int], resolved: Code):
+        self.layout = layout
+        self.symbols = symbols
+        self.resolved = resolved
+
+    def prune(self):
+        '''
+        Drops the blocks that were not part of the last run.
+        '''
+        keys = {pos.key for pos in self.layout}
+        self.blocks = {k: v for k, v in self.blocks.items() if k in keys}
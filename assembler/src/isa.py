@@ -0,0 +1,327 @@
+'''
+Instruction set definitions for the RTEM, shared by the tools that need to interpret main memory
+(simulator, analysers, disassembler).
+
+A byte in main memory has no fixed meaning: it is interpreted according to the execution state
+(ES) of the machine that reads it. Every (machine, ES) pair therefore gets a precomputed
+256-entry decode table, so consumers never need to re-extract bit fields at runtime.
+'''
+from enum import IntEnum
+from typing import Literal, NamedTuple
+
+Machine = Literal['trans', 'edit']
+MACHINES: tuple[Machine, Machine] = ('trans', 'edit')
+
+STACK_LEN = 6
+'''Stack depth of each machine (STACK_LEN in top.v)'''
+STACK_MASK = (1 << STACK_LEN) - 1
+
+
+class ES(IntEnum):
+    '''
+    Execution states. Values match the localparams in hdl/src/controller.v
+    '''
+    FINISH = 0b0000_0000
+    SETUP = 0b0000_0001
+    INIT = 0b0000_0010
+
+    STD = 0b1000_0001
+    ACC = 0b1000_0010
+    E_ACC = 0b0100_0010
+
+    PSH_CLK = 0b1000_0101
+    ACC_CLK = 0b1000_0110
+    E_ACC_CLK = 0b0100_0110
+
+    T_NXT = 0b1100_0000
+    T_TRA = 0b1100_0001
+    T_RST = 0b1100_0010
+    E_EDIT = 0b0100_0001
+
+
+CLK_STATES = frozenset((ES.PSH_CLK, ES.ACC_CLK, ES.E_ACC_CLK))
+'''States in which the A cycle evaluates the clock constraint at MEM[VAR]'''
+
+
+class Op(IntEnum):
+    '''
+    Decoded instruction kinds. Names follow the instruction tables in README.md.
+    '''
+    PSH = 0
+    OP = 1
+    DO = 2
+    NXT1 = 3
+    NXT2 = 4
+    VIO = 5
+    ACC = 6
+    EDI = 7
+    TAB = 8
+    TRA = 9
+    RST = 10
+    CLK0 = 11
+    CLK1 = 12
+    ADDR = 13
+    NONE = 14
+
+
+class Insn(NamedTuple):
+    '''
+    A decoded byte. The meaning of the fields depends on `op`:
+
+    | op   | a     | b     | c     | d     |
+    | ---- | ----- | ----- | ----- | ----- |
+    | PSH  | ex    | var   |       |       |
+    | OP   | ex    | pop   | lut   |       |
+    | VIO  | ex    | pop   | lut   |       |
+    | DO   | n     | addr  |       |       |
+    | NXT1 | trans |       |       |       |
+    | NXT2 | up    | len   |       |       |
+    | ACC  | op    | ex    | var   |       |
+    | EDI  | end   | val   | nxt   | var   |
+    | TAB  | hi    | lo    |       |       |
+    | TRA  | hi    | lo    |       |       |
+    | RST  | rst   |       |       |       |
+    | CLK0 | op    | clk   | imm   |       |
+    | CLK1 | op    | clk   | imm   |       |
+    | ADDR | addr  |       |       |       |
+
+    `clk` is the physical clock index ({clk, lng} in the HDL). For CLK1, `imm` only holds the low
+    nibble, the high byte is found in the following memory byte.
+    '''
+    op: Op
+    a: int = 0
+    b: int = 0
+    c: int = 0
+    d: int = 0
+
+
+def decode(machine: Machine, es: ES, byte: int) -> Insn:
+    '''
+    Decode a single byte as it would be interpreted by `machine` while in execution state `es`.
+    '''
+    hi, lo = byte >> 4, byte & 0xf
+    match es:
+        case ES.STD:
+            match byte >> 6:
+                case 0b00:
+                    if machine == 'edit':
+                        return Insn(Op.VIO, (byte >> 5) & 1, (byte >> 4) & 1, lo)
+                    if byte & 0x20:
+                        return Insn(Op.NXT2, (byte >> 4) & 1, lo)
+                    return Insn(Op.NXT1, byte & 0x1f)
+                case 0b01:
+                    return Insn(Op.OP, (byte >> 5) & 1, (byte >> 4) & 1, lo)
+                case 0b10:
+                    return Insn(Op.PSH, (byte >> 5) & 1, byte & 0x1f)
+                case _:
+                    return Insn(Op.DO, (byte >> 4) & 0b11, lo)
+        case ES.ACC | ES.E_ACC | ES.ACC_CLK | ES.E_ACC_CLK:
+            return Insn(Op.ACC, byte >> 6, (byte >> 5) & 1, byte & 0x1f)
+        case ES.PSH_CLK:
+            return Insn(Op.PSH, (byte >> 5) & 1, byte & 0x1f)
+        case ES.E_EDIT:
+            return Insn(Op.EDI, byte >> 7, (byte >> 6) & 1, (byte >> 5) & 1, byte & 0x1f)
+        case ES.T_NXT:
+            return Insn(Op.TAB, hi, lo)
+        case ES.T_TRA:
+            return Insn(Op.TRA, hi, lo)
+        case ES.T_RST:
+            return Insn(Op.RST, byte)
+        case ES.INIT:
+            return Insn(Op.ADDR, byte)
+    return Insn(Op.NONE)
+
+
+def decode_clock_constraint(byte: int) -> Insn:
+    '''
+    Decode the first byte of a clock constraint (the instruction found at MEM[x] for a clock input x)
+    '''
+    lng = byte >> 7
+    return Insn(Op.CLK1 if lng else Op.CLK0, (byte >> 6) & 1, ((byte >> 4) & 0b11) * 2 + lng, byte & 0xf)
+
+
+DECODE: dict[Machine, dict[ES, tuple[Insn, ...]]] = {
+    machine: {es: tuple(decode(machine, es, byte) for byte in range(256)) for es in ES}
+    for machine in MACHINES
+}
+'''Per machine, per ES decode tables, indexed by the byte value'''
+
+CLK_DECODE: tuple[Insn, ...] = tuple(decode_clock_constraint(byte) for byte in range(256))
+
+TRUNC_MASK: tuple[int, ...] = tuple(
+    ((t & -t) - 1) if t else 0x1f for t in range(32))
+'''
+Indexed by the 5 bit {up, len} field of NXT2. Masks the stack bits used to index the jump table,
+mirroring hdl/src/trunc.v (every bit at or above the lowest set bit of the truncator is cleared).
+'''
+
+
+def lut_eval(lut: int, stack: int) -> int:
+    '''
+    Binary logic operation used by OP and VIO: lut[{$1, $0}]
+    '''
+    return (lut >> (stack & 0b11)) & 1
+
+
+def acc_eval(op: int, stack0: int, val: int) -> int:
+    '''
+    Accumulate operation used by ACC, as implemented in calculation_module.v: (op[1]^val) | (op[0]^$0)
+    '''
+    return ((op >> 1) ^ val) | ((op & 1) ^ stack0)
+
+
+def table_states(memory: list[int], state_offset: int, trans_offset: int) -> list[int]:
+    '''
+    Ids of the states with an entry in the state address table. The table ends where the code
+    referenced by its entries begins.
+    '''
+    states: list[int] = []
+    code_start = len(memory)
+    for state in range(16):
+        addr = state_offset + 2 * state
+        if addr + 1 >= code_start:
+            break
+        trans, edit = memory[addr], memory[addr + 1]
+        if trans or edit:
+            states.append(state)
+            code_start = min(code_start, trans_offset + trans, trans_offset + edit)
+    return states
+
+
+class Execution(NamedTuple):
+    '''
+    Result of running one machine through a policy state with `execute`
+    '''
+    next_state: int
+    '''Next state written by TRA (transition machine only)'''
+    resets: int
+    '''Clock reset mask applied by RST (transition machine only)'''
+    edit_mask: int
+    '''Outputs overridden by EDI (edit machine only)'''
+    edit_values: int
+    reads: int
+    '''Mask of the IN addresses read by PSH and ACC'''
+    steps: int
+    '''Number of A/B cycle pairs from INIT up to and including the finishing instruction'''
+    clock_steps: int
+    '''Number of additional A/B cycle pairs spent evaluating clock constraints'''
+    max_stack: int
+    '''Maximum number of stack entries in use'''
+
+
+def execute(memory: list[int], machine: Machine, state: int, state_offset: int, trans_offset: int,
+            in_data: int = 0, clock_flags: int = 0, max_steps: int = 256) -> Execution:
+    '''
+    Functional model of a single machine running the code of `state`, with every input available
+    in `in_data`. Clock inputs (set in `clock_flags`) take an extra step the first time they are read,
+    as they would in hardware.
+
+    Control flow within a state does not depend on the input values, so `reads` and `steps` are the
+    same for every `in_data` except for the clock evaluation steps.
+    '''
+    decode_tables = DECODE[machine]
+    pc = (state_offset + 2 * state + (machine == 'edit')) & 0xff
+    pc = (trans_offset + memory[pc]) & 0xff
+    es = ES.STD
+    ra = jc = hi = stack = depth = max_depth = 0
+    up = 0
+    next_state = resets = edit_mask = edit_values = reads = 0
+    evaluated = 0
+    steps = 1  # INIT
+    clock_steps = 0
+    while steps < max_steps:
+        byte = memory[pc]
+        insn = decode_tables[es][byte]
+        steps += 1
+        new_pc = pc + 1
+        ra_old = ra
+
+        # A cycle: jump counter
+        if insn.op == Op.DO:
+            jc = insn.a + 2
+        elif insn.op == Op.NXT1:
+            jc = ((byte >> 4) & 0b11) + 2
+        elif es == ES.T_NXT:
+            jc = 2
+        elif jc:
+            jc -= 1
+
+        # B cycle
+        match insn.op:
+            case Op.PSH | Op.ACC:
+                var = insn.b if insn.op == Op.PSH else insn.c
+                ex = insn.a if insn.op == Op.PSH else insn.b
+                reads |= 1 << var
+                if (clock_flags >> var) & 1 and not (evaluated >> var) & 1:
+                    evaluated |= 1 << var
+                    clock_steps += 1
+                val = (in_data >> var) & 1
+                if insn.op == Op.PSH:
+                    stack = ((stack << 1) | val) & STACK_MASK
+                    depth += 1
+                    es = ES.ACC if ex else ES.STD
+                else:
+                    stack = (stack & ~1) | acc_eval(insn.a, stack & 1, val)
+                    if es == ES.E_ACC:
+                        es = ES.E_ACC if ex else ES.E_EDIT
+                    else:
+                        es = ES.ACC if ex else ES.STD
+            case Op.OP | Op.VIO:
+                res = lut_eval(insn.c, stack)
+                if insn.b:
+                    stack = (((stack >> 1) & ~1) if insn.op == Op.OP else (stack & ~1)) | res
+                    depth -= insn.op == Op.OP
+                else:
+                    stack = ((stack << 1) & STACK_MASK) | res
+                    depth += 1
+                if insn.op == Op.OP:
+                    es = ES.ACC if insn.a else ES.STD
+                else:
+                    es = ES.E_ACC if insn.a else ES.E_EDIT
+            case Op.DO:
+                offset = (((0x10 | (~insn.b & 0xf)) + (0x1c | (~insn.a & 0b11))) & 0x1f)
+                if offset & 0x10:
+                    offset -= 0x20
+                ra = (pc + 1) & 0xff
+                new_pc = pc + 1 + offset
+            case Op.NXT1:
+                hi = byte & 1
+                ra = (trans_offset - 1 - ((byte >> 1) & 0xf)) & 0xff
+                new_pc = trans_offset + (byte & 0x1f)
+                es = ES.T_TRA
+            case Op.NXT2:
+                hi = stack & 1
+                up = insn.a
+                new_pc = pc + 1 + ((stack >> 1) & TRUNC_MASK[byte & 0x1f])
+                es = ES.T_NXT
+            case Op.TAB:
+                trans = (up << 4) | (insn.a if hi else insn.b)
+                hi = trans & 1
+                ra = (trans_offset - 1 - ((trans >> 1) & 0xf)) & 0xff
+                new_pc = trans_offset + trans
+                es = ES.T_RST
+            case Op.RST:
+                resets = byte
+                es = ES.T_TRA
+            case Op.TRA:
+                next_state = insn.a if hi else insn.b
+                break
+            case Op.EDI:
+                if stack & 1:
+                    edit_mask |= 1 << insn.d
+                    edit_values = (edit_values & ~(1 << insn.d)) | (insn.b << insn.d)
+                if insn.a:
+                    break
+                if insn.c:
+                    es = ES.E_EDIT
+                else:
+                    stack >>= 1
+                    depth -= 1
+                    es = ES.STD
+            case _:
+                raise ValueError(f'Cannot execute byte {byte:08b} at {pc} in {es.name}')
+        max_depth = max(max_depth, depth)
+        pc = (ra_old if jc == 1 else new_pc) & 0xff
+    else:
+        raise ValueError(f'State {state} of the {machine} machine did not finish within {max_steps} steps')
+    return Execution(next_state, resets, edit_mask, edit_values, reads, steps, clock_steps, max(max_depth, depth))
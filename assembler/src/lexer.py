@@ -0,0 +1,128 @@
+'''
+Single pass lexer for the RTEM assembly language.
+
+The whole source is scanned once by one precompiled pattern, producing typed tokens with their
+source positions. Comments and whitespace are dropped, so the token list of a line is empty exactly
+when the line has no content. Commas are kept, as they are significant in EDIT lines.
+'''
+from enum import Enum
+import re
+from typing import Any, NamedTuple
+
+from .helpers import parse_int
+
+
+class TokenKind(Enum):
+    SECTION = 'SECTION'
+    '''.Name, value: the section name'''
+    LABEL = 'LABEL'
+    '''name:, value: the label name'''
+    ASSIGN = 'ASSIGN'
+    '''name=number, optionally spaced around the =. value: (name, number)'''
+    COMPARE = 'COMPARE'
+    '''Clock constraint clock<op>constant. value: (clock, op, constant)'''
+    STACK = 'STACK'
+    '''$0 or $1'''
+    OP = 'OP'
+    '''Run of operator characters, or a bracketed stack reference such as ![0]'''
+    NUMBER = 'NUMBER'
+    '''value: the parsed integer, None if it is not a valid number'''
+    NAME = 'NAME'
+    COMMA = 'COMMA'
+    PAREN = 'PAREN'
+    '''( or ), grouping guard and stack logic expressions'''
+    ERROR = 'ERROR'
+    '''Any character that cannot start a token'''
+
+
+class Token(NamedTuple):
+    kind: TokenKind
+    text: str
+    line: int
+    '''1 based line number'''
+    col: int
+    '''0 based column'''
+    value: Any = None
+
+    @property
+    def where(self) -> str:
+        return f'{self.line}:{self.col + 1}'
+
+
+_TOKEN_RE = re.compile(r'''
+    [ \t\r\f\v]*(?:\#[^\n]*)?
+    (?:
+      (?P<NAME>[A-Za-z_]\w*)(?:
+          (?P<LABEL>:)
+        | [ \t]*=(?!=)[ \t]*(?P<ASSIGN>[0-9]\w*)
+        | (?P<c_op><=|>=|==|!=|<|>|=)(?P<COMPARE>[A-Za-z_]\w*)
+      )?
+    | (?P<NEWLINE>\n)
+    | (?P<OP>!?\[[01]\]|[!|&<>=^~]+)
+    | (?P<NUMBER>[0-9]\w*)
+    | (?P<STACK>\$[01])
+    | (?P<COMMA>,)
+    | (?P<PAREN>[()])
+    | (?P<SECTION>\.\w+)
+    | (?P<EOF>\Z)
+    | (?P<ERROR>.)
+    )
+''', re.VERBOSE)
+'''
+Whitespace and comments are matched as the prefix of the following token. The name of the last
+matched group is the kind of the token: LABEL, ASSIGN and COMPARE end with their own group.
+'''
+
+_KINDS = {kind.value: kind for kind in TokenKind}
+
+
+def lex(source: str, first_line: int = 1) -> list[list[Token]]:
+    '''
+    Tokenizes `source`, returning the tokens of each line. There is one entry per line of
+    `source.split('\\n')`, numbered from `first_line`.
+    '''
+    lines: list[list[Token]] = [[]]
+    append = lines[0].append
+    line = first_line
+    line_start = 0
+    kinds = _KINDS
+    NAME, OP, NUMBER = TokenKind.NAME, TokenKind.OP, TokenKind.NUMBER
+    for m in _TOKEN_RE.finditer(source):
+        group = m.lastgroup
+        if group == 'NAME':
+            append(Token(NAME, m['NAME'], line, m.start('NAME') - line_start))
+        elif group == 'OP':
+            append(Token(OP, m['OP'], line, m.start('OP') - line_start))
+        elif group == 'NEWLINE':
+            toks: list[Token] = []
+            lines.append(toks)
+            append = toks.append
+            line += 1
+            line_start = m.end()
+        elif group == 'NUMBER':
+            text = m['NUMBER']
+            append(Token(NUMBER, text, line, m.start('NUMBER') - line_start, parse_int(text)))
+        elif group == 'EOF':
+            break
+        else:
+            start = m.start(1 if m['NAME'] else group)
+            text = source[start:m.end()]
+            if group == 'LABEL':
+                value = m['NAME']
+            elif group == 'ASSIGN':
+                value = m['NAME'], parse_int(m['ASSIGN'])
+            elif group == 'COMPARE':
+                value = m.group('NAME', 'c_op', 'COMPARE')
+            elif group == 'SECTION':
+                value = text[1:]
+            else:
+                value = None
+            append(Token(kinds[group], text, line, start - line_start, value))
+    return lines
+
+
+def source_text(toks: list[Token]) -> str:
+    '''
+    Approximate source text of a token slice, for error messages.
+    '''
+    return ' '.join(tok.text for tok in toks)
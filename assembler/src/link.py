@@ -0,0 +1,272 @@
+'''
+Relocatable objects and the linker.
+
+An object holds the code section of a parsed source, encoded with zeros in every field that refers
+to a symbol, and a relocation for each of these fields. Its symbol table lists the referenced
+inputs, clock constraints and transitions (and through them the states and clocks), the labels of
+its states, and the constants, clocks and inputs it was parsed with, which are only defaults.
+
+The linker lays out the code of its objects one after the other, each starting on a byte. It then
+assigns ids and slots exactly as RTEMAssembler.resolve does, registering the relocations in code
+order as the parser registered the references, and patches the id of its symbol into each field.
+Labels only appear in the state table, built by resolve from the linked label addresses
+(label + prog_offset - trans_offset), so the code itself needs no address relocations.
+
+Relinking with other pin maps or constants therefore never parses the source again. Objects are
+saved as JSON.
+'''
+from bisect import bisect_right
+from dataclasses import dataclass, field
+import json
+from typing import Any, Mapping, NamedTuple
+
+from .allocate import IN_SLOTS
+from .main import RTEMAssembler
+from .result import AssemblerResult
+from .sections import EditSection
+from .states import STD
+from .tokens import (Bits, Code, R, RTEMClock, RTEMClockConstraint, RTEMConstant, RTEMInput, RTEMLabel,
+                     RTEMState, RTEMTransition, RTEMVar, code_offsets, pack_code)
+from .trace import Tracer
+
+OBJECT_FORMAT = 1
+
+INPUT_BITS = (IN_SLOTS - 1).bit_length()
+'''Width of the field holding the slot of an input'''
+
+Symbol = RTEMInput | RTEMTransition
+
+
+class Relocation(NamedTuple):
+    bit: int
+    '''Offset of the field from the start of the object code, in the bit order of pack_code: the field
+    is the low bits of its encoded line'''
+    width: int
+    symbol: int
+    '''Index of the symbol in RTEMObject.symbols, whose id is patched into the field'''
+
+
+@dataclass
+class RTEMObject:
+    initial_state: str
+    code: bytes
+    '''Code section, with zeros in the relocated fields'''
+    symbols: list[Symbol] = field(default_factory=list)
+    '''Referenced symbols, in order of first use'''
+    relocations: list[Relocation] = field(default_factory=list)
+    '''Relocated fields, in code order'''
+    labels: dict[RTEMLabel, int] = field(default_factory=dict)
+    '''Address of each label, relative to the start of the object code'''
+    constants: dict[str, int] = field(default_factory=dict)
+    clocks: dict[str, int] = field(default_factory=dict)
+    inputs: dict[str, int] = field(default_factory=dict)
+    '''Fixed input slots'''
+    correspondence: list[tuple[int, int, str]] = field(default_factory=list)
+    '''code_correspondence of the source, relative to the start of the object code'''
+
+    def to_dict(self) -> dict[str, Any]:
+        return dict(
+            format=OBJECT_FORMAT,
+            initial_state=self.initial_state,
+            code=self.code.hex(),
+            symbols=[symbol_to_dict(s) for s in self.symbols],
+            relocations=[list(r) for r in self.relocations],
+            labels=[[label.name, label.section, addr] for label, addr in self.labels.items()],
+            constants=self.constants,
+            clocks=self.clocks,
+            inputs=self.inputs,
+            correspondence=[list(c) for c in self.correspondence])
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> 'RTEMObject':
+        if data.get('format') != OBJECT_FORMAT:
+            raise ValueError(f'Unsupported object format {data.get("format")}, expected {OBJECT_FORMAT}')
+        return cls(
+            initial_state=data['initial_state'],
+            code=bytes.fromhex(data['code']),
+            symbols=[symbol_from_dict(s) for s in data['symbols']],
+            relocations=[Relocation(*r) for r in data['relocations']],
+            labels={RTEMLabel(name, section): addr for name, section, addr in data['labels']},
+            constants=dict(data['constants']),
+            clocks=dict(data['clocks']),
+            inputs=dict(data['inputs']),
+            correspondence=[tuple(c) for c in data['correspondence']])
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=1) + '\n'
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            f.write(self.to_json())
+
+    @classmethod
+    def load(cls, path: str) -> 'RTEMObject':
+        with open(path) as f:
+            try:
+                return cls.from_dict(json.load(f))
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f'{path} is not a relocatable object: {e}') from None
+
+
+def symbol_to_dict(symbol: Symbol) -> dict[str, Any]:
+    match symbol:
+        case RTEMTransition(next_state, resets):
+            return dict(state=next_state.name, resets=sorted(r.name for r in resets))
+        case RTEMClockConstraint(op, clk, imm):
+            return dict(clock=clk.name, op=op, imm=imm.name)
+        case RTEMVar(name):
+            return dict(input=name)
+    raise ValueError(f'Cannot relocate a reference to {symbol!r}')
+
+
+def symbol_from_dict(data: Mapping[str, Any]) -> Symbol:
+    if 'state' in data:
+        return RTEMTransition(RTEMState(data['state']), {RTEMClock(r) for r in data['resets']})
+    if 'clock' in data:
+        return RTEMClockConstraint(data['op'], RTEMClock(data['clock']), RTEMConstant(data['imm']))
+    return RTEMVar(data['input'])
+
+
+def make_object(ass: RTEMAssembler) -> RTEMObject:
+    '''
+    The relocatable object of the source parsed by `ass`, minimized first if `ass.minimize` is set,
+    and optimized if `ass.peephole` or `ass.jump_tables` is set.
+    '''
+    if ass.minimize:
+        ass.minimize_states()
+    if ass.peephole:
+        ass.optimize_peephole()
+    if ass.jump_tables:
+        ass.optimize_tables()
+    data = ass.data
+    if not isinstance(data.state, STD):
+        raise ValueError(f'The source ends inside an instruction, in parse state {type(data.state).__name__}')
+
+    lines: Code = []
+    refs: list[tuple[int, Symbol, int]] = []
+    '''(line, symbol, field width) of each reference'''
+    for line in data.lines_unresolved:
+        if isinstance(line, R):
+            if len(line.requests) != 1:
+                raise ValueError(f'Cannot relocate {line}, which refers to several symbols')
+            symbol = line.requests[0]
+            encoded = line.resolve_fn((0,))
+            refs.append((len(lines), symbol, encoded.width if isinstance(symbol, RTEMTransition) else INPUT_BITS))
+            lines.append(encoded)
+        else:
+            lines.append(line)
+
+    symbols = list(dict.fromkeys(symbol for _, symbol, _ in refs))
+    index = {symbol: i for i, symbol in enumerate(symbols)}
+    offsets = code_offsets(lines)
+    return RTEMObject(
+        initial_state=ass.initial_state.name,
+        code=bytes(pack_code(lines)) if lines else b'',
+        symbols=symbols,
+        relocations=[Relocation(offsets[i], width, index[symbol])
+                     for i, symbol, width in refs],
+        labels=dict(data.label_map),
+        constants={c.name: v for c, v in data.constant_map.items()},
+        clocks={c.name: v for c, v in data.clock_map.items()},
+        inputs={i.name: v for i, v in data.input_map.items() if isinstance(i, RTEMVar)},
+        correspondence=list(data.code_correspondence))
+
+
+def merge_defaults(objects: list[RTEMObject], table: str, overrides: Mapping[str, int] | None) -> dict[str, int]:
+    '''
+    Merges the `table` defaults of the objects, which must agree unless `overrides` sets the value.
+    '''
+    overrides = overrides or {}
+    merged: dict[str, int] = {}
+    for obj in objects:
+        for name, value in getattr(obj, table).items():
+            if merged.setdefault(name, value) != value and name not in overrides:
+                raise ValueError(f'The objects disagree on {table} {name} ({merged[name]}, {value}), '
+                                 'set it when linking')
+    return merged | dict(overrides)
+
+
+class RTEMLinker(RTEMAssembler):
+    '''
+    Links relocatable objects into an image: resolve() lays out the objects as if their sources had
+    been parsed one after the other.
+    '''
+
+    def __init__(self,
+                 objects: list[RTEMObject],
+                 initial_state: str | None = None,
+                 clocks: dict[str, int] | None = None,
+                 constants: dict[str, int] | None = None,
+                 inputs: dict[str, int] | None = None,
+                 compress: bool = False,
+                 assign_clocks: bool = False,
+                 tracer: Tracer | None = None,
+                 **kwargs):
+        '''
+        initial_state: defaults to the initial state of the first object
+        clocks, constants, inputs: override the values the objects were parsed with
+        assign_clocks: assign the clocks of all the objects together (see RTEMAssembler)
+        kwargs: passed to the AssemblerState, e.g. the clock_divider_immediate_values of assign_clocks
+        '''
+        if not objects:
+            raise ValueError('Nothing to link')
+        super().__init__(initial_state or objects[0].initial_state,
+                         clocks=merge_defaults(objects, 'clocks', clocks),
+                         constants=merge_defaults(objects, 'constants', constants),
+                         inputs=merge_defaults(objects, 'inputs', inputs),
+                         compress=compress,
+                         assign_clocks=assign_clocks,
+                         tracer=tracer,
+                         **kwargs)
+        self.objects = objects
+        self.bases: list[int] = []
+        '''Address of each object, relative to the first instruction'''
+
+        section = EditSection(self.data)
+        base = 0
+        for obj in objects:
+            self.bases.append(base)
+            for label, addr in obj.labels.items():
+                if label in self.data.label_map:
+                    raise ValueError(f'Label {label} ({label.section}) is defined by several objects')
+                self.data.label_map[label] = base + addr
+            self.data.code_correspondence.extend(
+                (8 * base + bit, n, line) for bit, n, line in obj.correspondence)
+            for reloc in obj.relocations:
+                # Registers the symbol as the parser did, numbering states and transitions alike
+                section.process_ref(R((obj.symbols[reloc.symbol],), None))  # type: ignore
+            base += len(obj.code)
+
+    def clock_reads(self) -> list[list[RTEMClockConstraint]]:
+        blocks = []
+        for obj in self.objects:
+            starts = sorted(set(obj.labels.values()) | {0})
+            reads: list[list[RTEMClockConstraint]] = [[] for _ in starts]
+            for reloc in obj.relocations:
+                symbol = obj.symbols[reloc.symbol]
+                if isinstance(symbol, RTEMClockConstraint):
+                    reads[bisect_right(starts, reloc.bit // 8) - 1].append(symbol)
+            blocks.extend(reads)
+        return blocks
+
+    def resolve_code(self, context_map: Mapping[Any, int]) -> Code:
+        code = bytearray()
+        for obj in self.objects:
+            code += obj.code
+        for base, obj in zip(self.bases, self.objects):
+            for bit, width, symbol in obj.relocations:
+                value = context_map[obj.symbols[symbol]]
+                if not 0 <= value < 1 << width:
+                    raise ValueError(f'{obj.symbols[symbol]} = {value} does not fit its {width} bit field')
+                # Encoded lines never cross a byte, neither do their fields
+                bit += 8 * base
+                code[bit // 8] |= value << bit % 8
+        return [Bits(byte, 8) for byte in code]
+
+
+def link(objects: list[RTEMObject], initial_state: str | None = None, **settings) -> AssemblerResult:
+    '''
+    Links `objects` into an AssemblerResult.
+    settings: passed to RTEMLinker (clocks, constants, inputs, compress, assign_clocks, tracer)
+    '''
+    return RTEMLinker(objects, initial_state, **settings).resolve()
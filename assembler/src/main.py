@@ -1,11 +1,18 @@
-from .config import RTEMConfig
 
 from typing import Any, TypeVar, Mapping, TypeVarTuple
-from .sections import AssemblerState, Section, EditSection, ByteCode
+from .sections import AssemblerState, Section, CodeSection, EditSection, ByteCode
 from .states import *
 from . import tokens
 from .result import AssemblerResult
 from .helpers import grouper, ParsingException, int_map_to_list
+from .incremental import BlockCache, BlockPosition, ParsedBlock
+from .lexer import Token, TokenKind, lex
+from .allocate import SlotAllocation, allocate_slots
+from .clocks import ClockAssignment, assign_clocks
+from .peephole import PeepholeReport, optimize
+from .tables import TableReport, layout_tables
+from .trace import Level, Tracer
+from time import perf_counter
 import copy
 
 
@@ -31,7 +38,46 @@ class RTEMAssembler:
                  clocks: dict[str, int] | None = None,
                  constants: dict[str, int] | None = None,
                  inputs: dict[str, int] | None = None,
+                 compress: bool = False,
+                 minimize: bool = False,
+                 peephole: bool = False,
+                 jump_tables: bool = False,
+                 assign_clocks: bool = False,
+                 tracer: Tracer | None = None,
+                 cache: BlockCache | None = None,
                  **kwargs):
+        '''
+        compress: Replace repeated instruction runs in the code section with DO instructions.
+        minimize: Remove unreachable states and merge equivalent states before layout.
+        peephole: Rewrite the code with the peephole rules before layout (see peephole.py).
+        jump_tables: Lay out the NXT jump tables at their cheapest and renumber the transitions
+            before layout (see tables.py).
+        assign_clocks: Merge the clock constraints equal once their constants are resolved, and
+            assign the clocks to the physical clocks of fewest constraint bytes (see clocks.py). The
+            clock_divider_immediate_values given here set the rate of each clock, and the
+            configuration must use those of the result. A clock moved to a narrower clock must be
+            reset before it wraps there.
+        tracer: Receives trace events and phase timings. Silent by default.
+        cache: Shared between the assemblers of successive versions of a source, so that only the
+            changed blocks are parsed and resolved again (see incremental.py).
+        '''
+        self.compress = compress
+        self.minimize = minimize
+        self.peephole = peephole
+        self.peephole_report: PeepholeReport | None = None
+        '''Savings of the last peephole pass'''
+        self.jump_tables = jump_tables
+        self.tables_report: TableReport | None = None
+        '''Savings of the last jump table layout'''
+        self.assign_clocks = assign_clocks
+        self.clock_assignment: ClockAssignment | None = None
+        '''Clocks of the last resolve, if assigned'''
+        self.initial_state = tokens.RTEMState(initial_state)
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.cache = cache
+        self.block_layout: list[BlockPosition] = []
+        self.reused_blocks: list[tokens.RTEMLabel] = []
+        self.parsed_blocks: list[tokens.RTEMLabel] = []
 
         self.data = AssemblerState(
             constant_map={tokens.RTEMConstant(
@@ -41,9 +87,11 @@ class RTEMAssembler:
             input_map={tokens.RTEMVar(k): v for k, v in inputs.items()
                        } if inputs else {},
             state_map={tokens.RTEMState(initial_state): 0},
+            tracer=self.tracer,
             **kwargs
         )
         self.curr_section: Section = EditSection(self.data)
+        self.initial_data = copy.deepcopy(self.data)
 
     # def parse_file(self, filename: str):
     #     with open(filename, 'r') as f:
@@ -51,33 +99,103 @@ class RTEMAssembler:
     #             self.parse_line(line)
     #     return self.config
 
-    def check_section(self, line: str) -> str | None:
+    def check_section(self, toks: list[Token]) -> str | None:
         '''
         Checks if a line is a section. If it is, returns the section name.
         '''
-        if line.startswith('.'):
-            return line.split()[0].removeprefix('.')
+        if toks and toks[0].kind is TokenKind.SECTION:
+            return toks[0].value
         return None
 
+    def parse_source(self, code: str):
+        '''
+        Parses a whole source, which is lexed in a single pass.
+        '''
+        lines = code.split('\n')
+        line_toks = lex(code, self.data.current_line + 1)
+        if self.cache is None:
+            for line, toks in zip(lines, line_toks):
+                self.parse_tokens(line, toks)
+            return
+
+        i = 0
+        while i < len(lines):
+            if (isinstance(self.curr_section, CodeSection) and isinstance(self.data.state, STD)
+                    and CodeSection.check_label(line_toks[i]) is not None):
+                end = next((j for j in range(i + 1, len(lines)) if line_toks[j] and line_toks[j][0].kind in
+                            (TokenKind.LABEL, TokenKind.SECTION)), len(lines))
+                self.parse_block(lines[i:end], line_toks[i:end])
+                i = end
+            else:
+                self.parse_tokens(lines[i], line_toks[i])
+                i += 1
+
+    def parse_block(self, lines: list[str], line_toks: list[list[Token]]):
+        '''
+        Parses a labelled block of a code section, or replays it from the cache.
+        '''
+        assert self.cache is not None and isinstance(self.curr_section, CodeSection)
+        section = self.curr_section
+        label_name = line_toks[0][0].value
+        label = tokens.RTEMLabel(label_name, 'edit' if section.is_edit else 'trans')
+        key = BlockCache.block_key(section.name, self.data.current_bit % 8, lines)
+        start_bit = self.data.current_bit
+        start_item = len(self.data.lines_unresolved)
+        block = self.cache.blocks.get(key)
+        if block is not None:
+            start = perf_counter()
+            self.data.current_line += len(lines)
+            self.data.code.extend(lines)
+            section.replay_block(label_name, block)
+            elapsed = perf_counter() - start
+            self.tracer.add_time('parse', elapsed)
+            self.tracer.add_time(section.timing_key, elapsed)
+            self.tracer('parse', Level.INFO, 'Reused block %s (%s)', label, label.section)
+            self.reused_blocks.append(label)
+        else:
+            start_corr = len(self.data.code_correspondence)
+            for line, toks in zip(lines, line_toks):
+                self.parse_tokens(line, toks)
+            block = self.cache.blocks[key] = ParsedBlock(
+                code=self.data.lines_unresolved[start_item:],
+                correspondence=[(bit - start_bit, n, line)
+                                for bit, n, line in self.data.code_correspondence[start_corr:]],
+                nbits=self.data.current_bit - start_bit,
+                end_state=self.data.state)
+            self.tracer('parse', Level.INFO, 'Parsed block %s (%s)', label, label.section)
+            self.parsed_blocks.append(label)
+        self.block_layout.append(BlockPosition(key, start_item, start_bit, len(block.code)))
+
     def parse_line(self, line: str):
+        self.parse_tokens(line, [tok for toks in lex(line, self.data.current_line + 1) for tok in toks])
+
+    def parse_tokens(self, line: str, toks: list[Token]):
+        '''
+        Parses the next line of the source, given its tokens.
+        '''
+        start = perf_counter()
+        section = self.curr_section
         self.data.current_line += 1
         self.data.code.append(line)
         # Check if there is a new section, and update the section accordingly
-        print(line)
+        self.tracer('parse', Level.DEBUG, '%s', line)
         try:
-            self.curr_section.parse_line(line)
-            if sec := self.check_section(line):
+            self.curr_section.parse_line(line, toks)
+            if sec := self.check_section(toks):
                 self.curr_section = Section.class_map[sec](self.data)
                 return []
 
         except ParsingException as e:
-            print('Error while parsing:')
-            print(f'\tdata={self.data}')
-            print(f'\tsection={e.state}')
-            print(f'\tstate={e.state}')
-            print(f'\tline={e.line}')
-            print(f'\tmsg={e.msg}')
-            exit()
+            # Recoverable: the caller decides whether to stop, e.g. a batch goes on with other policies
+            if e.line_number is None:
+                e.line_number = self.data.current_line
+            self.tracer('parse', Level.ERROR, 'Error while parsing %s in %s: %s',
+                        repr(line), type(section).__name__, e)
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            self.tracer.add_time('parse', elapsed)
+            self.tracer.add_time(section.timing_key, elapsed)
 
     ####
     # Resolve functionality
@@ -85,68 +203,98 @@ class RTEMAssembler:
 
     def resolve_string(self, line: tokens.UnresolvedCodeline, map: Mapping[Any, int]) -> tokens.CodeLine:
         '''
-        Resolve string to bitstring
+        Resolve a line to its encoding
         '''
-        if isinstance(line, str):
+        if isinstance(line, tokens.Bits):
             return line
         return line.resolve(map)
 
-    def resolve_clock_flags(self):
+    def resolve_clock_flags(self, input_map: Mapping[tokens.RTEMInput, int]):
         clock_flags = 0
-        for idx, v in enumerate(int_map_to_list(self.data.input_map)):
+        for idx, v in enumerate(int_map_to_list(input_map)):
             if isinstance(v, tokens.RTEMClockConstraint):
                 clock_flags |= 1 << idx
         return clock_flags
 
-    def resolve_inputs(self):
-        final_input_map = self.data.input_map.copy()
-        used_inputs = set(self.data.input_map.values())
-        i = 0
-        for input_var in self.data.input_vars:
-            if input_var not in final_input_map:
-                while i in used_inputs:
-                    i += 1
-                final_input_map[input_var] = i
-                used_inputs.add(i)
-        return final_input_map
+    def clock_reads(self) -> list[list[tokens.RTEMClockConstraint]]:
+        '''
+        The clock constraints read by each block of the code.
+        '''
+        lines = self.data.lines_unresolved
+        bounds = sorted({0, *self.data.label_items.values(), len(lines)})
+        return [[r for line in lines[begin:end] if isinstance(line, tokens.R)
+                 for r in line.requests if isinstance(r, tokens.RTEMClockConstraint)]
+                for begin, end in zip(bounds, bounds[1:])]
 
-    def resolve_positions(self) -> tuple[int, int, int, int]:
+    def optimize_clocks(self) -> ClockAssignment:
+        '''
+        Assigns the clocks, tracing the clocks moved and the savings.
+        '''
+        clocks = assign_clocks(self.data, self.clock_reads())
+        self.clock_assignment = clocks
+        for clock, placement in clocks.placements.items():
+            if placement != (self.data.clock_map.get(clock),):
+                self.tracer('allocate', Level.INFO, 'Clock %s on %s', clock,
+                            ' joined to '.join(map(str, reversed(placement))))
+        self.tracer('allocate', Level.INFO, 'Clock assignment: %d constraints merged, %d bytes and %d cycles saved',
+                    len(clocks.canonical) - len(clocks.codes), clocks.bytes, clocks.cycles)
+        return clocks
+
+    def resolve_inputs(self, clocks: ClockAssignment | None = None) -> SlotAllocation:
+        '''
+        Places the clock constraints and unbound inputs around the inputs fixed by the user. With
+        assigned `clocks`, the constraints of a canonical form share its slot.
+        '''
+        fixed = {k: v for k, v in self.data.input_map.items()
+                 if not isinstance(k, tokens.RTEMClockConstraint)}
+        if clocks is None:
+            constraints = {k: k.resolve_defn(self.data.clock_map, self.data.constant_map)
+                           for k in self.data.input_map if isinstance(k, tokens.RTEMClockConstraint)}
+            return allocate_slots(fixed, constraints, self.data.input_vars)
+        allocation = allocate_slots(fixed, clocks.codes, self.data.input_vars)
+        for constraint, canonical in clocks.canonical.items():
+            allocation.input_map[constraint] = allocation.input_map[canonical]
+        return allocation
+
+    def resolve_positions(self, clock_region_length: int) -> tuple[int, int, int, int]:
         '''
         Returns: (trans_offset, trans_start, state_offset, prog_offset)
 
         '''
         # Get start positions of each section
-        trans_offset = len(self.data.clock_constraints) + \
+        trans_offset = clock_region_length + \
             (len(self.data.trans_map) + 1) // 2
-        print(len(self.data.clock_constraints), len(self.data.trans_map))
-        trans_start = len(self.data.clock_constraints)
+        self.tracer('layout', Level.DEBUG, 'clock constraints: %d bytes, transitions: %d',
+                    clock_region_length, len(self.data.trans_map))
+        trans_start = clock_region_length
         state_offset = trans_start + (len(self.data.trans_map) * 3 + 1)//2
         prog_offset = state_offset + len(self.data.state_map)*2
         return trans_offset, trans_start, state_offset, prog_offset
 
-    def resolve_transition_defns(self) -> tokens.Code:
+    def resolve_transition_defns(self, clocks: ClockAssignment | None = None) -> tokens.Code:
         '''
         Returns (trans_resets, trans_states)
         '''
         trans_resets: tokens.Code = []
         trans_states: tokens.Code = []
+        clock_map = self.data.clock_map if clocks is None else clocks.clock_map
 
         # Resolve state table
         for trans in int_map_to_list(self.data.trans_map):
             if trans is not None:
                 sta, rst = trans.resolve_defn(
-                    {**self.data.clock_map, **self.data.state_map})
+                    {**clock_map, **self.data.state_map}, 0 if clocks is None else clocks.clock_joins)
                 trans_resets.append(rst)
                 trans_states.append(sta)
             else:
-                trans_resets.append('00000000')
-                trans_states.append('0000')
+                trans_resets.append(tokens.Bits(0, 8))
+                trans_states.append(tokens.Bits(0, 4))
 
         if len(trans_states) % 2 == 1:  
-            trans_states.append('0000')  # pad with 0s
+            trans_states.append(tokens.Bits(0, 4))  # pad with 0s
 
         # pack trans_states such that the 4-bytes words are swapped in each byte
-        packed_trans_states = [word0 + word1 for word0,
+        packed_trans_states = [tokens.Bits(word0.value << 4 | word1.value, 8) for word0,
                                word1 in grouper(reversed(trans_states), 2, incomplete='strict')]
         return packed_trans_states + trans_resets
 
@@ -168,50 +316,172 @@ class RTEMAssembler:
                 # trans_offset is added back. This is never a problem since we always have
                 # trans_offset < state address
                 code_lines.append(
-                    f'{context_map[trans_label] - trans_offset:08b}')
+                    tokens.Bits(context_map[trans_label] - trans_offset, 8))
                 code_lines.append(
-                    f'{context_map[edit_label] - trans_offset:08b}')
+                    tokens.Bits(context_map[edit_label] - trans_offset, 8))
             else:
-                code_lines.append('00000000')
-                code_lines.append('00000000')
+                code_lines.append(tokens.Bits(0, 8))
+                code_lines.append(tokens.Bits(0, 8))
         return code_lines
 
     def resolve_code_section(self, lines: UnresolvedCode, context_map: Mapping[Any, int]):
-        resolved: list[str] = []
+        resolved: tokens.Code = []
         for line in lines:
             resolved_code = self.resolve_string(line, context_map)
-            print(f'{line} -> {resolved_code}')
+            self.tracer('code', Level.DEBUG, '%s -> %s', line, resolved_code)
             resolved.append(resolved_code)
         return resolved
 
-    def code_to_bytecode(self, lines):
-        # Transform to bitstring into a bytestream, aligned on byte boundaries
-        bytes_list: ByteCode = []
-        current_byte = ''
-        for line in lines:
-            if len(line) + len(current_byte) > 8:
-                bytes_list.append(int(current_byte, 2))
-                current_byte = line
-            else:
-                current_byte = line + current_byte
-        bytes_list.append(int(current_byte, 2))
-        return bytes_list
+    def resolve_code_incremental(self, context_map: Mapping[Any, int]) -> tokens.Code:
+        '''
+        Resolves the code section, reusing the code of the last run up to the first moved block.
+        '''
+        assert self.cache is not None
+        symbols = {k: v for k, v in context_map.items() if not isinstance(k, tokens.RTEMLabel)}
+        lines = self.data.lines_unresolved
+        n = self.cache.reusable_items(self.block_layout, symbols)
+        code_lines = self.cache.resolved[:n] + self.resolve_code_section(lines[n:], context_map)
+        self.tracer('code', Level.INFO, 'Reused the resolved code of %d of %d lines', n, len(lines))
+        self.cache.update(self.block_layout, symbols, code_lines)
+        return code_lines
 
-    def resolve(self) -> AssemblerResult:
+    def resolve_code(self, context_map: Mapping[Any, int]) -> tokens.Code:
+        '''
+        Resolves the code section against the symbols of `context_map`.
+        '''
+        if self.cache is not None:
+            return self.resolve_code_incremental(context_map)
+        return self.resolve_code_section(self.data.lines_unresolved, context_map)
+
+    def to_object(self) -> 'RTEMObject':
+        '''
+        The relocatable object of the parsed source, which can be linked without parsing it again
+        (see link.py).
+        '''
+        from .link import make_object
+
+        return make_object(self)
 
-        clock_flags: int = self.resolve_clock_flags()
+    def code_to_bytecode(self, lines: tokens.Code) -> ByteCode:
+        # Pack the encoded lines into a bytestream, aligned on byte boundaries
+        return tokens.pack_code(lines)
+
+    def compress_code_section(self, code_lines: tokens.Code) -> tuple[tokens.Code, AssemblerState]:
+        '''
+        Applies DO compression to the resolved code section. Returns the compressed code, and a copy of
+        the assembler state with the labels and code correspondence moved to their new addresses.
+        '''
+        from .compress import compress_code  # Imported on use, with the ISA decode tables
+
+        code = self.code_to_bytecode(code_lines)
+        compression = compress_code(
+            code, {addr: label.section for label, addr in self.data.label_map.items()})
+        self.tracer('compress', Level.INFO, 'DO compression: %d runs replaced, %d bytes saved',
+                    len(compression.replaced), compression.saved)
+
+        state = copy.copy(self.data)
+        state.label_map = {k: compression.remap_address(v) for k, v in self.data.label_map.items()}
+        state.code_correspondence = []
+        for start, length, line in self.data.code_correspondence:
+            new_start = compression.remap_bit(start)
+            state.code_correspondence.append(
+                (new_start, compression.remap_bit(start + length) - new_start, line))
+        return [tokens.Bits(byte, 8) for byte in compression.code], state
+
+    def minimize_states(self):
+        '''
+        Re-parses the code without the states that are unreachable or equivalent to another state,
+        with every transition redirected to the representative of its next state.
+        '''
+        from .minimize import equivalent_states
+
+        aliases = equivalent_states(self.data, self.initial_state)
+        kept = {s.name for s, rep in aliases.items() if rep == s}
+        # Labelled states that no transition names are not in the aliases, but are unreachable too
+        removed = {label.name for label in self.data.label_items} - kept
+        if not removed:
+            return
+        self.tracer('minimize', Level.INFO, 'Minimization removed states: %s', ', '.join(sorted(removed)))
+
+        code = self.data.code
+        self.data = copy.deepcopy(self.initial_data)
+        self.data.tracer = self.tracer
+        self.data.state_aliases = {s: rep for s, rep in aliases.items() if rep is not None and rep != s}
+        self.curr_section = EditSection(self.data)
+        # The blocks of the original parse no longer describe lines_unresolved
+        self.block_layout = []
+        skipping = False
+        for line, toks in zip(code, lex('\n'.join(code))):
+            if self.check_section(toks):
+                skipping = False
+            elif (label := CodeSection.check_label(toks)) is not None:
+                skipping = label in removed
+            if not skipping:
+                self.parse_tokens(line, toks)
+
+    def optimize_peephole(self) -> PeepholeReport:
+        '''
+        Applies the peephole rules to the parsed code, tracing the savings of each rule.
+        '''
+        report = optimize(self.data)
+        self.peephole_report = report
+        if report.bytes:
+            # The blocks of the parse no longer describe lines_unresolved
+            self.block_layout = []
+        for name, savings in report.rules.items():
+            if savings.rewrites:
+                self.tracer('peephole', Level.INFO, 'Peephole %s: %d rewrites, %d bytes and %d cycles saved',
+                            name, savings.rewrites, savings.bytes, savings.cycles)
+        return report
+
+    def optimize_tables(self) -> TableReport:
+        '''
+        Lays out the jump tables of the parsed code, tracing the layout chosen for each state.
+        '''
+        report = layout_tables(self.data)
+        self.tables_report = report
+        if report.states:
+            # The blocks of the parse no longer describe lines_unresolved
+            self.block_layout = []
+        for name, layout in report.states.items():
+            self.tracer('tables', Level.INFO, 'Jump table of %s %s to %d rows: %d bytes and %d cycles saved',
+                        name, layout.layout, layout.rows, layout.bytes, layout.cycles)
+        if report.transitions:
+            self.tracer('tables', Level.INFO, 'Removed %d unused transitions: %d bytes saved',
+                        report.transitions, report.transition_bytes)
+        return report
 
-        final_input_map: dict[tokens.RTEMInput, int] = self.resolve_inputs()
+    def resolve(self) -> AssemblerResult:
+        tracer = self.tracer
+        start = perf_counter()
+        if self.minimize:
+            with tracer.phase('minimize'):
+                self.minimize_states()
+        if self.peephole:
+            with tracer.phase('peephole'):
+                self.optimize_peephole()
+        if self.jump_tables:
+            with tracer.phase('tables'):
+                self.optimize_tables()
+
+        with tracer.phase('allocate'):
+            clocks = self.optimize_clocks() if self.assign_clocks else None
+            allocation = self.resolve_inputs(clocks)
+        final_input_map: dict[tokens.RTEMInput, int] = allocation.input_map
+
+        clock_flags: int = self.resolve_clock_flags(final_input_map)
 
         # Program length has been determined, so we know the location of each state
-        trans_offset, trans_start, state_offset, prog_offset = self.resolve_positions()
+        with tracer.phase('layout'):
+            trans_offset, trans_start, state_offset, prog_offset = self.resolve_positions(
+                len(allocation.clock_constraints))
 
         # At this point we can resolve all variables. This map is used to resolve all instructions.
         context_map = {
             **self.data.constant_map,  # "aviTicks", "aeiTicks", etc
             **self.data.trans_map,  # "state0, v=0"
             **final_input_map,  # "AP", "V1", "v<aeiTicks", etc
-            **self.data.clock_map,  # "v"
+            **(self.data.clock_map if clocks is None else clocks.clock_map),  # "v"
             **self.data.state_map,  # "state0"
             **{k: v + prog_offset for k, v in self.data.label_map.items()}}  # "state0:"
 
@@ -219,20 +489,39 @@ class RTEMAssembler:
         '''Finished bitstrings, of arbitrary length. Will be packed into bytes later.'''
 
         # resolve clock constraints
-        resolved_lines.extend(self.data.clock_constraints)
+        resolved_lines.extend(allocation.clock_constraints)
 
         # resolve transitions
-        resolved_lines.extend(self.resolve_transition_defns())
+        with tracer.phase('layout'):
+            resolved_lines.extend(self.resolve_transition_defns(clocks))
+
+        # resolve main code body. Instructions never refer to label addresses, so the code can be
+        # compressed before the state table is resolved against the final label positions.
+        with tracer.phase('code'):
+            code_lines = self.resolve_code(context_map)
+        if self.compress and code_lines:
+            with tracer.phase('compress'):
+                code_lines, state = self.compress_code_section(code_lines)
+            context_map.update({k: v + prog_offset for k, v in state.label_map.items()})
+        else:
+            state = copy.copy(self.data)
+        state.clock_constraints = allocation.clock_constraints
+        if clocks is not None:
+            state.clock_map = clocks.clock_map
+            state.clock_divider_immediate_values = clocks.clock_divider_immediate_values
+            state.clock_joins = clocks.clock_joins
+            state.clocks_assigned = True
 
         # resolve states
-        resolved_lines.extend(
-            self.resolve_state_section(context_map, trans_offset))
+        with tracer.phase('layout'):
+            resolved_lines.extend(
+                self.resolve_state_section(context_map, trans_offset))
 
-        # resolve main code body (without optimization at this point)
-        resolved_lines.extend(self.resolve_code_section(
-            self.data.lines_unresolved, context_map))
+        resolved_lines.extend(code_lines)
 
-        main_memory = self.code_to_bytecode(resolved_lines)
+        with tracer.phase('bytecode'):
+            main_memory = self.code_to_bytecode(resolved_lines)
+        tracer.add_time('resolve', perf_counter() - start)
         return AssemblerResult(
             trans_offset=trans_offset,
             state_offset=state_offset,
@@ -241,141 +530,111 @@ class RTEMAssembler:
             clock_flags=clock_flags,
             final_input_map=final_input_map,
             main_memory=main_memory,
-            assembler_state=copy.copy(self.data)
+            assembler_state=state,
+            timings=copy.deepcopy(tracer.timings),
+            trace_events=list(tracer.events),
+            reused_blocks=list(self.reused_blocks),
+            parsed_blocks=list(self.parsed_blocks)
         )
 
     def parse_string(self, code: str) -> AssemblerResult:
-        for line in code.split('\n'):
-            self.parse_line(line)
+        self.parse_source(code)
         return self.resolve()
 
 
-def verilog_translate_symbols(name: str, bit_len: int, map: dict[Any, int], file=None):
-    tab = '    '
-    print(f'function string {name}(input [{bit_len-1}:0] bits);', file=file)
-    print(f'{tab}case(bits)', file=file)
-    for k, v in map.items():
-        print(f"{tab}{tab}{bit_len}'d{v}: {name} = \"{k}\";", file=file)
-    print(f"{tab}{tab}default: {name} = $sformatf(\"<UNRECOGNIZED %d>\", bits);", file=file)
-    print(f'{tab}endcase', file=file)
-    print('endfunction', file=file)
-
-
-def verilog_translate_ids(name: str, bit_len: int, map: dict[Any, int], file=None):
-    tab = '    '
-    print(f'function [{bit_len-1}:0] {name}(input string symbol);', file=file)
-    print(f'{tab}case(symbol)', file=file)
-    for v, k in map.items():
-        print(f"{tab}{tab}\"{v}\": {name} = {bit_len}'d{k};", file=file)
-    print(f"{tab}{tab}default: {name} = {{{bit_len}{{1'bx}}}};", file=file)
-    print(f'{tab}endcase', file=file)
-    print('endfunction', file=file)
-
-
-def verilog_set_defines(map: dict[str, int], prefix: str = "", file=None):
-    for k, v in map.items():
-        print(f'`define {prefix}{k} {v}', file=file)
-
-
-ass = RTEMAssembler(
-    'pre_ASAP',
-    inputs=dict(
-        AS=28,
-        VS=29,
-        AP=30,
-        VP=31
-    ),
-    clocks=dict(
-        # clocks
-        vevent=0,
-        v=5
-    ),
-    constants=dict(
-        # aviTicks=3, #x500x10000
-        # aeiTicks=17, #x500x10000
-        # uriTicks=4, #x1000x10000
-        # lriTicks=10  #x1000x10000
+def build_pacemaker():
+    '''
+    Assembles the pacemaker example, writing the simulation data, the symbol translation and the xdc
+    constraints wherever they changed.
+    '''
+    # Only the example build needs these, importing the assembler stays cheap
+    from .analysis import analyze
+    from .build_cache import BuildCache, BuildEntry, build_key, write_if_changed
+    from .emit import emit_artifacts, make_config
+
+    source_path = 'examples/rtem/pacemaker.rtem'
+    settings = dict(
+        initial_state='pre_ASAP',
+        inputs=dict(
+            AS=28,
+            VS=29,
+            AP=30,
+            VP=31
+        ),
+        clocks=dict(
+            # clocks
+            vevent=0,
+            v=5
+        ),
+        constants=dict(
+            # aviTicks=3, #x500x10000
+            # aeiTicks=17, #x500x10000
+            # uriTicks=4, #x1000x10000
+            # lriTicks=10  #x1000x10000
+        )
+    )
+    config_params = dict(
+        clock_divider_immediate_values=(9, 0, 0, 4),
+        clock_joins=0,
+        program_length_sub1=12,
+        # tick_length_sub1=4999999*5*5,
+        tick_length_sub1=49,
+        config_root_cell='*/top_0/inst/cfg/'
+    )
+    # config_params = dict(
+    #     clock_divider_immediate_values=(999, 0, 0, 499),
+    #     clock_joins=0,
+    #     program_length_sub1=12,
+    #     tick_length_sub1=9999)
+    xdc_config_params = dict(
+        clock_divider_immediate_values=(999, 0, 0, 499),
+        clock_joins=0,
+        program_length_sub1=12,
+        tick_length_sub1=5000-1,
+        config_root_cell='*/top_0/inst/cfg/'
     )
-)
-f = open('examples/rtem/pacemaker.rtem')
-test = f.read()
-f.close()
-for line in test.split('\n'):
-    ass.parse_line(line)
-
-print(ass.data.clock_constraints)
-result = ass.resolve()
-print('Correspondence')
-print(result.print_corresponence())
-print('clock_flags', f'{result.clock_flags: 032b}')
-print(result.final_input_map)
-print(result.assembler_state.constant_map)
-
-
-# config = RTEMConfig(
-#     state_offset=result.state_offset,
-#     trans_offset=result.trans_offset,
-#     clock_flags=result.clock_flags,
-#     clock_divider_immediate_values=(999, 0, 0, 499),
-#     clock_joins=0,
-#     program_length_sub1=12,
-#     tick_length_sub1=9999,
-#     main_memory=result.main_memory)
-
-config = RTEMConfig(
-    state_offset=result.state_offset,
-    trans_offset=result.trans_offset,
-    clock_flags=result.clock_flags,
-    clock_divider_immediate_values=(9, 0, 0, 4),
-    clock_joins=0,
-    program_length_sub1=12,
-    # tick_length_sub1=4999999*5*5,
-    tick_length_sub1=49,
-    main_memory=result.main_memory,
-    config_root_cell='*/top_0/inst/cfg/'
-)
-
-
-# config = RTEMConfig(
-#     state_offset=result.state_offset,
-#     trans_offset=result.trans_offset,
-#     clock_flags=result.clock_flags,
-#     clock_divider_immediate_values=(9, 0, 0, 4),
-#     clock_joins=0,
-#     program_length_sub1=12,
-#     tick_length_sub1=99,
-#     main_memory=result.main_memory)
-
-symbol_translation_file = open("../hdl/sim/symbol_translation.sv", 'w')
-config.to_data_file('../hdl/sim/pacemaker.txt')
-verilog_set_defines({
-    "TICK_LENGTH": config.tick_length_sub1 + 1,
-    "TICK_LENGTH_NS": (config.tick_length_sub1 + 1)*20,
-    "PROGRAM_LENGTH": config.program_length_sub1 + 1
-}, file=symbol_translation_file)
-
-verilog_translate_symbols('get_input_symbol', 5,
-                          result.final_input_map, file=symbol_translation_file)
-verilog_translate_symbols('get_clock_symbol', 3,
-                          ass.data.clock_map, file=symbol_translation_file)
-verilog_translate_symbols('get_imm_symbol', 12,
-                          ass.data.constant_map, file=symbol_translation_file)
-verilog_translate_symbols('get_trans_symbol', 5,
-                          ass.data.trans_map, file=symbol_translation_file)
-verilog_translate_symbols('get_state_symbol', 4,
-                          ass.data.state_map, file=symbol_translation_file)
-verilog_translate_ids('get_input_id', 5, result.final_input_map, file=symbol_translation_file)
-
-config2 = RTEMConfig(
-    state_offset=result.state_offset,
-    trans_offset=result.trans_offset,
-    clock_flags=result.clock_flags,
-    clock_divider_immediate_values=(999, 0, 0, 499),
-    clock_joins=0,
-    program_length_sub1=12,
-    tick_length_sub1=5000-1,
-    main_memory=result.main_memory,
-    config_root_cell='*/top_0/inst/cfg/'
-)
-
-config2.to_xdc('examples/pacemaker.xdc')
\ No newline at end of file
+    outputs = {
+        'data': '../hdl/sim/pacemaker.txt',
+        'symbols': '../hdl/sim/symbol_translation.sv',
+        'xdc': 'examples/pacemaker.xdc',
+    }
+
+    with open(source_path) as f:
+        test = f.read()
+
+    build_cache = BuildCache('.rtem_cache')
+    key = build_key(source=test, settings=settings, config=config_params, xdc_config=xdc_config_params,
+                    outputs=outputs)
+    entry = build_cache.get(key)
+    if entry is None:
+        ass = RTEMAssembler(**settings)
+        ass.parse_source(test)
+        result = ass.resolve()
+        artifacts = emit_artifacts(result, outputs, make_config(result, **config_params),
+                                   {'xdc': make_config(result, **xdc_config_params)})
+        entry = build_cache.put(key, BuildEntry(result, artifacts))
+    else:
+        print('Build cache hit', key)
+    result = entry.result
+
+    print(result.assembler_state.clock_constraints)
+    print('Correspondence')
+    print(result.print_corresponence())
+    print('clock_flags', f'{result.clock_flags: 032b}')
+    print(result.final_input_map)
+    print(result.assembler_state.constant_map)
+
+    config = make_config(result, **config_params)
+    timing = analyze(config, sorted(result.assembler_state.state_map.values()))
+    print(timing)
+    for problem in timing.check(config):
+        print('Warning:', problem)
+
+    for path, artifact in entry.artifacts.items():
+        if write_if_changed(path, artifact):
+            print('Wrote', path)
+    return result
+
+
+if __name__ == '__main__':
+    build_pacemaker()
@@ -0,0 +1,165 @@
+'''
+Batch assembly of many policies, listed in a manifest, on a process pool.
+
+A manifest is a JSON or TOML table with optional `defaults` and a `policy` list:
+
+    [defaults]
+    clocks = { vevent = 0, v = 5 }
+    inputs = { AS = 28, VS = 29, AP = 30, VP = 31 }
+    outputs = { data = "out/{name}.txt", xdc = "out/{name}.xdc" }
+
+    [[policy]]
+    name = "pacemaker"
+    source = "rtem/pacemaker.rtem"
+    initial_state = "pre_ASAP"
+    config = { tick_length_sub1 = 49 }
+
+Each policy is merged over the defaults, tables key by key. Paths are relative to the manifest, and
+output paths are formatted with the policy name. Every policy is assembled and emitted in a worker
+process of its own; a policy that fails is reported in its outcome and does not stop the batch.
+'''
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable
+
+from .helpers import load_map
+
+_TABLES = ('clocks', 'inputs', 'constants', 'config', 'outputs')
+
+
+@dataclass
+class PolicySpec:
+    name: str
+    source: str
+    '''Path of the source file'''
+    initial_state: str
+    clocks: dict[str, int] = field(default_factory=dict)
+    inputs: dict[str, int] = field(default_factory=dict)
+    constants: dict[str, int] = field(default_factory=dict)
+    config: dict[str, Any] = field(default_factory=dict)
+    '''RTEMConfig parameters, the missing lengths are fitted to the timing analysis'''
+    outputs: dict[str, str] = field(default_factory=dict)
+    '''Path of each artifact to emit (see emit.ARTIFACTS)'''
+    compress: bool = False
+    minimize: bool = False
+    peephole: bool = False
+    jump_tables: bool = False
+    assign_clocks: bool = False
+
+
+@dataclass
+class PolicyOutcome:
+    name: str
+    error: str | None = None
+    seconds: float = 0
+    '''Wall time of the worker, from reading the source to writing the outputs'''
+    timings: dict[str, float] = field(default_factory=dict)
+    '''Seconds spent in each assembler phase'''
+    written: list[str] = field(default_factory=list)
+    '''Outputs whose contents changed'''
+    warnings: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def load_manifest(path: str) -> list[PolicySpec]:
+    manifest = load_map(path)
+    root = Path(path).parent
+    defaults = manifest.get('defaults', {})
+    specs: list[PolicySpec] = []
+    for i, policy in enumerate(manifest.get('policy', [])):
+        entry = defaults | policy
+        for table in _TABLES:
+            entry[table] = defaults.get(table, {}) | policy.get(table, {})
+        try:
+            spec = PolicySpec(**entry)
+        except TypeError as e:
+            raise ValueError(f'{path}: policy {policy.get("name", i)}: {e}') from None
+        spec.source = str(root / spec.source)
+        spec.outputs = {artifact: str(root / out.format(name=spec.name)) for artifact, out in spec.outputs.items()}
+        specs.append(spec)
+
+    names = [spec.name for spec in specs]
+    if duplicates := {name for name in names if names.count(name) > 1}:
+        raise ValueError(f'{path}: duplicate policy names {", ".join(sorted(duplicates))}')
+    writers: dict[str, str] = {}
+    for spec in specs:
+        for out in spec.outputs.values():
+            if (other := writers.setdefault(out, spec.name)) != spec.name:
+                raise ValueError(f'{path}: policies {other} and {spec.name} both write {out}')
+    return specs
+
+
+def assemble_policy(spec: PolicySpec) -> PolicyOutcome:
+    '''
+    Assembles `spec` and writes its outputs. Every error is caught and reported in the outcome.
+    '''
+    from .build_cache import write_if_changed
+    from .emit import CLOCK_FIELDS, emit_artifacts, fit_config, timing_problems
+    from .main import RTEMAssembler
+    from .trace import Tracer
+
+    start = perf_counter()
+    outcome = PolicyOutcome(spec.name)
+    tracer = Tracer()
+    try:
+        with open(spec.source) as f:
+            source = f.read()
+        config_params = dict(spec.config)
+        if 'clock_divider_immediate_values' in config_params:
+            config_params['clock_divider_immediate_values'] = tuple(config_params['clock_divider_immediate_values'])
+        # The assignment starts from the configured clocks, and chooses those of the image
+        clocks = {name: config_params.pop(name) for name in CLOCK_FIELDS
+                  if spec.assign_clocks and name in config_params}
+        ass = RTEMAssembler(spec.initial_state, clocks=spec.clocks, constants=spec.constants,
+                            inputs=spec.inputs, compress=spec.compress, minimize=spec.minimize,
+                            peephole=spec.peephole, jump_tables=spec.jump_tables,
+                            assign_clocks=spec.assign_clocks, tracer=tracer, **clocks)
+        ass.parse_source(source)
+        result = ass.resolve()
+        config = fit_config(result, **config_params)
+        outcome.warnings = timing_problems(result, config)
+        for path, data in emit_artifacts(result, spec.outputs, config).items():
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            if write_if_changed(path, data):
+                outcome.written.append(path)
+    except Exception as e:
+        outcome.error = f'{type(e).__name__}: {e}'
+    outcome.timings = {phase: timing.seconds for phase, timing in tracer.timings.items()}
+    outcome.seconds = perf_counter() - start
+    return outcome
+
+
+def assemble_batch(specs: list[PolicySpec], jobs: int | None = None,
+                   on_done: Callable[[PolicyOutcome], None] | None = None) -> list[PolicyOutcome]:
+    '''
+    Assembles every policy of `specs`, returning their outcomes in the same order.
+    jobs: number of worker processes, defaults to the number of CPUs. With 1, the policies are
+        assembled in this process.
+    on_done: called with each outcome as soon as it is available
+    '''
+    outcomes: list[PolicyOutcome | None] = [None] * len(specs)
+    if jobs == 1:
+        for i, spec in enumerate(specs):
+            outcomes[i] = assemble_policy(spec)
+            if on_done:
+                on_done(outcomes[i])
+        return outcomes
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(assemble_policy, spec): i for i, spec in enumerate(specs)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                # The worker died, e.g. BrokenProcessPool
+                outcome = PolicyOutcome(specs[i].name, error=f'{type(e).__name__}: {e}')
+            outcomes[i] = outcome
+            if on_done:
+                on_done(outcome)
+    return outcomes
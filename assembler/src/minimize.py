@@ -0,0 +1,92 @@
+'''
+Minimization of the policy's Mealy machine, before layout.
+
+Every state is described by the code following its trans and edit labels. Two states are
+equivalent when their code is identical once each transition is replaced by the equivalence
+class of its next state (and its resets): they then compute the same outputs and resets for every
+input, and move to equivalent states. The classes are found by partition refinement, starting from
+the code with the next states erased.
+
+States are assumed not to fall through into the code of the label that follows them.
+'''
+from typing import Hashable
+
+from .sections import AssemblerState
+from .tokens import Bits, R, RTEMLabel, RTEMState, RTEMTransition, UnresolvedCode
+
+
+def label_blocks(data: AssemblerState) -> dict[RTEMLabel, UnresolvedCode]:
+    '''
+    Splits lines_unresolved into the code following each label, up to the next label.
+    '''
+    starts = sorted(data.label_items.items(), key=lambda item: item[1])
+    ends = [start for _, start in starts[1:]] + [len(data.lines_unresolved)]
+    return {label: data.lines_unresolved[start:end] for (label, start), end in zip(starts, ends)}
+
+
+def transitions(code: UnresolvedCode) -> list[RTEMTransition]:
+    return [r for line in code if isinstance(line, R) for r in line.requests if isinstance(r, RTEMTransition)]
+
+
+def reachable_states(data: AssemblerState, initial_state: RTEMState) -> list[RTEMState]:
+    '''
+    States reachable from `initial_state`, in order of discovery.
+    '''
+    blocks = label_blocks(data)
+    seen = [initial_state]
+    for state in seen:
+        for trans in transitions(blocks.get(state.label('trans'), [])):
+            if trans.next_state not in seen:
+                seen.append(trans.next_state)
+    return seen
+
+
+def _signature(code: UnresolvedCode, class_of: dict[RTEMState, int]) -> tuple[Hashable, ...]:
+    sig: list[Hashable] = []
+    for line in code:
+        if isinstance(line, Bits):
+            sig.append(line)
+            continue
+        # The requested values are inserted into the low bits, so the encoding with every value 0
+        # together with the requests identifies the resolved line.
+        requests = tuple(
+            (class_of.get(r.next_state, -1), frozenset(c.name for c in r.resets))
+            if isinstance(r, RTEMTransition) else r for r in line.requests)
+        sig.append((line.resolve_fn(tuple(0 for _ in line.requests)), requests))
+    return tuple(sig)
+
+
+def equivalent_states(data: AssemblerState, initial_state: RTEMState) -> dict[RTEMState, RTEMState | None]:
+    '''
+    Maps every state to the representative of its equivalence class, or to None if it cannot be
+    reached from `initial_state`. The representative is the state with the lowest id, so the initial
+    state always represents its own class.
+    '''
+    blocks = label_blocks(data)
+    reachable = sorted(reachable_states(data, initial_state), key=lambda s: data.state_map[s])
+
+    def code(state: RTEMState):
+        return blocks.get(state.label('trans')), blocks.get(state.label('edit'))
+
+    # States without code are left in classes of their own, resolve() reports them
+    class_of = {s: 0 if None not in code(s) else -1 - i for i, s in enumerate(reachable)}
+    nclasses = 0
+    while True:
+        signatures: dict[tuple[Hashable, ...], int] = {}
+        refined: dict[RTEMState, int] = {}
+        for state in reachable:
+            trans_code, edit_code = code(state)
+            if trans_code is None or edit_code is None:
+                refined[state] = class_of[state]
+                continue
+            sig = (class_of[state], _signature(trans_code, class_of), _signature(edit_code, class_of))
+            refined[state] = signatures.setdefault(sig, len(signatures))
+        class_of = refined
+        if len(signatures) == nclasses:
+            break
+        nclasses = len(signatures)
+
+    representative: dict[int, RTEMState] = {}
+    for state in reachable:
+        representative.setdefault(class_of[state], state)
+    return {s: representative[class_of[s]] if s in class_of else None for s in data.state_map}
@@ -0,0 +1,401 @@
+'''
+Peephole optimization of the code section, over lines_unresolved.
+
+The code following each label is decoded as the machine reads it (isa.DECODE), and cut into lines:
+a PSH or OP2 with the ACCs extending it. Windows of consecutive lines are rewritten by the rules of
+RULES, from the start of each run of such lines, until none applies. Every rewrite is proven before
+it is applied: the window and its replacement are run (guard.run_program) for every value of the
+inputs they read and of the two stack entries below them, and must leave the same stack.
+
+A line pushing the same value as the line before it becomes OP2 [1], which pushes a copy of the
+top entry (the ISA's only duplication). A line pushed again further down the run is left alone:
+its value is no longer on top, and copying the entry below the top (LUT 1100) has no OP2
+mnemonic, so the image could not be disassembled.
+
+Savings are counted per rule. A byte is a step, and a clock constraint no longer read in its block
+saves the step evaluating it.
+
+The labels and the source correspondence are moved with the code. A source line whose code was
+removed keeps its position, with no bits.
+'''
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Callable, Hashable, NamedTuple
+
+from .guard import GuardStep, Program, run_program
+from .isa import DECODE, ES, Op, acc_eval, lut_eval
+from .sections import AssemblerState
+from .states import encode_steps
+from .tokens import Bits, R, RTEMClockConstraint, UnresolvedCode, UnresolvedCodeline
+
+Line = Program
+'''A PSH or OP2, and its extensions'''
+
+CONSTANTS = {0b0000: 0, 0b1111: 1}
+'''LUTs of OP2 F and OP2 T'''
+
+COPY_TOP = 0b1010
+'''LUT of OP2 [1], the value of $0'''
+
+
+def encoded(item: UnresolvedCodeline) -> Bits:
+    '''
+    The encoding of a line, with 0 for each symbol it refers to
+    '''
+    return item if isinstance(item, Bits) else item.resolve_fn(tuple(0 for _ in item.requests))
+
+
+class Rule(NamedTuple):
+    name: str
+    lines: int
+    '''Lines in the window'''
+    rewrite: Callable[[list[Line]], list[Line] | None]
+    '''Replacement of the window, None if the rule does not apply'''
+
+
+def pushes(line: Line) -> bool:
+    '''
+    True if the line only pushes a value of its inputs, leaving the stack below it alone
+    '''
+    return line[0].op == Op.PSH or line[0].arg in CONSTANTS and not line[0].mode
+
+
+def literal(line: Line) -> tuple[int, int] | None:
+    '''
+    (input, negated) if the line pushes an input or its negation, such as PSH a or OP2 F |! a
+    '''
+    match line:
+        case (GuardStep(Op.PSH, i),):
+            return i, 0
+        case (GuardStep(Op.OP, lut, 0), GuardStep(Op.ACC, i, op)) if lut in CONSTANTS and CONSTANTS[lut] ^ op & 1 == 0:
+            return i, op >> 1
+    return None
+
+
+def accumulate(lut: int, below: bool, negated: int) -> int | None:
+    '''
+    The ACC operator computing lut($1, $0) from the value accumulated so far and an input, the
+    input (negated if `negated`) being $1 if `below`, else $0
+    '''
+    for op in range(4):
+        if all(acc_eval(op, acc, val) == lut_eval(lut, (val ^ negated) << 1 | acc if below else acc << 1 | val ^ negated)
+               for acc in (0, 1) for val in (0, 1)):
+            return op
+    return None
+
+
+def fold_literal(window: list[Line]) -> list[Line] | None:
+    '''
+    X; PSH b; OP2 L pop ... -> X L b ...
+    '''
+    x, b, (op, *extensions) = window
+    lit = literal(b)
+    if lit is None or op.op != Op.OP or not op.mode:
+        return None
+    acc = accumulate(op.arg, False, lit[1])
+    if acc is None:
+        return None
+    return [x + (GuardStep(Op.ACC, lit[0], acc), *extensions)]
+
+
+def fold_literal_below(window: list[Line]) -> list[Line] | None:
+    '''
+    PSH b; X; OP2 L pop ... -> X L' b ..., when X only pushes a value of its inputs
+    '''
+    b, x, (op, *extensions) = window
+    lit = literal(b)
+    if lit is None or not pushes(x) or op.op != Op.OP or not op.mode:
+        return None
+    acc = accumulate(op.arg, True, lit[1])
+    if acc is None:
+        return None
+    return [x + (GuardStep(Op.ACC, lit[0], acc), *extensions)]
+
+
+def repeated_input(window: list[Line]) -> list[Line] | None:
+    '''
+    PSH a op a -> PSH a, OP2 T or OP2 F; ... op a op' a ... -> ... op'' a ... or ...
+    '''
+    line, = window
+    for j in range(len(line) - 1):
+        first, second = line[j], line[j + 1]
+        if second.op != Op.ACC or first.op == Op.OP or first.arg != second.arg:
+            continue
+        if first.op == Op.PSH:
+            values = [acc_eval(second.mode, a, a) for a in (0, 1)]
+            if values == [0, 1]:
+                head = (first,)
+            elif values[0] == values[1]:
+                head = (GuardStep(Op.OP, 0b1111 if values[0] else 0b0000),)
+            else:
+                continue
+            return [head + line[j + 2:]]
+        # Two ACCs of the same input
+        for replacement in ((), *((GuardStep(Op.ACC, first.arg, op),) for op in range(4))):
+            if all(acc_eval(second.mode, acc_eval(first.mode, acc, val), val) ==
+                   (acc_eval(replacement[0].mode, acc, val) if replacement else acc)
+                   for acc in (0, 1) for val in (0, 1)):
+                return [line[:j] + replacement + line[j + 2:]]
+    return None
+
+
+def constant_extension(window: list[Line]) -> list[Line] | None:
+    '''
+    OP2 T | a -> OP2 T; OP2 F | a -> PSH a
+    '''
+    line, = window
+    if len(line) < 2 or line[0].op != Op.OP or line[0].mode or line[0].arg not in CONSTANTS:
+        return None
+    acc = CONSTANTS[line[0].arg] ^ line[1].mode & 1
+    if acc:
+        return [(GuardStep(Op.OP, 0b1111),) + line[2:]]
+    if not line[1].mode >> 1:
+        return [(GuardStep(Op.PSH, line[1].arg),) + line[2:]]
+    return None
+
+
+def dropped_push(window: list[Line]) -> list[Line] | None:
+    '''
+    X; Y; OP2 [1] pop ... -> Y ..., when X and Y only push values of their inputs
+    '''
+    x, y, (op, *extensions) = window
+    if not pushes(x) or not pushes(y) or op != GuardStep(Op.OP, 0b1010, 1):
+        return None
+    return [y + tuple(extensions)]
+
+
+def repeated_push(window: list[Line]) -> list[Line] | None:
+    '''
+    X; X -> X; OP2 [1], when X only pushes a value of its inputs and is longer than a byte
+    '''
+    x, y = window
+    if x != y or len(x) < 2 or not pushes(x):
+        return None
+    return [x, (GuardStep(Op.OP, COPY_TOP),)]
+
+
+RULES: tuple[Rule, ...] = (
+    Rule('repeated-input', 1, repeated_input),
+    Rule('constant-extension', 1, constant_extension),
+    Rule('dropped-push', 3, dropped_push),
+    Rule('fold-literal', 3, fold_literal),
+    Rule('fold-literal-below', 3, fold_literal_below),
+    Rule('repeated-push', 2, repeated_push),
+)
+'''Rules, tried in order at each window'''
+
+
+@dataclass
+class RuleSavings:
+    rewrites: int = 0
+    bytes: int = 0
+    cycles: int = 0
+
+
+@dataclass
+class PeepholeReport:
+    rules: dict[str, RuleSavings] = field(default_factory=lambda: {rule.name: RuleSavings() for rule in RULES})
+
+    @property
+    def bytes(self) -> int:
+        return sum(s.bytes for s in self.rules.values())
+
+    @property
+    def cycles(self) -> int:
+        return sum(s.cycles for s in self.rules.values())
+
+
+def prove(before: Program, after: Program):
+    '''
+    Checks that both programs leave the same stack, whatever their inputs and the two stack entries
+    below them.
+    '''
+    inputs = {i: j for j, i in enumerate(dict.fromkeys(s.arg for s in before if s.op != Op.OP))}
+    before, after = ([s._replace(arg=inputs[s.arg]) if s.op != Op.OP else s for s in steps]
+                     for steps in (before, after))
+    for values in range(1 << len(inputs)):
+        for below in range(4):
+            stack = [below & 1, below >> 1]
+            assert run_program(before, values, stack) == run_program(after, values, stack), \
+                f'{before} -> {after} differs for inputs {values:b}, stack {stack}'
+
+
+class CodeBlock:
+    '''
+    The code following a label, decoded into runs of lines as the machine reads it
+    '''
+
+    def __init__(self, machine: str, items: UnresolvedCode):
+        self.symbols: list[Hashable] = []
+        self.runs: list[list[list[tuple[GuardStep, int]]]] = []
+        '''Runs of consecutive lines, of steps with the index of their item'''
+        self.other: list[int] = []
+        '''Items which are not in a line'''
+        tables = DECODE[machine]
+        es = ES.STD
+        run: list[list[tuple[GuardStep, int]]] = []
+        for n, item in enumerate(items):
+            code = encoded(item)
+            insn = tables[es][code.value] if code.width == 8 else None
+            step = None
+            if insn is None:
+                pass
+            elif insn.op == Op.PSH and es == ES.STD:
+                step = GuardStep(Op.PSH, self.symbol(item, insn.b))
+                es = ES.ACC if insn.a else ES.STD
+            elif insn.op == Op.OP and es == ES.STD:
+                step = GuardStep(Op.OP, insn.c, insn.b)
+                es = ES.ACC if insn.a else ES.STD
+            elif insn.op == Op.ACC and es == ES.ACC:
+                step = GuardStep(Op.ACC, self.symbol(item, insn.c), insn.a)
+                es = ES.ACC if insn.b else ES.STD
+            elif insn.op == Op.ACC:
+                es = ES.E_ACC if insn.b else ES.E_EDIT
+            elif insn.op == Op.VIO:
+                es = ES.E_ACC if insn.a else ES.E_EDIT
+            elif insn.op == Op.EDI:
+                es = ES.E_EDIT if insn.c else ES.STD
+            if step is None:
+                self.other.append(n)
+                if run:
+                    self.runs.append(run)
+                    run = []
+            elif step.op == Op.ACC:
+                run[-1].append((step, n))
+            else:
+                run.append([(step, n)])
+        if run:
+            self.runs.append(run)
+
+    def symbol(self, item: UnresolvedCodeline, slot: int) -> int:
+        key = item.requests[0] if isinstance(item, R) else slot
+        if key not in self.symbols:
+            self.symbols.append(key)
+        return self.symbols.index(key)
+
+    def reads(self, exclude: frozenset[int] = frozenset()) -> set[int]:
+        return {step.arg for run in self.runs for line in run for step, n in line
+                if step.op != Op.OP and n not in exclude}
+
+
+def optimize_run(block: CodeBlock, run: list[list[tuple[GuardStep, int]]], report: PeepholeReport):
+    '''
+    Rewrites the lines of a run in place. The steps of a replacement take the items of the steps
+    they replace, in order, so that they stay in the source lines of the window.
+    '''
+    i = 0
+    while i < len(run):
+        for rule in RULES:
+            window = run[i:i + rule.lines]
+            if len(window) < rule.lines:
+                continue
+            lines = [tuple(step for step, _ in line) for line in window]
+            replacement = rule.rewrite(lines)
+            if replacement is None:
+                continue
+            before = tuple(step for line in lines for step in line)
+            after = tuple(step for line in replacement for step in line)
+            prove(before, after)
+            items = [n for line in window for _, n in line]
+            it = iter(items)
+            run[i:i + rule.lines] = [[(step, next(it)) for step in line] for line in replacement]
+            # Clock constraints still read elsewhere in the block are evaluated anyway
+            unread = {s.arg for s in before if s.op != Op.OP} - {s.arg for s in after if s.op != Op.OP}
+            unread -= block.reads(frozenset(items))
+            savings = report.rules[rule.name]
+            savings.rewrites += 1
+            savings.bytes += len(before) - len(after)
+            savings.cycles += len(before) - len(after) + sum(
+                isinstance(block.symbols[s], RTEMClockConstraint) for s in unread)
+            # A rewrite may let the rules apply to the lines before it
+            i = max(0, i - 2)
+            break
+        else:
+            i += 1
+
+
+def optimize(data: AssemblerState) -> PeepholeReport:
+    '''
+    Applies the rules to the code of every label, updating the labels, the source correspondence
+    and the position of the code end.
+    '''
+    report = PeepholeReport()
+    lines = data.lines_unresolved
+    starts = sorted(data.label_items.items(), key=lambda item: item[1])
+    bounds = [0, *(start for _, start in starts), len(lines)]
+    new_lines: UnresolvedCode = []
+    origin: list[int] = []
+    '''Item of lines_unresolved each new line replaces'''
+    for begin, end in zip(bounds, bounds[1:]):
+        if begin == end:
+            continue
+        label = next((label for label, start in starts if start == begin), None)
+        if label is None:
+            # Code before the first label is not reached from the state table
+            new_lines.extend(lines[begin:end])
+            origin.extend(range(begin, end))
+            continue
+        block = CodeBlock(label.section, lines[begin:end])
+        for run in block.runs:
+            optimize_run(block, run, report)
+        kept: list[tuple[int, UnresolvedCodeline]] = [(n, lines[begin + n]) for n in block.other]
+        for run in block.runs:
+            for line in run:
+                code = encode_steps(tuple(step for step, _ in line), block.symbols)
+                kept.extend((n, item) for (_, n), item in zip(line, code))
+        kept.sort(key=lambda k: k[0])
+        new_lines.extend(item for _, item in kept)
+        origin.extend(begin + n for n, _ in kept)
+    if report.bytes:
+        relocate(data, new_lines, origin)
+    return report
+
+
+def relocate(data: AssemblerState, lines: UnresolvedCode, origin: list[int]):
+    '''
+    Replaces lines_unresolved by `lines`, where lines[j] replaces the item origin[j] (in increasing
+    order), moving the labels, the source correspondence and the position of the code end.
+    '''
+    # Positions of the new lines, as the sections advance
+    bit = 0
+    cursor: list[int] = []
+    '''Bit before each new line, then the end of the code'''
+    for item in lines:
+        cursor.append(bit)
+        width = encoded(item).width
+        if bit % 8 and bit % 8 + width > 8:
+            bit = (bit + 7) // 8 * 8
+        bit += width
+    cursor.append(bit)
+
+    def first_line(item: int) -> int:
+        '''Index of the first new line replacing an item at or after `item`'''
+        return bisect_left(origin, item)
+
+    for label, item in data.label_items.items():
+        data.label_items[label] = first_line(item)
+        data.label_map[label] = cursor[first_line(item)] // 8
+
+    old = data.lines_unresolved
+    widths = [encoded(item).width for item in old]
+    positions: dict[int, list[int]] = {}
+    for j, n in enumerate(origin):
+        positions.setdefault(n, []).append(j)
+    correspondence = []
+    item = 0
+    for start, length, source in data.code_correspondence:
+        owned = []
+        while length > 0 and item < len(old):
+            owned.append(item)
+            length -= widths[item]
+            item += 1
+        new = [j for n in owned for j in positions.get(n, ())]
+        if new:
+            correspondence.append((cursor[new[0]], sum(encoded(lines[j]).width for j in new), source))
+        else:
+            correspondence.append((cursor[first_line(item)], 0, source))
+    data.code_correspondence = correspondence
+    data.lines_unresolved = lines
+    data.current_bit = bit
+    data.current_address = bit // 8
+    data.byte_pos = bit % 8
@@ -2,8 +2,9 @@
 
 from .code_printer import CodePrinter
 from .sections import AssemblerState
-from .tokens import ByteCode, RTEMInput
-from dataclasses import dataclass
+from .tokens import ByteCode, RTEMInput, RTEMLabel
+from .trace import PhaseTiming, TraceEvent
+from dataclasses import dataclass, field
 
 
 @dataclass
@@ -21,6 +22,15 @@ class AssemblerResult:
     The assember state at the time of this result.
     '''
 
+    timings: dict[str, PhaseTiming] = field(default_factory=dict)
+    '''Time spent in each phase of the assembler (see trace.Tracer.timings)'''
+    trace_events: list[TraceEvent] = field(default_factory=list)
+    '''Events recorded by the tracer up to this result'''
+    reused_blocks: list[RTEMLabel] = field(default_factory=list)
+    '''Labelled blocks taken from the incremental cache'''
+    parsed_blocks: list[RTEMLabel] = field(default_factory=list)
+    '''Labelled blocks parsed and added to the incremental cache'''
+
     def print_corresponence(self):
         printer = CodePrinter(self.main_memory)
         lines: list[str] = []
@@ -33,7 +43,8 @@ class AssemblerResult:
         lines.extend(printer.accept(
             8*(self.prog_offset - self.state_offset), '.state_offset'))
 
-        self.assembler_state.code_correspondence.sort()
+        # By start, lines at the same bit (such as labels, or lines without code) in source order
+        self.assembler_state.code_correspondence.sort(key=lambda c: c[0])
         prev_end = 0
         for start, length, line in self.assembler_state.code_correspondence:
             assert prev_end <= start
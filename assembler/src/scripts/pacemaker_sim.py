@@ -1,11 +1,165 @@
-from dataclasses import dataclass
-from typing import Literal
+from dataclasses import dataclass, field
+from typing import Literal, Protocol
+import argparse
+import mmap
+import os
+import signal
 import subprocess
-from time import time
+import sys
+from time import monotonic_ns, perf_counter, perf_counter_ns, sleep, time
     
 GPIO_BASE = 0xA0000000
 GPIO_READ_ACK_BASE = 0xA0000008
 
+
+class GPIOBackend(Protocol):
+    def read32(self, addr: int) -> int: ...
+    def write32(self, addr: int, value: int): ...
+
+
+class DevmemGPIO:
+    '''
+    Accesses the GPIO registers by running `devmem` for every access. Slow, but needs no setup.
+    '''
+
+    def read32(self, addr: int) -> int:
+        return int(subprocess.run(['devmem', f'0x{addr:08x}', '32'], capture_output=True, text=True).stdout, 16)
+
+    def write32(self, addr: int, value: int):
+        subprocess.run(['devmem', f'0x{addr:08x}', '32', f'0x{value:08x}'])
+
+
+class MmapGPIO:
+    '''
+    Maps the page holding the GPIO registers once, and accesses them in place as 32 bit words.
+
+    `path` defaults to /dev/mem, in which case `base` must be the page aligned physical address
+    of the registers. Any other path is treated as a regular file standing in for the registers
+    (see `FileGPIO`).
+    '''
+
+    def __init__(self, path: str = '/dev/mem', base: int = GPIO_BASE, length: int = mmap.PAGESIZE,
+                 file_offset: int | None = None):
+        self.base = base
+        fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            self.mem = mmap.mmap(fd, length, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE,
+                                 offset=base if file_offset is None else file_offset)
+        finally:
+            os.close(fd)
+        self.words = memoryview(self.mem).cast('I')
+
+    def read32(self, addr: int) -> int:
+        return self.words[(addr - self.base) >> 2]
+
+    def write32(self, addr: int, value: int):
+        self.words[(addr - self.base) >> 2] = value
+
+    def close(self):
+        self.words.release()
+        self.mem.close()
+
+
+class FileGPIO(MmapGPIO):
+    '''
+    File backed stand-in for `MmapGPIO`, so the loop can be run and benchmarked without the
+    hardware. Another process can drive the inputs by writing to the file.
+    '''
+
+    def __init__(self, path: str = 'gpio.bin', base: int = GPIO_BASE, length: int = mmap.PAGESIZE):
+        with open(path, 'ab') as f:
+            if f.tell() < length:
+                f.truncate(length)
+        super().__init__(path, base, length, file_offset=0)
+
+
+class Histogram:
+    '''
+    Log-linear (HDR style) histogram of non-negative integer values, typically nanoseconds.
+
+    Values below 2**sub_bucket_bits are counted exactly. Above that, every power of two range is
+    split into 2**(sub_bucket_bits-1) equal buckets, so the relative error stays below
+    2**(1-sub_bucket_bits) over the whole range while recording stays O(1).
+    '''
+
+    def __init__(self, name: str, sub_bucket_bits: int = 7, max_value_bits: int = 40):
+        self.name = name
+        self.sub_bucket_bits = sub_bucket_bits
+        self.half_bits = sub_bucket_bits - 1
+        self.counts = [0] * ((max_value_bits - sub_bucket_bits + 2) << self.half_bits)
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def index(self, value: int) -> int:
+        shift = value.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return value
+        return (shift << self.half_bits) + (value >> shift)
+
+    def lowest_value(self, index: int) -> int:
+        '''
+        Smallest value counted in bucket `index`
+        '''
+        if index < 1 << self.sub_bucket_bits:
+            return index
+        shift = (index >> self.half_bits) - 1
+        return (index - (shift << self.half_bits)) << shift
+
+    def record(self, value: int):
+        value = max(value, 0)
+        self.counts[min(self.index(value), len(self.counts) - 1)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    def percentile(self, p: float) -> int:
+        '''
+        Upper bound of the bucket containing the `p`th percentile
+        '''
+        target = max(1, -(-self.total * p // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.lowest_value(index + 1) - 1, self.max)
+        return self.max
+
+    def dump(self, out=sys.stderr, scale: float = 1e-3, unit: str = 'us'):
+        if not self.total:
+            print(f'{self.name}: no samples', file=out)
+            return
+        print(f'{self.name} ({unit}): n={self.total} min={self.min * scale:.1f} '
+              f'mean={self.sum / self.total * scale:.1f} max={self.max * scale:.1f}', file=out)
+        for p in (50, 90, 99, 99.9, 99.99, 100):
+            print(f'  p{p:<6} {self.percentile(p) * scale:12.1f}', file=out)
+
+
+@dataclass
+class LoopStats:
+    period_jitter: Histogram = field(default_factory=lambda: Histogram('period jitter'))
+    '''Absolute difference between the measured and nominal update period'''
+    read_latency: Histogram = field(default_factory=lambda: Histogram('io read latency'))
+    '''Time taken by the GPIO read and its acknowledgement'''
+    reaction_time: Histogram = field(default_factory=lambda: Histogram('sense to pace'))
+    '''Time from sampling the inputs to completing the pace write they caused'''
+    overruns: int = 0
+    '''Deadlines skipped because an update ran past the following deadline'''
+
+    def dump(self, out=sys.stderr):
+        for histogram in (self.period_jitter, self.read_latency, self.reaction_time):
+            histogram.dump(out)
+        print(f'overruns: {self.overruns}', file=out)
+
+
+BACKENDS = {
+    'mmap': MmapGPIO,
+    'file': FileGPIO,
+    'devmem': DevmemGPIO,
+}
+
 @dataclass
 class Pacemaker:
     # params    
@@ -17,6 +171,11 @@ class Pacemaker:
     clk: float = 0
     io: int = 0
 
+    # No default: opening a backend is I/O (MmapGPIO maps /dev/mem), left to the caller
+    gpio: GPIOBackend = field(kw_only=True)
+    stats: LoopStats | None = None
+    sample_time: int = 0
+
     def update(self, dt: float):
         self.clk += dt
         self.update_io()
@@ -38,15 +197,20 @@ class Pacemaker:
                 self.clk -= (1-self.duty_cycle)/self.rate
 
     def write_io(self, value: int):
-        subprocess.run(['devmem', f'0x{GPIO_BASE:08x}', '32', f'0x{1<<value:08x}'])
-        subprocess.run(['devmem', f'0x{GPIO_BASE:08x}', '32', '0x00000000'])
+        self.gpio.write32(GPIO_BASE, 1 << value)
+        self.gpio.write32(GPIO_BASE, 0)
+        if self.stats:
+            self.stats.reaction_time.record(perf_counter_ns() - self.sample_time)
         # print('written', value)
 
     def update_io(self):
-        self.io = int(subprocess.run(['devmem', f'0x{GPIO_BASE:08x}', '32'], capture_output=True, text=True).stdout, 16)
+        self.sample_time = perf_counter_ns()
+        self.io = self.gpio.read32(GPIO_BASE)
         # indicate io has been read
-        subprocess.run(['devmem', f'0x{GPIO_READ_ACK_BASE:08x}', '1', '1'])
-        subprocess.run(['devmem', f'0x{GPIO_READ_ACK_BASE:08x}', '1', '0'])
+        self.gpio.write32(GPIO_READ_ACK_BASE, 1)
+        self.gpio.write32(GPIO_READ_ACK_BASE, 0)
+        if self.stats:
+            self.stats.read_latency.record(perf_counter_ns() - self.sample_time)
 
     def check_atrial_sense(self):
         return bool(self.io & (1 << 30))
@@ -61,8 +225,83 @@ class Pacemaker:
         self.write_io(31)
 
 
+def wait_until(deadline: int, spin: int):
+    '''
+    Wait until the monotonic time `deadline` (ns). Sleeps until `spin` ns before the deadline, then
+    busy waits for the remainder, trading CPU time for wakeup accuracy.
+    '''
+    remaining = deadline - monotonic_ns() - spin
+    if remaining > 0:
+        sleep(remaining * 1e-9)
+    while monotonic_ns() < deadline:
+        pass
+
+
+def run_fixed_rate(pacemaker: Pacemaker, period: float, spin: float = 0, duration: float | None = None):
+    '''
+    Run `pacemaker.update` every `period` seconds against monotonic deadlines, so that lateness in
+    one update does not accumulate. If an update overruns the next deadline, the missed deadlines
+    are skipped and counted rather than run back to back.
+    '''
+    stats = pacemaker.stats
+    period_ns = round(period * 1e9)
+    spin_ns = round(spin * 1e9)
+    start = last = monotonic_ns()
+    deadline = start + period_ns
+    end = None if duration is None else start + round(duration * 1e9)
+    while end is None or deadline <= end:
+        wait_until(deadline, spin_ns)
+        now = monotonic_ns()
+        dt = now - last
+        last = now
+        if stats:
+            stats.period_jitter.record(abs(dt - period_ns))
+        pacemaker.update(dt * 1e-9)
+        pacemaker.rate += 0.1 * dt * 1e-9
+
+        deadline += period_ns
+        now = monotonic_ns()
+        if now >= deadline:
+            missed = (now - deadline) // period_ns + 1
+            deadline += missed * period_ns
+            if stats:
+                stats.overruns += missed
+
+
 if __name__ == '__main__':
-    pacemaker = Pacemaker()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', choices=BACKENDS, default='mmap')
+    parser.add_argument('--gpio-file', default='gpio.bin', help='backing file for the file backend')
+    parser.add_argument('--benchmark', type=int, metavar='N', help='time N updates and exit')
+    parser.add_argument('--period', type=float, help='run updates at a fixed period (s) instead of free running')
+    parser.add_argument('--spin', type=float, default=0, help='busy wait for the last SPIN seconds before each deadline')
+    parser.add_argument('--duration', type=float, help='stop after DURATION seconds')
+    parser.add_argument('--stats', action='store_true',
+                        help='record timing histograms, dumped to stderr on SIGUSR1 and at exit')
+    args = parser.parse_args()
+
+    gpio = FileGPIO(args.gpio_file) if args.backend == 'file' else BACKENDS[args.backend]()
+    pacemaker = Pacemaker(gpio=gpio, stats=LoopStats() if args.stats else None)
+
+    if args.period:
+        if pacemaker.stats:
+            signal.signal(signal.SIGUSR1, lambda *_: pacemaker.stats.dump())
+        try:
+            run_fixed_rate(pacemaker, args.period, args.spin, args.duration)
+        except KeyboardInterrupt:
+            pass
+        if pacemaker.stats:
+            pacemaker.stats.dump()
+        exit()
+
+    if args.benchmark:
+        start = perf_counter()
+        for _ in range(args.benchmark):
+            pacemaker.update(0)
+        elapsed = perf_counter() - start
+        print(f'{args.benchmark} updates in {elapsed:.3f}s ({args.benchmark / elapsed:.0f} Hz)')
+        exit()
+
     t = time()
     while True:
         tnew = time() 
@@ -1,10 +1,12 @@
 from .code_printer import CodePrinter
-import re
 
 from typing import Any, ClassVar, TypeVar, Mapping, TypeVarTuple
 from .states import State, STD, TAB, EDIT, Commands
-from .tokens import RTEMClock, RTEMConstant, RTEMInput, RTEMTransition, RTEMVar, R, RTEMClockConstraint, RTEMLabel, RTEMState, ByteCode
-from .helpers import grouper, parse_re, ParsingException, parse_int
+from .tokens import Bits, RTEMClock, RTEMConstant, RTEMInput, RTEMTransition, RTEMVar, R, RTEMClockConstraint, RTEMLabel, RTEMState, ByteCode
+from .helpers import grouper, ParsingException, parse_int
+from .incremental import ParsedBlock
+from .lexer import Token, TokenKind
+from .trace import Level, Tracer
 from dataclasses import dataclass, field
 import copy
 
@@ -14,11 +16,6 @@ TT = TypeVarTuple('TT')
 
 
 
-def should_ignore_line(line: str, ignore_metadata: bool = False):
-    line = line.split('#')[0].strip()
-    return not line or (ignore_metadata and (line.startswith('.') or line.endswith(':')))
-
-
 @dataclass
 class AssemblerState:
     constant_map: dict[RTEMConstant, int] = field(default_factory=dict)
@@ -41,6 +38,9 @@ class AssemblerState:
     state_map: dict[RTEMState, int] = field(default_factory=dict)
     '''Map between state and it's id'''
 
+    state_aliases: dict[RTEMState, RTEMState] = field(default_factory=dict)
+    '''States replaced by an equivalent state in every transition (see minimize.py)'''
+
     # self.trans_map_adjacency: dict[int, list[int]] = {}
     # For each transition, store the index of the other transitions it is found with
     # we need to store this in or
@@ -49,6 +49,9 @@ class AssemblerState:
 
     lines_unresolved: list[str | R] = field(default_factory=list)
 
+    label_items: dict[RTEMLabel, int] = field(default_factory=dict)
+    '''Index in lines_unresolved of the first line following each label'''
+
     current_address: int = 0
     current_line: int = 0
     current_bit: int = 0
@@ -57,7 +60,8 @@ class AssemblerState:
 
     nclock_constraints: int = 0
 
-    clock_constraints: list[str] = field(default_factory=list)
+    clock_constraints: list[Bits] = field(default_factory=list)
+    '''Clock constraint region of the resolved image'''
 
     code: list[str] = field(default_factory=list)
     '''Each line of code'''
@@ -70,9 +74,14 @@ class AssemblerState:
     Guaranteed that the sections are non-overlapping.
     '''
 
+    tracer: Tracer = field(default_factory=Tracer)
+
     # Other config
     clock_divider_immediate_values: tuple[int, int, int, int] = (0, 0, 0, 0)
     clock_joins: int = 0
+    clocks_assigned: bool = False
+    '''clock_map, clock_divider_immediate_values and clock_joins were chosen by assign_clocks (see
+    clocks.py), and the configuration must use them'''
     program_length: int = 0  # 12
     tick_length: int = 0  # 24
 
@@ -83,28 +92,35 @@ class Section:
 
     class_map: ClassVar[dict[str, type['Section']]] = {}
 
+    timing_key: ClassVar[str] = 'parse:'
+    '''Key under which the time spent parsing this section is recorded'''
+
     def __init_subclass__(cls) -> None:
         if hasattr(cls, 'name'):
+            cls.timing_key = f'parse:{cls.name}'
             assert cls.name not in cls.class_map, f"Error while creating {cls} subclassing Section: class name {cls.name} is already defined for class {cls.class_map[cls.name]}"
             cls.class_map[cls.name] = cls
 
     def __init__(self, data: AssemblerState):
         self.ass = data
 
-    def parse_line(self, line: str):
+    def parse_line(self, line: str, toks: list[Token]):
+        '''
+        line: the source line, toks: its tokens
+        '''
         ...
 
 
 class CodeSection(Section):
     is_edit: ClassVar[bool]
 
-    def check_label(self, line: str) -> str | None:
+    @staticmethod
+    def check_label(toks: list[Token]) -> str | None:
         '''
         Checks if a line is a label. If it is, returns the label name.
         '''
-        match = re.match(r'([A-Za-z0-9_]+):', line.strip())
-        if match:
-            return match.group(1)
+        if toks and toks[0].kind is TokenKind.LABEL:
+            return toks[0].value
         return None
 
     def advance(self, bits: int):
@@ -116,18 +132,20 @@ class CodeSection(Section):
         self.ass.current_bit += bits
         self.ass.current_address = self.ass.current_bit // 8
         self.ass.byte_pos = self.ass.current_bit % 8
-        print(f'addr {self.ass.current_address}:{self.ass.byte_pos}')
+        self.ass.tracer('parse', Level.DEBUG, 'addr %d:%d', self.ass.current_address, self.ass.byte_pos)
 
     def add_clock_constraint(self, identity: RTEMClockConstraint):
         if identity in self.ass.input_map:
             return
-        self.ass.input_map[identity] = len(self.ass.clock_constraints)
+        # Encoded when the slots are allocated, once the clocks are known (see RTEMAssembler.resolve_inputs)
+        self.ass.input_map[identity] = self.ass.nclock_constraints
         self.ass.nclock_constraints += 1
-        # Clock constraints can be resolved directly to bytes
-        self.ass.clock_constraints.extend(
-            identity.resolve_defn(self.ass.clock_map, self.ass.constant_map))
 
     def process_ref(self, ref: R):
+        if self.ass.state_aliases:
+            ref.requests = tuple(
+                RTEMTransition(self.ass.state_aliases.get(r.next_state, r.next_state), r.resets)
+                if isinstance(r, RTEMTransition) else r for r in ref.requests)
         for r in ref.requests:
             if isinstance(r, RTEMClockConstraint):
                 self.add_clock_constraint(r)
@@ -141,23 +159,24 @@ class CodeSection(Section):
                 if r.name not in self.ass.input_map:
                     self.ass.input_vars.append(r)
 
-    def parse_line(self, line: str):
-        if should_ignore_line(line) or line.startswith('.'):
+    def parse_line(self, line: str, toks: list[Token]):
+        if not toks or toks[0].kind is TokenKind.SECTION:
             self.ass.code_correspondence.append(
                 (self.ass.current_bit, 0, line))
             return
 
-        if lab := self.check_label(line):
+        if lab := self.check_label(toks):
             # note down the address of the label, relative to the first intruction.
             # Note that this is not the absolute address, as there is a preamble before the first instruciton.
             # this will be resolved in the final pass.
-            self.ass.label_map[RTEMLabel(
-                lab, 'edit' if self.is_edit else 'trans')] = self.ass.current_address
+            label = RTEMLabel(lab, 'edit' if self.is_edit else 'trans')
+            self.ass.label_map[label] = self.ass.current_address
+            self.ass.label_items[label] = len(self.ass.lines_unresolved)
             self.ass.code_correspondence.append(
                 (self.ass.current_bit, 0, line))
             return
 
-        self.ass.state, res, n = self.ass.state.ingest(line)
+        self.ass.state, res, n = self.ass.state.ingest(toks)
         if self.is_edit:
             if isinstance(self.ass.state, TAB):
                 raise ParsingException(
@@ -167,7 +186,7 @@ class CodeSection(Section):
                 raise ParsingException(
                     self.ass.state, line, "EDI instructions not allowed in trans section")
 
-        print(':::', res)
+        self.ass.tracer('parse', Level.DEBUG, '::: %s', res)
         # Register all the tokens we saw along the way.
         for s in res:
             if isinstance(s, R):
@@ -177,6 +196,27 @@ class CodeSection(Section):
         self.advance(n)
 
 
+    def replay_block(self, label_name: str, block: ParsedBlock):
+        '''
+        Applies the parse output of a cached block, as if its lines had just been parsed.
+        '''
+        label = RTEMLabel(label_name, 'edit' if self.is_edit else 'trans')
+        start = self.ass.current_bit
+        self.ass.label_map[label] = self.ass.current_address
+        self.ass.label_items[label] = len(self.ass.lines_unresolved)
+        self.ass.code_correspondence.extend((start + bit, n, line) for bit, n, line in block.correspondence)
+        for s in block.code:
+            if isinstance(s, R):
+                # process_ref may rewrite the requests, the cached block must stay untouched
+                s = copy.copy(s)
+                self.process_ref(s)
+            self.ass.lines_unresolved.append(s)
+        self.ass.current_bit = start + block.nbits
+        self.ass.current_address = self.ass.current_bit // 8
+        self.ass.byte_pos = self.ass.current_bit % 8
+        self.ass.state = block.end_state
+
+
 class EditSection(CodeSection):
     is_edit = True
     name = 'NextEdits'
@@ -190,11 +230,18 @@ class TransSection(CodeSection):
 class ConstSection(Section):
     name = 'Constants'
 
-    def parse_line(self, line: str):
-        if should_ignore_line(line, ignore_metadata=True):
+    def parse_line(self, line: str, toks: list[Token]):
+        if not toks or toks[0].kind in (TokenKind.SECTION, TokenKind.LABEL):
             return
-        name, val = parse_re(self, line.strip(), r"^(\w+)\s*=\s*(\w+)$")
-        val = parse_int(val)
+        match toks:
+            case [Token(kind=TokenKind.ASSIGN, value=(name, val))]:
+                pass
+            # Values that are not lexed as numbers, such as hex digits
+            case ([Token(kind=TokenKind.COMPARE, value=(name, '=', rhs))]
+                  | [Token(kind=TokenKind.NAME, text=name), Token(kind=TokenKind.OP, text='='), Token(text=rhs)]):
+                val = parse_int(rhs)
+            case _:
+                raise ParsingException(self, line, 'Expected <name>=<value>')
         if val is None:
             raise ParsingException(
                 self, line, "Value of rhs of declaration unrecognized")
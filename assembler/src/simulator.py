@@ -0,0 +1,418 @@
+'''
+Cycle-accurate simulator of the RTEM controller, for checking assembled images without running
+the Verilog testbenches.
+
+The model follows the register transfers of hdl/src/controller.v and its datapath modules:
+- The transition machine (T) performs its A cycle on even clock cycles and its B cycle on odd
+  clock cycles. The edit machine (E) is offset by one cycle.
+- Inputs are loaded, and stacks cleared, on the setup event (global clock 0). Outputs are latched
+  and the clocks advance on the flush event (global clock 2*program_length_sub1 + 1).
+- Clock constraints are evaluated on demand in the CLK execution states, and cached in IN until
+  the next setup.
+- The transition table is laid out as emitted by the assembler: state nibbles below
+  `trans_offset` (RA), reset bytes from `trans_offset` upwards (PC).
+
+DO follows the ISA table in README.md (JC<=n+2, PC<=PC+1+VAR). controller.v does not yet route
+the DO offset into the PC adder.
+'''
+from dataclasses import dataclass, field
+from typing import Iterable, Mapping
+
+from .config import RTEMConfig
+from .isa import DECODE, CLK_DECODE, TRUNC_MASK, ES, Op, STACK_MASK
+from .result import AssemblerResult
+
+T = 0
+E = 1
+
+_FINISH = int(ES.FINISH)
+_SETUP = int(ES.SETUP)
+_INIT = int(ES.INIT)
+_STD = int(ES.STD)
+_ACC = int(ES.ACC)
+_E_ACC = int(ES.E_ACC)
+_PSH_CLK = int(ES.PSH_CLK)
+_ACC_CLK = int(ES.ACC_CLK)
+_E_ACC_CLK = int(ES.E_ACC_CLK)
+_T_NXT = int(ES.T_NXT)
+_T_TRA = int(ES.T_TRA)
+_T_RST = int(ES.T_RST)
+_E_EDIT = int(ES.E_EDIT)
+
+_CLK_STATES = (_PSH_CLK, _ACC_CLK, _E_ACC_CLK)
+
+_STD_DECODE = (DECODE['trans'][ES.STD], DECODE['edit'][ES.STD])
+_PSH, _OP, _DO, _NXT1, _NXT2, _VIO = Op.PSH, Op.OP, Op.DO, Op.NXT1, Op.NXT2, Op.VIO
+
+_DIVIDED_CLOCKS = (0, 1, 4, 5)
+'''Clocks with a divider. The others increment on every flush.'''
+_DIVIDER_INDEX = {0: 0, 1: 1, 4: 2, 5: 3}
+
+
+@dataclass
+class TickResult:
+    tick: int
+    inputs: int
+    '''Input word loaded at the start of this tick'''
+    state: int
+    '''The policy state executed during this tick'''
+    next_state: int
+    outputs: int
+    '''Edited outputs, latched at the flush event'''
+    violation: bool
+    tran_cycles: int | None
+    '''Clock cycles from the start of the tick until the transition machine finished'''
+    edit_cycles: int | None
+    '''Clock cycles from the start of the tick until the edit machine finished'''
+    clocks: tuple[int, ...]
+    '''Clock counters after the flush event'''
+
+
+@dataclass
+class SimulationResult:
+    ticks: list[TickResult] = field(default_factory=list)
+    cycles: int = 0
+    '''Total number of clock cycles simulated'''
+
+    @property
+    def states(self) -> list[int]:
+        return [t.next_state for t in self.ticks]
+
+    @property
+    def outputs(self) -> list[int]:
+        return [t.outputs for t in self.ticks]
+
+    @property
+    def max_tran_cycles(self) -> int | None:
+        return max((t.tran_cycles for t in self.ticks if t.tran_cycles is not None), default=None)
+
+    @property
+    def max_edit_cycles(self) -> int | None:
+        return max((t.edit_cycles for t in self.ticks if t.edit_cycles is not None), default=None)
+
+
+class RTEMSimulator:
+    '''
+    Simulates both machines of the RTEM controller over an input trace, one tick per input word.
+    '''
+
+    def __init__(self, config: RTEMConfig, input_map: Mapping[object, int] | None = None):
+        self.config = config
+        self.input_map = {str(k): v for k, v in input_map.items()} if input_map else {}
+        self.memory = [0] * 256
+        for idx, byte in enumerate(config.main_memory[:256]):
+            self.memory[idx] = byte
+        self.period = 2 * (config.tick_length_sub1 + 1)
+        self.flush_cycle = 2 * config.program_length_sub1 + 1
+        self.reset()
+
+    @classmethod
+    def from_result(cls, result: AssemblerResult,
+                    program_length_sub1: int = 12,
+                    tick_length_sub1: int = 49,
+                    clock_divider_immediate_values: tuple[int, int, int, int] | None = None,
+                    clock_joins: int | None = None) -> 'RTEMSimulator':
+        # The clocks of the image by default, those of an assignment or 0
+        data = result.assembler_state
+        config = RTEMConfig(
+            state_offset=result.state_offset,
+            trans_offset=result.trans_offset,
+            clock_flags=result.clock_flags,
+            clock_divider_immediate_values=data.clock_divider_immediate_values
+            if clock_divider_immediate_values is None else clock_divider_immediate_values,
+            clock_joins=data.clock_joins if clock_joins is None else clock_joins,
+            program_length_sub1=program_length_sub1,
+            tick_length_sub1=tick_length_sub1,
+            main_memory=result.main_memory)
+        return cls(config, result.final_input_map)
+
+    def reset(self):
+        '''
+        Equivalent to asserting the reset line.
+        '''
+        self.tick = 0
+        self.cycles = 0
+        self.es = [_FINISH, _FINISH]
+        self.pc = [0, 0]
+        self.ra = [0, 0]
+        self.jc = [0, 0]
+        self.var = [0, 0]
+        self.stack = [0, 0]
+        self.hi = 0
+        self.next_state = 0
+        self.in_data = 0
+        self.in_valid = 0
+        self.out_buf = 0
+        self.outputs = 0
+        self.violation = False
+        self.counters = [0] * 8
+        self.dividers = [0] * 4
+        self.reset_latch = 0
+
+    def pack_inputs(self, values: Mapping[str, bool | int]) -> int:
+        '''
+        Build an input word from named inputs, using the input map of the assembled program.
+        '''
+        word = 0
+        for name, value in values.items():
+            if value:
+                word |= 1 << self.input_map[name]
+        return word
+
+    def eval_clock_constraint(self, addr: int) -> int:
+        mem = self.memory
+        insn = CLK_DECODE[mem[addr]]
+        imm = insn.c
+        if insn.op == Op.CLK1:
+            imm |= mem[(addr + 1) & 0xff] << 4
+        val = self.counters[insn.b]
+        return int(val == imm) if insn.a else int(val < imm)
+
+    def advance_clocks(self):
+        '''
+        Clock module update on the flush event (clocks_module.v)
+        '''
+        cfg = self.config
+        joins = cfg.clock_joins
+        counters = self.counters
+        dividers = self.dividers
+        resets = self.reset_latch
+        carry = 0
+        for j in range(8):
+            width_mask = 0xfff if j % 2 else 0xf
+            counter = counters[j]
+            do_reset = (resets >> j) & 1
+            if j in _DIVIDED_CLOCKS:
+                d = _DIVIDER_INDEX[j]
+                divider_max = cfg.clock_divider_immediate_values[d]
+                divider = dividers[d]
+                inc = carry if (joins >> j) & 1 else int(divider == 0)
+                if divider == 0:
+                    dividers[d] = divider_max
+                else:
+                    dividers[d] = ((divider_max if do_reset else divider) - 1) & 0x3ff
+            else:
+                inc = carry if (joins >> j) & 1 else 1
+            carry = int(counter == width_mask and inc)
+            counters[j] = ((0 if do_reset else counter) + inc) & width_mask
+        self.reset_latch = 0
+
+    def step_tick(self, inputs: int) -> TickResult:
+        '''
+        Simulate one full tick, loading `inputs` at the setup event.
+        '''
+        mem = self.memory
+        cfg = self.config
+        trans_offs = cfg.trans_offset
+        state_offs = cfg.state_offset
+        clk_flags = cfg.clock_flags
+        period = self.period
+        flush_cycle = self.flush_cycle
+        es, pc, ra, jc, var, stack = self.es, self.pc, self.ra, self.jc, self.var, self.stack
+        std_decode = _STD_DECODE
+
+        state = self.next_state
+        finished: list[int | None] = [None, None]
+        gc = 0
+        while gc < period:
+            # Both machines idle: skip ahead to the next event
+            if es[T] == _FINISH and es[E] == _FINISH and gc > 1:
+                target = flush_cycle if gc < flush_cycle else period
+                if target > gc:
+                    skip_even = (target + 1) // 2 - (gc + 1) // 2
+                    skip_odd = target // 2 - gc // 2
+                    jc[T] = max(jc[T] - skip_even, 0)
+                    jc[E] = max(jc[E] - skip_odd, 0)
+                    gc = target
+                    if gc == period:
+                        break
+
+            if gc & 1:
+                b, a = T, E
+            else:
+                b, a = E, T
+            if gc == 0:
+                stack[T] = stack[E] = 0
+
+            #######
+            # B cycle of machine b
+            #######
+            s = es[b]
+            v = var[b]
+            ra_old = ra[b]
+            new_pc = -1
+            if s == _FINISH:
+                if gc <= 1:
+                    es[b] = _SETUP
+            elif s == _STD:
+                op, f0, f1, f2, _ = std_decode[b][v]
+                if op == _PSH:
+                    if (self.in_valid >> f1) & 1:
+                        stack[b] = ((stack[b] << 1) | ((self.in_data >> f1) & 1)) & STACK_MASK
+                        es[b] = _ACC if f0 else _STD
+                        new_pc = pc[b] + 1
+                    else:
+                        es[b] = _PSH_CLK
+                elif op == _OP:
+                    st = stack[b]
+                    res = (f2 >> (st & 0b11)) & 1
+                    if f1:
+                        stack[b] = ((st >> 1) & ~1) | res
+                    else:
+                        stack[b] = ((st << 1) & STACK_MASK) | res
+                    es[b] = _ACC if f0 else _STD
+                    new_pc = pc[b] + 1
+                elif op == _VIO:
+                    st = stack[b]
+                    res = (f2 >> (st & 0b11)) & 1
+                    if f1:
+                        stack[b] = (st & ~1) | res
+                    else:
+                        stack[b] = ((st << 1) & STACK_MASK) | res
+                    es[b] = _E_ACC if f0 else _E_EDIT
+                    new_pc = pc[b] + 1
+                elif op == _DO:
+                    offset = v & 0x1f
+                    if offset & 0x10:
+                        offset -= 0x20
+                    ra[b] = (pc[b] + 1) & 0xff
+                    new_pc = pc[b] + 1 + offset
+                elif op == _NXT1:
+                    self.hi = v & 1
+                    ra[b] = (trans_offs + 0xf0 + (~(v >> 1) & 0xf)) & 0xff
+                    new_pc = trans_offs + (v & 0x1f)
+                    es[b] = _T_TRA
+                else:  # NXT2
+                    st = stack[b]
+                    self.hi = st & 1
+                    new_pc = pc[b] + 1 + ((st >> 1) & TRUNC_MASK[v & 0x1f])
+                    es[b] = _T_NXT
+            elif s == _ACC or s == _ACC_CLK or s == _E_ACC or s == _E_ACC_CLK:
+                addr = v & 0x1f
+                is_edit = s == _E_ACC or s == _E_ACC_CLK
+                if (self.in_valid >> addr) & 1:
+                    val = (self.in_data >> addr) & 1
+                    st = stack[b]
+                    res = (((v >> 7) & 1) ^ val) | (((v >> 6) & 1) ^ (st & 1))
+                    stack[b] = (st & ~1) | res
+                    if (v >> 5) & 1:
+                        es[b] = _E_ACC if is_edit else _ACC
+                    else:
+                        es[b] = _E_EDIT if is_edit else _STD
+                    new_pc = pc[b] + 1
+                else:
+                    es[b] = _E_ACC_CLK if is_edit else _ACC_CLK
+            elif s == _PSH_CLK:
+                addr = v & 0x1f
+                stack[b] = ((stack[b] << 1) | ((self.in_data >> addr) & 1)) & STACK_MASK
+                es[b] = _ACC if (v >> 5) & 1 else _STD
+                new_pc = pc[b] + 1
+            elif s == _E_EDIT:
+                if stack[b] & 1:
+                    bit = 1 << (v & 0x1f)
+                    self.out_buf = (self.out_buf | bit) if (v >> 6) & 1 else (self.out_buf & ~bit)
+                end = v >> 7
+                nxt = (v >> 5) & 1
+                if not (end or nxt):
+                    stack[b] >>= 1
+                if end:
+                    es[b] = _FINISH
+                    finished[E] = gc + 1
+                else:
+                    es[b] = _E_EDIT if nxt else _STD
+                new_pc = pc[b] + 1
+            elif s == _T_NXT:
+                self.hi = v & 1
+                ra[b] = (trans_offs + 0xf0 + (~(v >> 1) & 0xf)) & 0xff
+                new_pc = trans_offs + (v & 0x1f)
+                es[b] = _T_RST
+            elif s == _T_RST:
+                self.reset_latch |= v
+                es[b] = _T_TRA
+                new_pc = pc[b] + 1
+            elif s == _T_TRA:
+                self.next_state = v & 0xf
+                es[b] = _FINISH
+                finished[T] = gc + 1
+                new_pc = pc[b] + 1
+            elif s == _SETUP:
+                new_pc = state_offs + (v & 0x1f)
+                es[b] = _INIT
+            elif s == _INIT:
+                new_pc = trans_offs + v
+                es[b] = _STD
+
+            if new_pc >= 0:
+                # Return from a DO block or into the transition table (program_flow.v)
+                pc[b] = (ra_old if jc[b] == 1 else new_pc) & 0xff
+
+            #######
+            # A cycle of machine a
+            #######
+            s = es[a]
+            insn = mem[pc[a]]
+            if s in _CLK_STATES:
+                addr = var[a] & 0x1f
+                self.in_data = (self.in_data & ~(1 << addr)) | (self.eval_clock_constraint(addr) << addr)
+                self.in_valid |= 1 << addr
+            else:
+                if s == _STD and std_decode[a][insn][0] == _DO:
+                    jc[a] = ((insn >> 4) & 0b11) + 2
+                    n = (insn >> 4) & 0b11
+                    lo = insn & 0xf
+                    var[a] = (insn & 0xe0) | (((0x10 | (~lo & 0xf)) + (0x1c | (~n & 0b11))) & 0x1f)
+                elif s == _STD and a == T and (insn >> 5) == 0:
+                    jc[a] = ((insn >> 4) & 0b11) + 2
+                    var[a] = insn
+                elif s == _T_NXT:
+                    jc[a] = 2
+                    var[a] = (insn & 0xe0) | (var[a] & 0x10) | ((insn >> 4) if self.hi else (insn & 0xf))
+                else:
+                    if jc[a]:
+                        jc[a] -= 1
+                    if s == _SETUP:
+                        var[a] = (insn & 0xe0) | (self.next_state << 1) | a
+                    elif s == _T_TRA:
+                        var[a] = (insn & 0xe0) | ((insn >> 4) if self.hi else (insn & 0xf))
+                    elif s == _FINISH:
+                        var[a] = (insn & 0xe0) | (var[a] & 0x1f)
+                    else:
+                        var[a] = insn
+
+            #######
+            # End of cycle events
+            #######
+            if gc == 0:
+                stack[T] = stack[E] = 0
+                self.in_data = inputs
+                self.in_valid = ~clk_flags & 0xffffffff
+                self.out_buf = inputs
+            if gc == flush_cycle:
+                self.outputs = self.out_buf
+                self.violation = bool((self.out_buf ^ self.in_data) & ~clk_flags & 0xffffffff)
+                self.advance_clocks()
+            gc += 1
+
+        self.cycles += period
+        result = TickResult(
+            tick=self.tick,
+            inputs=inputs,
+            state=state,
+            next_state=self.next_state,
+            outputs=self.outputs,
+            violation=self.violation,
+            tran_cycles=finished[T],
+            edit_cycles=finished[E],
+            clocks=tuple(self.counters))
+        self.tick += 1
+        return result
+
+    def run(self, trace: Iterable[int]) -> SimulationResult:
+        '''
+        Simulate one tick per input word in `trace`.
+        '''
+        result = SimulationResult()
+        for inputs in trace:
+            result.ticks.append(self.step_tick(inputs))
+        result.cycles = self.cycles
+        return result
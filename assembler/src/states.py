@@ -1,82 +1,121 @@
 
 
 from dataclasses import dataclass
-import re
-from typing import Any
+from functools import cache
+from typing import Sequence
 
-from .tokens import UnresolvedCode, R, RTEMClock, RTEMClockConstraint, RTEMConstant, RTEMVar, RTEMTransition, RTEMState
-from .helpers import regular_tokenizer, parse_int, ParsingException
+from .tokens import Bits, UnresolvedCode, UnresolvedCodeline, R, RTEMClock, RTEMClockConstraint, RTEMConstant, RTEMVar, RTEMTransition, RTEMState
+from .guard import EDI_OPS, GuardStep, compile_guard, parse_expr, truth_table
+from .helpers import ParsingException
+from .isa import Op
+from .lexer import Token, TokenKind, lex, source_text
 
 
 
-def parse_extensions(line: str) -> UnresolvedCode:
+EXTENSION_OPS = {
+    '|': 0,
+    '!|': 1,
+    '|!': 2,
+    '!|!': 3,
+}
+
+
+def parse_extensions(toks: list[Token]) -> UnresolvedCode:
     '''
     Takes input in the form
     "| VS | VP | AS | AP"
     '''
-    toks = regular_tokenizer(line)
-    assert len(toks) % 2 == 0
+    if len(toks) % 2:
+        raise ParsingException(None, source_text(toks), f'Expected an input after {toks[-1].text} at {toks[-1].where}')
     ncommands = len(toks) // 2
     out: UnresolvedCode = []
+    for i in range(ncommands):
+        op_tok = toks[2*i]
+        op = EXTENSION_OPS.get(op_tok.text) if op_tok.kind is TokenKind.OP else None
+        if op is None:
+            raise ParsingException(None, source_text(toks), f'Invalid operator {op_tok.text} at {op_tok.where}')
+        out.append(input_line(op << 6 | (i < ncommands-1) << 5, parse_input(toks[2*i+1])))
+    return out
+
 
-    op_map = {
-        '|': 0,
-        '!|': 1,
-        '|!': 2,
-        '!|!': 3,
-    }
+def input_line(prefix: int, var: RTEMClockConstraint | RTEMVar | int) -> UnresolvedCodeline:
+    '''
+    The byte prefix | slot of `var`, to be resolved unless `var` is a slot number.
+    '''
+    if isinstance(var, int):
+        return Bits(prefix | var, 8)
+    return R((var,), lambda t: Bits(prefix | t[0], 8))
 
-    def create_closure(op, i, ncommands):
-        return lambda t: f'{op:02b}{(i<ncommands-1):01b}{t[0]:05b}'
 
-    for i in range(ncommands):
-        op = toks[2*i].replace(' ', '')
-        op = op_map.get(op)
-        assert op is not None, f'Invalid operator {toks}'
-        tok1 = parse_input(toks[2*i+1])
-        if isinstance(tok1, int):
-            out.append(f'{op:02b}{(i<ncommands-1):01b}{tok1:05b}')
-        else:
-            out.append(
-                R((tok1,), create_closure(op, i, ncommands)))
+def table_jump(up: int, n: int) -> Bits:
+    '''
+    NXT <up> <n>, taking one of the 2**n transitions of the table following it.
+    '''
+    return Bits(0b001 << 5 | up << 4 | 2**n, 8)
+
+
+def table_row(transition: RTEMTransition) -> UnresolvedCodeline:
+    '''
+    A row of a jump table, the id of `transition`.
+    '''
+    return R((transition,), lambda t: Bits(t[0], 4))
+
+
+def encode_steps(steps: Sequence[GuardStep], inputs: Sequence[RTEMClockConstraint | RTEMVar | int]) -> UnresolvedCode:
+    '''
+    Encodes PSH/OP2/ACC steps over `inputs` (see guard.py), extending each by the ACCs following it.
+    '''
+    out: UnresolvedCode = []
+    for i, step in enumerate(steps):
+        ex = i + 1 < len(steps) and steps[i + 1].op == Op.ACC
+        match step.op:
+            case Op.PSH:
+                out.append(input_line(0b10 << 6 | ex << 5, inputs[step.arg]))
+            case Op.ACC:
+                out.append(input_line(step.mode << 6 | ex << 5, inputs[step.arg]))
+            case Op.OP:
+                out.append(Bits(0b01 << 6 | ex << 5 | step.mode << 4 | step.arg, 8))
     return out
 
 
-def parse_input(token: str) -> RTEMClockConstraint | RTEMVar | int:
+def parse_input(token: Token) -> RTEMClockConstraint | RTEMVar | int:
     '''
     Deermine the type of the given input.
     This will be used in some instructions to resol
     '''
-    token = token.strip()
-    if (m := re.search(r'(?P<clk>[A-z_][\w_]*)(?P<op>(>|<|=|<=|>=|!=|==))(?P<imm>[A-z_][\w_]*)', token)):
-        clk = m.group('clk')
-        imm = m.group('imm')
-        op = m.group('op')
+    if token.kind is TokenKind.COMPARE:
+        clk, op, imm = token.value
         return RTEMClockConstraint(op, RTEMClock(clk), RTEMConstant(imm))
-    val = parse_int(token)
-    if val is not None:
-        return val
-    return RTEMVar(token)  # Symbol to be resolved
+    if token.kind is TokenKind.NUMBER and token.value is not None:
+        return token.value
+    if token.kind is TokenKind.NAME:
+        return RTEMVar(token.text)  # Symbol to be resolved
+    raise ParsingException(None, token.text, f'Expected an input at {token.where}')
 
 
-def parse_transition(line: str) -> RTEMTransition:
-    toks = regular_tokenizer(line)
-    return RTEMTransition(
-        RTEMState(toks[0]),
-        set(RTEMClock(tok.replace('=0', '').strip()) for tok in toks[1:])
-    )
+def parse_transition(toks: list[Token]) -> RTEMTransition:
+    '''
+    Takes input in the form
+    "state clk0=0, clk1=0"
+    '''
+    if not toks or toks[0].kind is not TokenKind.NAME:
+        raise ParsingException(None, source_text(toks), 'Expected the next state of a transition')
+    resets = set()
+    for tok in toks[1:]:
+        if tok.kind is TokenKind.NAME:
+            resets.add(RTEMClock(tok.text))
+        elif tok.kind is TokenKind.ASSIGN and tok.value[1] == 0:
+            resets.add(RTEMClock(tok.value[0]))
+        elif tok.kind is not TokenKind.COMMA:
+            raise ParsingException(None, source_text(toks), f'Expected a clock reset at {tok.where}')
+    return RTEMTransition(RTEMState(toks[0].text), resets)
 
 
 class State():
-    def parse_re(self, line, regex):
-        match = re.match(regex, line)
-        if not match:
-            raise ParsingException(self, line, f'Expected {regex}')
-        return match.groups()[1:]
-
-    def ingest(self, line: str) -> tuple['State', UnresolvedCode, int]:
+    def ingest(self, toks: list[Token]) -> tuple['State', UnresolvedCode, int]:
         '''
-        Ingests a line of code and returns a new state object to be used at the next line.
+        Ingests the (non-empty) tokens of a line of code and returns a new state object to be used
+        at the next line.
         '''
         ...
 
@@ -92,18 +131,27 @@ class Command():
 
 class Commands():
     class PSH(State):
-        def ingest(self, line: str) -> tuple[State, UnresolvedCode, int]:
-            toks = regular_tokenizer(line)
-            extensions = parse_extensions(" ".join(toks[1:]))
-            ex = f'{bool(extensions):01b}'
-            tok0 = parse_input(toks[0])
-            psh: UnresolvedCode
-            if not isinstance(tok0, int):
-                psh = [R((tok0,), lambda t: f'10{ex}{t[0]:05b}')] + extensions
-            else:
-                psh = [f'{tok0:05b}']
+        def ingest(self, toks: list[Token]) -> tuple[State, UnresolvedCode, int]:
+            if not toks:
+                raise ParsingException(self, '', 'PSH expects an input')
+            extensions = parse_extensions(toks[1:])
+            ex = bool(extensions)
+            psh = [input_line(0b10 << 6 | ex << 5, parse_input(toks[0]))] + extensions
             return STD(), psh, 8 + 8*len(extensions)
 
+    class GRD(State):
+        '''
+        GRD (VS | VP) & !v<aviTicks
+
+        Pushes the value of a guard expression, by the cheapest PSH/OP2/ACC sequence (see guard.py).
+        '''
+        def ingest(self, toks: list[Token]) -> tuple[State, UnresolvedCode, int]:
+            if not toks:
+                raise ParsingException(self, '', 'GRD expects a guard expression')
+            program = compile_guard(toks, parse_input)
+            code = encode_steps(program.steps, program.inputs)  # type: ignore
+            return STD(), code, 8*len(code)
+
     class OP2(State):
         op_map = {
             'T': 0b1111,
@@ -126,41 +174,45 @@ class Commands():
             '!=': 0b0110,
         }
 
-        def ingest(self, line: str) -> tuple[State, UnresolvedCode, int]:
-            toks = regular_tokenizer(line)
+        def ingest(self, toks: list[Token]) -> tuple[State, UnresolvedCode, int]:
             pos = 0
             pop = 0
-            op = self.op_map[toks[pos]]
+            op = self.op_map.get(toks[pos].text) if toks else None
+            if op is None:
+                raise ParsingException(self, source_text(toks), f'OP2 expects one of {", ".join(self.op_map)}')
             pos += 1
             if len(toks) <= pos:
-                return STD(), [f'010{pop:01b}{op:04b}'], 8
-            if toks[pos] == 'pop':
+                return STD(), [Bits(0b010 << 5 | pop << 4 | op, 8)], 8
+            if toks[pos].kind is TokenKind.NAME and toks[pos].text == 'pop':
                 pop = 1
                 pos += 1
             if len(toks) <= pos:
-                return STD(), [f'010{pop:01b}{op:04b}'], 8
-            extensions = parse_extensions(" ".join(toks[pos:]))
+                return STD(), [Bits(0b010 << 5 | pop << 4 | op, 8)], 8
+            extensions = parse_extensions(toks[pos:])
             ex = bool(extensions)
-            return STD(), [f'01{ex:01b}{pop:01b}{op:04b}'] + extensions, 8 + 8*len(extensions)
+            return STD(), [Bits(0b01 << 6 | ex << 5 | pop << 4 | op, 8)] + extensions, 8 + 8*len(extensions)
 
     class NXT(State):
-        def ingest(self, line: str) -> tuple[State, UnresolvedCode, int]:
-            toks = regular_tokenizer(line)
+        def ingest(self, toks: list[Token]) -> tuple[State, UnresolvedCode, int]:
             pos = 0
             nargs = len(toks)
-            type = (nargs == 2)
+            type = (nargs == 2 and all(t.kind is TokenKind.NUMBER for t in toks))
             if type:  # type 1
-                up = int(toks[pos])
+                up = toks[pos].value
                 pos += 1
-                n = int(toks[pos])
-                return TAB(up, 2**n), [f'001{up:01b}{2**n:04b}'], 8
+                n = toks[pos].value
+                if up not in (0, 1) or n is None:
+                    raise ParsingException(self, source_text(toks), 'Expected NXT <up> <n>, with up 0 or 1')
+                return TAB(up, 2**n), [table_jump(up, n)], 8
             else:  # type 0
-                tok = parse_int(toks[pos])
+                if not toks:
+                    raise ParsingException(self, '', 'NXT expects a transition')
+                tok = toks[pos].value if toks[pos].kind is TokenKind.NUMBER else None
                 if len(toks[pos:]) > 1 or tok is None:
-                    transition = parse_transition(' '.join(toks[pos:]))
-                    cmd = R((transition,), lambda t: f'000{t[0]:05b}')
+                    transition = parse_transition(toks[pos:])
+                    cmd = R((transition,), lambda t: Bits(t[0], 8))
                 else:
-                    cmd = f'000{tok:05b}'
+                    cmd = Bits(tok, 8)
                 return STD(), [cmd], 8
 
     class EDI(State):
@@ -169,33 +221,62 @@ class Commands():
 
         '''
         @staticmethod
-        def parse_stack_logic_expr(expr: str):
+        def stack_logic_table(toks: list[Token]) -> int:
             '''
-            Converts a stack logic expression (such as "$0 & $1") to it's corresponding bitstring 
+            Converts the tokens of a stack logic expression (such as "$0 & $1") to it's corresponding 4
+            bit table, where bit i is the value of the expression for $0 = i & 1, $1 = i & 2.
             '''
-            expr = expr.replace('$0', 'a').replace('$1', 'b').replace(
-                '&', ' and ').replace('|', ' or ').replace('~', ' not ').replace('!', ' not ').strip()
-            return ''.join((str(int(eval(expr, {'a': i & 1, 'b': bool(i & 2)}))) for i in range(3, -1, -1)))
+            def leaf(tok: Token) -> str | bool:
+                if tok.kind is TokenKind.STACK:
+                    return tok.text
+                if tok.kind is TokenKind.NUMBER and tok.value in (0, 1):
+                    return bool(tok.value)
+                raise ParsingException(None, source_text(toks), f'Expected $0, $1 or a constant at {tok.where}')
+            # $0 is the low bit of the LUT index, as input 0 is of the truth table
+            variables = {'$0': 0, '$1': 1}
+            return truth_table(parse_expr(toks, leaf, variables, EDI_OPS), 2)
 
-        def ingest(self, line: str) -> tuple[State, UnresolvedCode, int]:
-            regex = r"^(pop)?(.*?)(\|.+)?$"
-            toks = re.match(regex, line.strip())
-            if not toks:
-                raise ParsingException(self, line, f'Expected {regex}')
-            pop = bool(toks.group(1))
-            bits = self.parse_stack_logic_expr(toks.group(2))
-            ex = bool(toks.group(3))
-            if ex:
-                extensions = parse_extensions(toks.group(3).strip())
-            else:
-                extensions = []
-            return EDIT(), [f'00{ex:01b}{pop:01b}{bits}', *extensions], 8
+        @staticmethod
+        @cache
+        def parse_stack_logic_expr(expr: str) -> int:
+            '''
+            The table of a stack logic expression (see stack_logic_table). The few distinct
+            expressions of a program are only parsed once.
+            '''
+            return Commands.EDI.stack_logic_table(lex(expr)[0])
+
+        def ingest(self, toks: list[Token]) -> tuple[State, UnresolvedCode, int]:
+            pop = bool(toks) and toks[0].kind is TokenKind.NAME and toks[0].text == 'pop'
+            # The expression extends up to the first extension operator
+            end = next((i for i, t in enumerate(toks) if t.kind is TokenKind.OP and t.text in EXTENSION_OPS), len(toks))
+            if end <= pop:
+                raise ParsingException(self, source_text(toks), 'EDI expects a stack logic expression')
+            try:
+                bits = self.parse_stack_logic_expr(source_text(toks[pop:end]))
+            except ParsingException:
+                # Raises again, at the position of the tokens in the source rather than in the expression
+                bits = self.stack_logic_table(toks[pop:end])
+            extensions = parse_extensions(toks[end:])
+            ex = bool(extensions)
+            return EDIT(), [Bits(ex << 5 | pop << 4 | bits, 8), *extensions], 8
+
+
+COMMANDS: dict[str, State] = {
+    'PSH': Commands.PSH(),
+    'GRD': Commands.GRD(),
+    'OP2': Commands.OP2(),
+    'NXT': Commands.NXT(),
+    'EDI': Commands.EDI(),
+}
+'''Instruction mnemonics, dispatched to by STD'''
 
 
 class STD(State):
-    def ingest(self, line: str) -> tuple[State, UnresolvedCode, int]:
-        toks = regular_tokenizer(line)
-        return getattr(Commands, toks[0])().ingest(' '.join(toks[1:]))
+    def ingest(self, toks: list[Token]) -> tuple[State, UnresolvedCode, int]:
+        command = COMMANDS.get(toks[0].text) if toks[0].kind is TokenKind.NAME else None
+        if command is None:
+            raise ParsingException(self, source_text(toks), f'Unknown instruction {toks[0].text} at {toks[0].where}')
+        return command.ingest(toks[1:])
 
 
 class EDIT(State):
@@ -204,24 +285,21 @@ class EDIT(State):
 
     '''
 
-    def ingest(self, line: str) -> tuple[State, UnresolvedCode, int]:
-        regex = r"^([A-z0-9_]+)\s*=\s*([01])\s*(END)?\s*(,)?$"
-        toks = re.match(regex, line.strip())
-        if not toks:
-            raise ParsingException(self, line, f'Expected {regex}')
-        nxt = bool(toks.group(4))
-        end = bool(toks.group(3))
-        val = parse_int(toks.group(2))
-        var = RTEMVar(toks.group(1))
-        if not toks:
-            raise ParsingException(
-                self, line, f'Captured group(2) "{toks.group(2)}" from {regex} is not an integer')
-        assert val is not None
+    def ingest(self, toks: list[Token]) -> tuple[State, UnresolvedCode, int]:
+        assign, *rest = toks
+        if assign.kind is not TokenKind.ASSIGN or assign.value[1] not in (0, 1):
+            raise ParsingException(self, source_text(toks), f'Expected <Var>=[01] at {assign.where}')
+        name, val = assign.value
+        end = bool(rest) and rest[0].kind is TokenKind.NAME and rest[0].text == 'END'
+        nxt = bool(rest[end:]) and rest[end].kind is TokenKind.COMMA
+        if rest[end + nxt:]:
+            raise ParsingException(self, source_text(toks), f'Expected END or "," at {rest[end + nxt].where}')
+        var = RTEMVar(name)
         assert not (
             nxt and end), "Asserting END & NXT at the same time dissaloweed."
         next_state = EDIT() if nxt else STD()
 
-        return next_state, [R((var,), lambda x: f'{end:01b}{val:01b}{nxt:01b}{x[0]:05b}')], 8
+        return next_state, [R((var,), lambda x: Bits(end << 7 | val << 6 | nxt << 5 | x[0], 8))], 8
 
 
 @dataclass
@@ -229,14 +307,12 @@ class TAB(State):
     up: int
     count: int
 
-    def ingest(self, line: str) -> tuple[State, UnresolvedCode, int]:
-        toks = regular_tokenizer(line)
+    def ingest(self, toks: list[Token]) -> tuple[State, UnresolvedCode, int]:
         if self.count == 1:
             next_state = STD()
         else:
             next_state = TAB(self.up, self.count-1)
-        transition = parse_transition(' '.join(toks))
-        return next_state, [R((transition,), lambda t: f'{t[0]:04b}')], 4
+        return next_state, [table_row(parse_transition(toks))], 4
 
     # '''
     # If no token matches the input string, return the string itself as a variable
@@ -0,0 +1,207 @@
+'''
+Parameter sweeps over the constants and the configuration of a policy.
+
+A grid maps each swept parameter to its values: RTEMConfig fields (clock_divider_immediate_values,
+tick_length_sub1, ...) configure the image, any other name is a constant of the policy. The source
+is parsed once per worker process, and each point only resolves the parsed policy against its
+constants. Points sharing their constants also share the resolved image and its timing analysis,
+and only check their own configuration against it.
+'''
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from dataclasses import dataclass, field
+import itertools
+import os
+from typing import Any, Iterator, Mapping, Sequence
+
+from .analysis import TimingAnalysis, analyze
+from .config import MEMORY_DEPTH, RTEMConfig
+from .emit import make_config
+from .main import RTEMAssembler
+from .result import AssemblerResult
+from .tokens import RTEMConstant
+from .trace import Tracer
+
+ROM_BYTES = MEMORY_DEPTH
+'''Size of cfg_main_memory'''
+
+_CONFIG_FIELDS = frozenset(RTEMConfig.iter_fields()) - {'state_offset', 'trans_offset', 'clock_flags', 'main_memory'}
+'''RTEMConfig fields that can be swept, the others are set by the assembled image'''
+
+_UNSET_CONFIG = dict(program_length_sub1=0, tick_length_sub1=0)
+'''Configuration of the timing analysis, which does not depend on these fields. The clock dividers and
+joins are those of the image unless swept.'''
+
+
+@dataclass
+class SweepRow:
+    params: dict[str, Any]
+    '''Value of each swept parameter'''
+    rom_bytes: int | None = None
+    '''Length of the image, None if it could not be assembled'''
+    states: int = 0
+    transitions: int = 0
+    program_length_sub1: int | None = None
+    '''Minimal program length of the image, used when the point does not set it'''
+    tick_length_sub1: int | None = None
+    problems: list[str] = field(default_factory=list)
+    '''Every reason why the image does not fit the hardware'''
+
+    @property
+    def fits(self) -> bool:
+        return not self.problems
+
+
+def grid_points(grid: Mapping[str, Sequence[Any]]) -> Iterator[dict[str, Any]]:
+    '''
+    Every combination of the values of `grid`, the last parameter varying fastest.
+    '''
+    names = list(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def split_params(params: Mapping[str, Any]) -> tuple[dict[str, int], dict[str, Any]]:
+    '''
+    Returns (constants, config) of a point.
+    '''
+    constants = {k: v for k, v in params.items() if k not in _CONFIG_FIELDS}
+    config = {k: tuple(v) if isinstance(v, list) else v for k, v in params.items() if k in _CONFIG_FIELDS}
+    return constants, config
+
+
+def register_problems(config: Mapping[str, Any]) -> list[str]:
+    problems = []
+    for name, value in config.items():
+        bits = RTEMConfig.get_meta(name).reg_size
+        for v in value if isinstance(value, Sequence) else (value,):
+            if not 0 <= v < 1 << bits:
+                problems.append(f'{name}={value} does not fit its {bits} bit register')
+    return problems
+
+
+class PolicySweep:
+    '''
+    A parsed policy, resolved again for each assignment of its constants.
+    '''
+
+    def __init__(self, source: str, initial_state: str, **settings):
+        '''
+        settings: passed to RTEMAssembler (clocks, constants, inputs, compress, minimize, peephole,
+            jump_tables, assign_clocks)
+        '''
+        self.assembler = RTEMAssembler(initial_state, **settings)
+        self.assembler.parse_source(source)
+        if self.assembler.minimize:
+            # Constants do not change which states are equivalent, so minimization is done once
+            self.assembler.minimize_states()
+            self.assembler.minimize = False
+        if self.assembler.peephole:
+            # Nor do they change the peephole rewrites
+            self.assembler.optimize_peephole()
+            self.assembler.peephole = False
+        if self.assembler.jump_tables:
+            # Or the transitions the tables take
+            self.assembler.optimize_tables()
+            self.assembler.jump_tables = False
+        # The constants decide which clock constraints are equal, so the clocks are assigned by each resolve
+
+    def constant_map(self, constants: Mapping[str, int]) -> dict[RTEMConstant, int]:
+        constant_map = dict(self.assembler.data.constant_map)
+        for name, value in constants.items():
+            constant = RTEMConstant(name)
+            if constant not in constant_map:
+                raise ValueError(f'Unknown constant {name}, the policy defines {", ".join(map(str, constant_map))}')
+            constant_map[constant] = value
+        return constant_map
+
+    def resolve(self, constants: Mapping[str, int]) -> AssemblerResult:
+        ass = copy.copy(self.assembler)
+        ass.tracer = Tracer()
+        ass.data = copy.copy(self.assembler.data)
+        ass.data.tracer = ass.tracer
+        ass.data.constant_map = self.constant_map(constants)
+        return ass.resolve()
+
+    def evaluate(self, constants: Mapping[str, int], points: list[dict[str, Any]]) -> list[SweepRow]:
+        '''
+        Evaluates the points that share the assignment `constants`.
+        '''
+        self.constant_map(constants)
+        try:
+            result = self.resolve(constants)
+        except (ValueError, AssertionError) as e:
+            return [SweepRow(params, problems=[f'{type(e).__name__}: {e}']) for params in points]
+        timing: TimingAnalysis = analyze(make_config(result, **_UNSET_CONFIG),
+                                         sorted(result.assembler_state.state_map.values()))
+        rows = []
+        for params in points:
+            row = SweepRow(
+                params,
+                rom_bytes=len(result.main_memory),
+                states=len(result.assembler_state.state_map),
+                transitions=len(result.assembler_state.trans_map),
+                program_length_sub1=timing.program_length_sub1,
+                tick_length_sub1=timing.tick_length_sub1)
+            if row.rom_bytes > ROM_BYTES:
+                row.problems.append(f'The image takes {row.rom_bytes} of the {ROM_BYTES} ROM bytes')
+            config = dict(
+                _UNSET_CONFIG,
+                program_length_sub1=timing.program_length_sub1,
+                tick_length_sub1=timing.tick_length_sub1) | split_params(params)[1]
+            row.problems += register_problems(config)
+            try:
+                row.problems += timing.check(make_config(result, **config))
+            except ValueError as e:
+                # Swept dividers or joins of assigned clocks
+                row.problems.append(str(e))
+            rows.append(row)
+        return rows
+
+
+_worker_sweep: PolicySweep | None = None
+
+
+def _init_worker(source: str, initial_state: str, settings: dict[str, Any]):
+    global _worker_sweep
+    _worker_sweep = PolicySweep(source, initial_state, **settings)
+
+
+def _evaluate_group(group: tuple[dict[str, int], list[dict[str, Any]]]) -> list[SweepRow]:
+    assert _worker_sweep is not None
+    return _worker_sweep.evaluate(*group)
+
+
+def sweep(source: str, initial_state: str, grid: Mapping[str, Sequence[Any]], jobs: int | None = None,
+          **settings) -> list[SweepRow]:
+    '''
+    Evaluates every point of `grid`, returning one row per point in grid order.
+    jobs: number of worker processes, defaults to the number of CPUs. With 1, the points are
+        evaluated in this process.
+    settings: passed to RTEMAssembler (clocks, constants, inputs, compress, minimize, peephole,
+        jump_tables, assign_clocks)
+    '''
+    groups: dict[tuple, tuple[dict[str, int], list[dict[str, Any]]]] = {}
+    indices: dict[tuple, list[int]] = {}
+    for i, params in enumerate(grid_points(grid)):
+        constants = split_params(params)[0]
+        key = tuple(constants.items())
+        groups.setdefault(key, (constants, []))[1].append(params)
+        indices.setdefault(key, []).append(i)
+
+    if jobs == 1:
+        _init_worker(source, initial_state, settings)
+        results = list(map(_evaluate_group, groups.values()))
+    else:
+        workers = jobs or os.cpu_count() or 1
+        # Groups are sent in chunks, to amortize the IPC over many small groups
+        chunksize = max(1, len(groups) // (4 * workers))
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(source, initial_state, settings)) as pool:
+            results = list(pool.map(_evaluate_group, groups.values(), chunksize=chunksize))
+
+    rows: list[SweepRow] = [None] * sum(map(len, indices.values()))  # type: ignore
+    for group_indices, group_rows in zip(indices.values(), results):
+        for i, row in zip(group_indices, group_rows):
+            rows[i] = row
+    return rows
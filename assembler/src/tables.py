@@ -0,0 +1,278 @@
+'''
+Layout of the jump tables of the trans code, over lines_unresolved.
+
+A trans block that pushes n values of its inputs and ends with `NXT 0 n` takes the transition in
+row $0 + 2*$1 + ... of its table. The block is run (guard.run_program) for every value of its
+inputs, giving the transition taken for each, and the rows that no input reaches. It is rewritten
+to the cheapest, in bytes then cycles, of:
+
+- collapsed: the same lines, less the pushed values that never decide the transition, and the
+  table of the remaining ones;
+- encoded: a guard (guard.synthesize) for each bit of a code of the transitions taken, and the
+  table of the codes. A single transition takes no guard, and a table of two equal rows.
+
+Rows that no input reaches take the most common transition. The order of the pushes only permutes
+the rows, which are all stored, so it changes neither the size nor the cycles of a table and the
+order of the source is kept.
+
+The transitions are then renumbered: those no longer referenced are removed, and those in tables
+come first, the most used first, as a row holds ids below 16.
+'''
+from collections import Counter
+from dataclasses import dataclass, field
+from itertools import permutations
+
+from .guard import MAX_GUARD_INPUTS, GuardStep, Program, program_depth, run_program, synthesize
+from .isa import DECODE, ES, STACK_LEN, Op
+from .peephole import CodeBlock, encoded, pushes, relocate
+from .sections import AssemblerState
+from .states import encode_steps, table_jump, table_row
+from .tokens import R, RTEMClockConstraint, RTEMTransition, UnresolvedCode
+
+MAX_TABLE_INPUTS = 12
+'''Inputs of a block beyond which its transitions are not enumerated'''
+
+MAX_TABLE_BITS = 3
+'''Tables have at most 8 rows, NXT encoding 2**n in 4 bits'''
+
+MAX_ASSIGNMENTS = 4
+'''Transitions up to which every code assignment is tried, beyond it the most used get the lowest codes'''
+
+
+@dataclass
+class TableLayout:
+    layout: str
+    '''collapsed or encoded'''
+    rows: int
+    '''Rows of the new table'''
+    bytes: int
+    cycles: int
+
+
+@dataclass
+class TableReport:
+    states: dict[str, TableLayout] = field(default_factory=dict)
+    '''Layout of each rewritten trans block, by state'''
+    transitions: int = 0
+    '''Transitions removed from the transition table'''
+    transition_bytes: int = 0
+
+    @property
+    def bytes(self) -> int:
+        return sum(t.bytes for t in self.states.values()) + self.transition_bytes
+
+    @property
+    def cycles(self) -> int:
+        return sum(t.cycles for t in self.states.values())
+
+
+@dataclass
+class JumpTable:
+    '''
+    A trans block pushing the index of its NXT 0 n table
+    '''
+    block: CodeBlock
+    lines: list[Program]
+    '''Lines pushing the index, the first pushed being its highest bit'''
+    rows: list[RTEMTransition]
+    taken: list[RTEMTransition]
+    '''Transition taken for each value of the inputs'''
+
+    def cost(self, steps: Program, rows: int) -> tuple[int, int]:
+        '''
+        (bytes, cycles) of the block, a clock constraint taking a cycle the first time it is read
+        '''
+        clocks = {s.arg for s in steps if s.op != Op.OP and isinstance(self.block.symbols[s.arg], RTEMClockConstraint)}
+        return len(steps) + 1 + (rows + 1) // 2, len(steps) + len(clocks)
+
+    def table(self, key: list[int], bits: int) -> list[RTEMTransition]:
+        '''
+        Rows of a table of `bits` bits (at least 1) indexed by key[v] for the input values v, the
+        rows no value reaches taking the most common transition. Raises KeyError if values of one
+        key take different transitions.
+        '''
+        rows: list[RTEMTransition | None] = [None] * (1 << max(1, bits))
+        for k, transition in zip(key, self.taken):
+            if rows[k] not in (None, transition):
+                raise KeyError(k)
+            rows[k] = transition
+        common = Counter(self.taken).most_common(1)[0][0]
+        return [common if row is None else row for row in rows]
+
+    def collapsed(self) -> tuple[Program, list[RTEMTransition]] | None:
+        '''
+        The lines deciding the transition, the most expensive being dropped first
+        '''
+        if not all(pushes(line) for line in self.lines):
+            return None
+        values = [[run_program(line, v)[0] for v in range(len(self.taken))] for line in self.lines]
+        kept = list(range(len(self.lines)))
+        rows = self.rows
+        for j in sorted(kept, key=lambda j: -len(self.lines[j])):
+            trial = [i for i in kept if i != j]
+            key = [sum(values[i][v] << (len(trial) - 1 - n) for n, i in enumerate(trial))
+                   for v in range(len(self.taken))]
+            try:
+                rows = self.table(key, len(trial))
+            except KeyError:
+                continue
+            kept = trial
+        if len(kept) == len(self.lines):
+            return None
+        return tuple(step for i in kept for step in self.lines[i]), rows
+
+    def encoded(self, bound: tuple[int, int]) -> tuple[Program, list[RTEMTransition]] | None:
+        '''
+        The cheapest guards computing a code of the transitions taken, if cheaper than `bound`
+        '''
+        ninputs = len(self.block.symbols)
+        distinct = [t for t, _ in Counter(self.taken).most_common()]
+        if ninputs > MAX_GUARD_INPUTS or len(distinct) > 1 << MAX_TABLE_BITS:
+            return None
+        if len(distinct) == 1:
+            return (), distinct * 2
+        bits = (len(distinct) - 1).bit_length()
+        if len(distinct) <= MAX_ASSIGNMENTS:
+            assignments = permutations(range(1 << bits), len(distinct))
+        else:
+            assignments = iter([tuple(range(len(distinct)))])
+        best: tuple[tuple[int, int], Program, list[RTEMTransition]] | None = None
+        for codes in assignments:
+            code = dict(zip(distinct, codes))
+            steps: Program = ()
+            for b in reversed(range(bits)):
+                # Every bit left takes a step at least
+                if self.cost(steps + (GuardStep(Op.OP, 0),) * (b + 1), 1 << bits) >= bound:
+                    break
+                table = sum(((code[t] >> b) & 1) << v for v, t in enumerate(self.taken))
+                program = synthesize(table, ninputs)
+                if bits - 1 - b + program_depth(program) > STACK_LEN:
+                    break
+                steps += program
+            else:
+                rows = self.table([code[t] for t in self.taken], bits)
+                cost = self.cost(steps, len(rows))
+                if cost < bound:
+                    bound = cost
+                    best = cost, steps, rows
+        return None if best is None else best[1:]
+
+
+def jump_table(block: CodeBlock, items: UnresolvedCode) -> JumpTable | None:
+    '''
+    The table of a trans block pushing values of its inputs and ending with NXT 0 n, None for any
+    other block
+    '''
+    # The lines, then the NXT and its rows
+    if len(block.runs) > 1 or not block.other or \
+            block.other != list(range(len(items) - len(block.other), len(items))):
+        return None
+    run = block.runs[0] if block.runs else []
+    jump, *table = block.other
+    code = encoded(items[jump])
+    insn = DECODE['trans'][ES.STD][code.value] if code.width == 8 else None
+    if insn is None or insn.op != Op.NXT2 or insn.a or insn.b != len(table) or len(table) & (len(table) - 1):
+        return None
+    rows = []
+    for n in table:
+        item = items[n]
+        if not isinstance(item, R) or not isinstance(item.requests[0], RTEMTransition):
+            return None
+        rows.append(item.requests[0])
+    lines = [tuple(step for step, _ in line) for line in run]
+    steps = tuple(step for line in lines for step in line)
+    bits = len(rows).bit_length() - 1
+    # The stack is empty at the start of the tick, and only the index may be left on it
+    if len(block.symbols) > MAX_TABLE_INPUTS or program_depth(steps) > STACK_LEN or \
+            len(run_program(steps, 0)) != bits:
+        return None
+    taken = []
+    for v in range(1 << len(block.symbols)):
+        stack = run_program(steps, v)
+        taken.append(rows[sum(bit << i for i, bit in enumerate(stack))])
+    return JumpTable(block, lines, rows, taken)
+
+
+def rewrite(table: JumpTable) -> tuple[TableLayout, Program, list[RTEMTransition]] | None:
+    '''
+    The cheapest layout of a table, if cheaper than its own
+    '''
+    steps = tuple(step for line in table.lines for step in line)
+    old = cost = table.cost(steps, len(table.rows))
+    best = None
+    collapsed = table.collapsed()
+    if collapsed is not None:
+        cost = table.cost(collapsed[0], len(collapsed[1]))
+        best = 'collapsed', *collapsed
+    coded = table.encoded(cost)
+    if coded is not None:
+        cost = table.cost(coded[0], len(coded[1]))
+        best = 'encoded', *coded
+    if best is None:
+        return None
+    layout, new_steps, rows = best
+    # The new block must take the same transition for every value of the inputs
+    for v, transition in enumerate(table.taken):
+        stack = run_program(new_steps, v)
+        assert rows[sum(bit << i for i, bit in enumerate(stack))] == transition, \
+            f'{layout} table of {new_steps} differs for inputs {v:b}'
+    return TableLayout(layout, len(rows), old[0] - cost[0], old[1] - cost[1]), new_steps, rows
+
+
+def renumber_transitions(data: AssemblerState) -> int:
+    '''
+    Numbers the transitions still referenced, those in tables first and the most used first.
+    Returns the number of transitions removed.
+    '''
+    rows: Counter[RTEMTransition] = Counter()
+    uses: Counter[RTEMTransition] = Counter()
+    for item in data.lines_unresolved:
+        if not isinstance(item, R):
+            continue
+        for r in item.requests:
+            if isinstance(r, RTEMTransition):
+                uses[r] += 1
+                rows[r] += encoded(item).width == 4
+    order = sorted(uses, key=lambda t: (not rows[t], -rows[t], -uses[t], data.trans_map[t]))
+    removed = len(data.trans_map) - len(order)
+    data.trans_map = {t: i for i, t in enumerate(order)}
+    return removed
+
+
+def layout_tables(data: AssemblerState) -> TableReport:
+    '''
+    Rewrites the jump table of every trans block where another layout is cheaper, and renumbers
+    the transitions. Updates the labels, the source correspondence and the position of the code end.
+    '''
+    report = TableReport()
+    lines = data.lines_unresolved
+    starts = sorted(data.label_items.items(), key=lambda item: item[1])
+    bounds = [0, *(start for _, start in starts), len(lines)]
+    new_lines: UnresolvedCode = []
+    origin: list[int] = []
+    '''Item of lines_unresolved each new line replaces'''
+    for begin, end in zip(bounds, bounds[1:]):
+        label = next((label for label, start in starts if start == begin), None)
+        items = lines[begin:end]
+        block = CodeBlock('trans', items) if label is not None and label.section == 'trans' else None
+        table = jump_table(block, items) if block is not None else None
+        layout = rewrite(table) if table is not None else None
+        if layout is None or label is None or block is None:
+            new_lines.extend(items)
+            origin.extend(range(begin, end))
+            continue
+        report.states[label.name], steps, rows = layout
+        jump = block.other[0]
+        code = encode_steps(steps, block.symbols)
+        new_lines.extend([*code, table_jump(0, len(rows).bit_length() - 1), *map(table_row, rows)])
+        # The new lines stay in the source lines of the items they replace, in order
+        origin.extend(begin + min(j, max(jump - 1, 0)) for j in range(len(code)))
+        origin.append(begin + jump)
+        origin.extend(begin + min(jump + 1 + j, len(items) - 1) for j in range(len(rows)))
+    if report.states:
+        relocate(data, new_lines, origin)
+    before = len(data.trans_map)
+    report.transitions = renumber_transitions(data)
+    # A transition is a state nibble and a reset byte
+    report.transition_bytes = (3 * before + 1) // 2 - (3 * len(data.trans_map) + 1) // 2
+    return report
@@ -2,7 +2,7 @@
 from dataclasses import dataclass
 import re
 
-from typing import Literal, TypeVar, Callable, Mapping
+from typing import Iterable, Literal, NamedTuple, TypeVar, Callable, Mapping
 from .helpers import parse_int
 
 
@@ -27,7 +27,7 @@ class R:
     '''
     An unresolved reference.
     Comprised of a tuple of requested (hashable) objects, and a resolution function, which
-    inserts the resolved values into a string.
+    inserts the resolved values into the encoding.
     '''
     requests: tuple[RTEMTok]
     resolve_fn: Callable[[tuple[int, ...]], 'CodeLine']
@@ -39,14 +39,60 @@ class R:
         return f'R({",".join(map(str, self.requests))} -> {self.resolve_fn(tuple(0 for _ in self.requests))})'
 
 
+class Bits(NamedTuple):
+    '''
+    An encoded piece of code: the `width` low bits of `value`.
+    '''
+    value: int
+    width: int
+
+    def __str__(self) -> str:
+        return f'{self.value:0{self.width}b}'
+
+
 # Types for better semantic readability
-CodeLine = str
-'''String of 1's and 0's'''
+CodeLine = Bits
 Code = list[CodeLine]
-UnresolvedCodeline = str | R
-UnresolvedCode = list[str | R]
-'''List of arbitrary length strings of 1's and 0's'''
-ByteCode = list[int]
+UnresolvedCodeline = Bits | R
+UnresolvedCode = list[Bits | R]
+'''Encoded pieces of arbitrary width, some of them unresolved'''
+ByteCode = bytearray
+
+
+def pack_code(lines: Iterable[CodeLine]) -> ByteCode:
+    '''
+    Packs code into bytes. Each line goes into the high bits left free in the current byte, or
+    starts a new byte if it does not fit.
+    '''
+    out = bytearray()
+    byte = 0
+    nbits = 0
+    for value, width in lines:
+        if value >> width or value < 0:
+            raise ValueError(f'Encoded value {value} does not fit in {width} bits, at byte {len(out)}')
+        if nbits + width > 8:
+            out.append(byte)
+            byte = value
+            nbits = width
+        else:
+            byte |= value << nbits
+            nbits += width
+    out.append(byte)
+    return out
+
+
+def code_offsets(lines: Iterable[CodeLine]) -> list[int]:
+    '''
+    Bit offset of each line in the output of pack_code.
+    '''
+    offsets = []
+    bit = 0
+    for _, width in lines:
+        if bit % 8 and bit % 8 + width > 8:
+            bit += 8 - bit % 8
+        offsets.append(bit)
+        bit += width
+    return offsets
 
 
 def resolve_to_int(tok: _TokenT, token_mapping: Mapping[_TokenT, int]) -> int:
@@ -114,14 +160,19 @@ class RTEMTransition(RTEMTok):
     def __hash__(self) -> int:
         return hash((self.__class__, self.next_state, tuple(sorted(self.resets, key=lambda x: x.name))))
 
-    def resolve_defn(self, token_mapping: dict[RTEMState | RTEMClock, int]) -> tuple[CodeLine, CodeLine]:
+    def resolve_defn(self, token_mapping: dict[RTEMState | RTEMClock, int], joins: int = 0) -> tuple[CodeLine, CodeLine]:
         '''
-        Returns state, resets
+        Returns state, resets. Resetting a clock joined to the clock below it (its bit set in `joins`)
+        resets that one too.
         '''
-        reset_string = [0 for _ in range(8)]
+        resets = 0
         for r in self.resets:
-            reset_string[7-token_mapping[r]] = 1
-        return f'{token_mapping[self.next_state]:04b}', ''.join(map(str, reset_string))
+            clk = token_mapping[r]
+            resets |= 1 << clk
+            while clk and (joins >> clk) & 1:
+                clk -= 1
+                resets |= 1 << clk
+        return Bits(token_mapping[self.next_state], 4), Bits(resets, 8)
 
     def __repr__(self):
         return f'TRN({self.next_state},[{",".join(str(r) for r in sorted(self.resets, key=lambda x: x.name))}])'
@@ -143,24 +194,37 @@ class RTEMClockConstraint(RTEMInput):
     def __repr__(self):
         return f'CLK({self.clk}{self.op}{self.imm})'
 
-    def resolve_defn(self, clks: Mapping[RTEMClock, int], constants: Mapping[RTEMConstant, int]) -> Code:
+    def canonical(self, constants: Mapping[RTEMConstant, int]) -> tuple[int, int]:
+        '''
+        (op, imm) of the comparison, op being 0 for < and 1 for ==, once the constant is resolved
+        '''
         imm = resolve_to_int(self.imm, constants)
-        clk = resolve_to_int(self.clk, clks)
         match self.op:
             case '<':
-                op = 0
+                return 0, imm
             case '<=':
-                op = 0
-                imm += 1
+                return 0, imm + 1
             case '==' | '=':
-                op = 1
+                return 1, imm
+        raise ValueError(f'Unsupported clock constraint {self}, expected <, <= or ==')
+
+    def resolve_defn(self, clks: Mapping[RTEMClock, int], constants: Mapping[RTEMConstant, int]) -> Code:
+        op, imm = self.canonical(constants)
+        clk = resolve_to_int(self.clk, clks)
         if clk < 4 and imm > 16:
             assert False, f'Low clocks cannot have immediate values greater than 16. {clk} {imm}'
-        assert clk < 8 and imm < 2**12
-        if clk % 2 == 0:
-            return [f'0{op:01b}{clk//2:02b}{imm%16:04b}']
-        else:
-            return [f'1{op:01b}{clk//2:02b}{imm%16:04b}', f'{imm>>4:08b}']
+        assert clk < 8 and imm < 2**12, f'Clock {clk} or immediate value {imm} out of range. {self}'
+        return clock_constraint_code(op, clk, imm)
+
+
+def clock_constraint_code(op: int, clk: int, imm: int) -> Code:
+    '''
+    CLK0 (even clk) or CLK1 (odd clk) comparing the physical clock `clk` with `imm`.
+    '''
+    if clk % 2 == 0:
+        return [Bits(op << 6 | clk//2 << 4 | imm % 16, 8)]
+    else:
+        return [Bits(1 << 7 | op << 6 | clk//2 << 4 | imm % 16, 8), Bits(imm >> 4, 8)]
 
 
 @dataclass
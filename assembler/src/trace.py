@@ -0,0 +1,107 @@
+'''
+Trace events and per-phase timing for the assembler.
+
+Events are enabled per phase and level. Messages are only formatted (`fmt % args`) once an event
+has passed the level check, so a silent tracer does no formatting work.
+'''
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from time import perf_counter
+from typing import Callable, Iterator, Literal, Mapping
+import tracemalloc
+
+
+class Level(IntEnum):
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+    OFF = 100
+
+
+Phase = Literal['parse', 'minimize', 'peephole', 'tables', 'resolve', 'allocate', 'layout', 'code', 'compress', 'bytecode']
+PHASES: tuple[Phase, ...] = ('parse', 'minimize', 'peephole', 'tables', 'resolve', 'allocate', 'layout', 'code', 'compress', 'bytecode')
+
+
+@dataclass
+class TraceEvent:
+    phase: Phase
+    level: Level
+    message: str
+
+    def __str__(self):
+        return self.message
+
+
+@dataclass
+class PhaseTiming:
+    calls: int = 0
+    seconds: float = 0
+    allocated: int = 0
+    '''Net bytes allocated, only counted while tracemalloc is tracing'''
+
+
+def print_event(event: TraceEvent):
+    print(event.message)
+
+
+@dataclass
+class Tracer:
+    levels: dict[str, Level] = field(default_factory=dict)
+    '''Minimum level of the recorded events, per phase. Phases not listed use `default_level`.'''
+    default_level: Level = Level.OFF
+    sink: Callable[[TraceEvent], None] | None = None
+    '''Called with every recorded event, e.g. `print_event`'''
+    events: list[TraceEvent] = field(default_factory=list)
+    timings: dict[str, PhaseTiming] = field(default_factory=dict)
+    '''Timing of each phase. Parsing is also timed per section, as 'parse:<section>'.'''
+    track_allocations: bool = False
+    '''Start tracemalloc, so that the phases also count the bytes they allocate'''
+
+    def __post_init__(self):
+        if self.track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @classmethod
+    def verbose(cls, phases: Mapping[str, Level] | None = None, level: Level = Level.DEBUG) -> 'Tracer':
+        '''
+        Tracer printing the events of `phases` (every phase by default) as they happen.
+        '''
+        if phases is None:
+            return cls(default_level=level, sink=print_event)
+        return cls(levels=dict(phases), sink=print_event)
+
+    def enabled(self, phase: Phase, level: Level) -> bool:
+        return level >= self.levels.get(phase, self.default_level)
+
+    def __call__(self, phase: Phase, level: Level, fmt: str, *args):
+        if level < self.levels.get(phase, self.default_level):
+            return
+        event = TraceEvent(phase, level, fmt % args if args else fmt)
+        self.events.append(event)
+        if self.sink:
+            self.sink(event)
+
+    def add_time(self, name: str, seconds: float, allocated: int = 0):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = PhaseTiming()
+        timing.calls += 1
+        timing.seconds += seconds
+        timing.allocated += allocated
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        '''
+        Times the enclosed block, adding it to the timing of `name`.
+        '''
+        tracing = tracemalloc.is_tracing()
+        before = tracemalloc.get_traced_memory()[0] if tracing else 0
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            allocated = tracemalloc.get_traced_memory()[0] - before if tracing else 0
+            self.add_time(name, seconds, allocated)
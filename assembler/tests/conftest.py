@@ -0,0 +1,45 @@
+from pathlib import Path
+import random
+
+import pytest
+
+from src.main import RTEMAssembler
+
+PACEMAKER = Path(__file__).resolve().parent.parent / 'examples' / 'rtem' / 'pacemaker.rtem'
+
+PACEMAKER_SETTINGS = dict(
+    initial_state='pre_ASAP',
+    inputs=dict(AS=28, VS=29, AP=30, VP=31),
+    clocks=dict(vevent=0, v=5),
+)
+'''Settings of build_pacemaker'''
+
+
+@pytest.fixture(scope='session')
+def pacemaker_settings() -> dict:
+    return PACEMAKER_SETTINGS
+
+
+@pytest.fixture(scope='session')
+def pacemaker_source() -> str:
+    return PACEMAKER.read_text()
+
+
+@pytest.fixture(scope='session')
+def pacemaker(pacemaker_source):
+    asm = RTEMAssembler(**PACEMAKER_SETTINGS)
+    asm.parse_source(pacemaker_source)
+    return asm.resolve()
+
+
+@pytest.fixture(scope='session')
+def pacemaker_clocks() -> dict:
+    '''Clock configuration of build_pacemaker'''
+    return dict(clock_divider_immediate_values=(9, 0, 0, 4), clock_joins=0)
+
+
+@pytest.fixture(scope='session')
+def pacemaker_trace() -> list[int]:
+    '''Input words setting each of AS, VS, AP and VP in about one tick in twenty'''
+    rng = random.Random(0)
+    return [sum(1 << slot for slot in (28, 29, 30, 31) if rng.random() < 0.05) for _ in range(2000)]
@@ -0,0 +1,22 @@
+from src.analysis import analyze
+from src.emit import make_config
+from src.simulator import RTEMSimulator
+
+
+def test_minimal_program_length_matches_the_simulator(pacemaker, pacemaker_clocks, pacemaker_trace):
+    config = make_config(pacemaker, **pacemaker_clocks, program_length_sub1=0, tick_length_sub1=49)
+    timing = analyze(config, sorted(pacemaker.assembler_state.state_map.values()))
+    minimal = timing.program_length_sub1
+
+    def simulate(program_length_sub1: int):
+        sim = RTEMSimulator.from_result(pacemaker, program_length_sub1, 49, **pacemaker_clocks)
+        run = sim.run(pacemaker_trace)
+        return run.states, run.outputs
+
+    reference = simulate(40)
+    assert simulate(minimal) == reference
+    assert simulate(minimal - 1) != reference
+    assert not timing.check(make_config(pacemaker, **pacemaker_clocks, program_length_sub1=minimal,
+                                        tick_length_sub1=49))
+    assert timing.check(make_config(pacemaker, **pacemaker_clocks, program_length_sub1=minimal - 1,
+                                    tick_length_sub1=49))
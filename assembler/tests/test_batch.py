@@ -0,0 +1,22 @@
+import pytest
+
+from src.simulator import RTEMSimulator
+
+np = pytest.importorskip('numpy')
+from src.batch import BatchEvaluator, CompiledPolicy  # noqa: E402
+
+
+def test_batch_matches_the_simulator(pacemaker, pacemaker_clocks):
+    rng = np.random.default_rng(0)
+    events = rng.random((4, 5000, 4)) < 0.05
+    words = (events.astype(np.int64) << np.arange(28, 32)).sum(axis=-1)
+
+    batch = BatchEvaluator(CompiledPolicy.from_result(pacemaker, **pacemaker_clocks), len(words)).run(words)
+    assert len(set(batch.states.ravel().tolist())) > 2
+    for i, trace in enumerate(words.tolist()):
+        sim = RTEMSimulator.from_result(pacemaker, 12, 49, **pacemaker_clocks)
+        run = sim.run(trace)
+        assert batch.states[i].tolist() == run.states
+        assert batch.outputs[i].tolist() == run.outputs
+        assert batch.violations[i].tolist() == [t.violation for t in run.ticks]
+        assert batch.clocks[i].tolist() == sim.counters
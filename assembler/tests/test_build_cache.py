@@ -0,0 +1,22 @@
+import os
+
+from src.build_cache import write_if_changed
+
+
+def test_new_file_takes_the_umask_mode(tmp_path):
+    mask = os.umask(0o022)
+    try:
+        assert write_if_changed(tmp_path / 'out.hex', b'data')
+    finally:
+        os.umask(mask)
+    assert (tmp_path / 'out.hex').stat().st_mode & 0o777 == 0o644
+
+
+def test_replaced_file_keeps_its_mode(tmp_path):
+    path = tmp_path / 'out.hex'
+    path.write_bytes(b'old')
+    path.chmod(0o664)
+    assert write_if_changed(path, b'new')
+    assert path.read_bytes() == b'new'
+    assert path.stat().st_mode & 0o777 == 0o664
+    assert not write_if_changed(path, b'new')
@@ -0,0 +1,50 @@
+from src.disassemble import disassemble
+from src.main import RTEMAssembler
+
+REPEATED = '''.NextTrans
+s0:
+    PSH AS | AP
+    PSH VS | VP
+    PSH AS | AP
+    PSH VS | VP
+    OP2 [1] pop
+    OP2 [1] pop
+    NXT 0 1
+        s0
+        s1
+s1:
+    PSH VS | VP
+    NXT 0 1
+        s1
+        s0
+.NextEdits
+s0:
+    PSH AS | AP
+    PSH VS | VP
+    PSH AS | AP
+    PSH VS | VP
+    EDI $0
+        VP=0 END
+s1:
+    PSH AP
+    EDI $0
+        VP=0 END
+'''
+
+
+def assemble(source: str, compress: bool):
+    asm = RTEMAssembler('s0', inputs=dict(AS=28, VS=29, AP=30, VP=31), compress=compress)
+    asm.parse_source(source)
+    return asm.resolve()
+
+
+def test_repeated_runs_shrink():
+    plain = assemble(REPEATED, compress=False)
+    compressed = assemble(REPEATED, compress=True)
+    assert len(compressed.main_memory) < len(plain.main_memory)
+
+
+def test_compressed_image_disassembles_to_the_same_code():
+    plain = assemble(REPEATED, compress=False)
+    compressed = assemble(REPEATED, compress=True)
+    assert disassemble(compressed).source == disassemble(plain).source
@@ -0,0 +1,20 @@
+from src.disassemble import SymbolNames, disassemble
+from src.main import RTEMAssembler
+
+
+def reassemble(disassembly):
+    asm = RTEMAssembler(**disassembly.settings())
+    asm.parse_source(disassembly.source)
+    return asm.resolve()
+
+
+def image(result):
+    return bytes(result.main_memory), result.state_offset, result.trans_offset, result.clock_flags
+
+
+def test_pacemaker_reassembles_byte_for_byte(pacemaker):
+    assert image(reassemble(disassemble(pacemaker))) == image(pacemaker)
+
+
+def test_unnamed_image_reassembles_byte_for_byte(pacemaker):
+    assert image(reassemble(disassemble(pacemaker, SymbolNames()))) == image(pacemaker)
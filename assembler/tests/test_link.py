@@ -0,0 +1,41 @@
+import json
+
+from src.link import RTEMObject, link, make_object
+from src.main import RTEMAssembler
+
+
+def image(result):
+    return bytes(result.main_memory), result.state_offset, result.trans_offset, result.clock_flags
+
+
+def assemble(settings: dict, source: str, **overrides):
+    asm = RTEMAssembler(**(settings | overrides))
+    asm.parse_source(source)
+    return asm.resolve()
+
+
+def saved_object(settings: dict, source: str) -> RTEMObject:
+    asm = RTEMAssembler(**settings)
+    asm.parse_source(source)
+    return RTEMObject.from_dict(json.loads(make_object(asm).to_json()))
+
+
+def test_saved_object_links_to_the_assembled_image(pacemaker_settings, pacemaker_source, pacemaker):
+    obj = saved_object(pacemaker_settings, pacemaker_source)
+    assert image(link([obj])) == image(pacemaker)
+
+
+def test_relinking_matches_assembling_with_the_new_settings(pacemaker_settings, pacemaker_source, pacemaker):
+    obj = saved_object(pacemaker_settings, pacemaker_source)
+    inputs = dict(AS=0, VS=1, AP=2, VP=3)
+    relinked = link([obj], inputs=inputs, constants=dict(aviTicks=9))
+    expected = assemble(pacemaker_settings, pacemaker_source.replace('aviTicks=8', 'aviTicks=9'), inputs=inputs)
+    assert image(expected) != image(pacemaker)
+    assert image(relinked) == image(expected)
+
+
+def test_split_source_links_to_the_whole(pacemaker_settings, pacemaker_source, pacemaker):
+    split = pacemaker_source.index('.NextEdits')
+    objects = [saved_object(pacemaker_settings, part)
+               for part in (pacemaker_source[:split], pacemaker_source[split:])]
+    assert image(link(objects)) == image(pacemaker)
@@ -0,0 +1,33 @@
+from src.main import RTEMAssembler
+
+UNREFERENCED = '''.NextTrans
+s0:
+    PSH AS
+    NXT 0 1
+        s0
+        s0
+s1:
+    NXT s2
+s2:
+    NXT s0
+.NextEdits
+s0:
+    PSH AS
+    EDI $0
+        VP=0 END
+s1:
+    PSH AS
+    EDI $0
+        VP=1 END
+s2:
+    PSH AS
+    EDI $0
+        AP=1 END
+'''
+
+
+def test_unreferenced_states_are_removed():
+    asm = RTEMAssembler('s0', inputs=dict(AS=28, VS=29, AP=30, VP=31), minimize=True)
+    asm.parse_source(UNREFERENCED)
+    result = asm.resolve()
+    assert [s.name for s in result.assembler_state.state_map] == ['s0']
@@ -0,0 +1,17 @@
+import pytest
+
+from src.scripts.pacemaker_sim import GPIO_BASE, FileGPIO, Pacemaker
+
+
+def test_construction_needs_a_backend():
+    with pytest.raises(TypeError):
+        Pacemaker()  # type: ignore
+
+
+def test_atrial_sense_moves_to_pv(tmp_path):
+    gpio = FileGPIO(str(tmp_path / 'gpio.bin'))
+    pacemaker = Pacemaker(gpio=gpio)
+    gpio.write32(GPIO_BASE, 1 << 30)
+    pacemaker.update(0)
+    assert pacemaker.state == 'PV'
+    gpio.close()
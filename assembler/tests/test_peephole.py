@@ -0,0 +1,49 @@
+import random
+
+from src.main import RTEMAssembler
+from src.simulator import RTEMSimulator
+
+REPEATED_LINE = '''.NextTrans
+s0:
+    PSH AS | VS
+    PSH AS | VS
+    NXT 0 2
+        s0
+        s1
+        s1
+        s0
+s1:
+    PSH AS
+    NXT 0 1
+        s0
+        s1
+.NextEdits
+s0:
+    PSH VS !| AS
+    PSH VS !| AS
+    EDI $0 & $1
+        VP=1 END
+s1:
+    PSH AS
+    EDI $0
+        AP=0 END
+'''
+
+
+def assemble(peephole: bool):
+    asm = RTEMAssembler('s0', inputs=dict(AS=28, VS=29, AP=30, VP=31), peephole=peephole)
+    asm.parse_source(REPEATED_LINE)
+    return asm, asm.resolve()
+
+
+def test_repeated_line_reuses_the_stack():
+    _, plain = assemble(False)
+    asm, optimized = assemble(True)
+    assert asm.peephole_report.rules['repeated-push'].rewrites == 2
+    assert len(optimized.main_memory) == len(plain.main_memory) - 2
+
+    rng = random.Random(0)
+    trace = [rng.getrandbits(4) << 28 for _ in range(500)]
+    runs = [RTEMSimulator.from_result(result).run(trace) for result in (plain, optimized)]
+    assert runs[0].states == runs[1].states
+    assert runs[0].outputs == runs[1].outputs
@@ -0,0 +1,31 @@
+import pytest
+
+from src.helpers import ParsingException
+from src.main import RTEMAssembler
+from src.states import Commands
+
+parse = Commands.EDI.parse_stack_logic_expr
+
+
+@pytest.mark.parametrize('expr, lut', [
+    ('$0 & $1', 0b1000),
+    ('$0 & $1 ^ $1', 0b0000),
+    ('$0 | $1 ^ $1', 0b1010),
+    ('!$0 ^ $1', 0b1001),
+    ('~$0 & $1', 0b0100),
+    ('($0 & $1) ^ $1', 0b0100),
+])
+def test_edi_precedence(expr, lut):
+    assert parse(expr) == lut
+
+
+@pytest.mark.parametrize('source, message', [
+    ('.NextTrans\ns0:\n    BAD\n', 'Unknown instruction BAD at 3:5'),
+    ('.NextEdits\ns0:\n    PSH AS\n    EDI $0 & )\n', 'Unexpected ) at 4:14'),
+    ('.Constants\na=1\na=2\n', 'line 3: Duplicate constant declaration detected.'),
+])
+def test_errors_give_their_position_once(source, message):
+    asm = RTEMAssembler('s0', inputs=dict(AS=28))
+    with pytest.raises(ParsingException) as error:
+        asm.parse_source(source)
+    assert str(error.value) == message